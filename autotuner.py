@@ -0,0 +1,221 @@
+"""A search over Fhelipe layouts for the cheapest layout for a kernel.
+
+A layout of a tensor is an ordering of the bits of its axes, possibly with
+gap bits, where the leading bits select the ciphertext and the rest the
+slot (see fhelipe.Layout). The candidate bit orders are enumerated up to
+symmetries that do not change a kernel's cost:
+
+ - The bits of an axis appear in decreasing order, since permuting them
+   only renames the tensor indices held by the same set of slots.
+ - The ciphertext index bits appear in a canonical order, since permuting
+   them only reorders the ciphertexts, and are never gaps, since a gap there
+   only adds empty ciphertexts.
+
+Each candidate is scored by a kernel, which estimates the ops it needs on
+the layout, and the estimates are priced by a planner.CostModel. The
+candidates are split into chunks evaluated by a process pool.
+
+Example:
+
+    best = autotune((64, 64), num_slots=1024, kernel=AxisReduction(axis=1))
+    print(best[0].layout, best[0].estimate)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import heapq
+from itertools import combinations, islice
+from math import log2
+from typing import Callable, Iterator, Optional
+
+from fhelipe import AxisBit, AxisBitRange, GapBlock, Layout, is_power_of_two
+from planner import CostModel, Estimate
+
+# The label of a gap bit in a bit order.
+GAP = -1
+
+
+def _to_layout(labels: tuple[int, ...], shape, num_slots: int) -> Layout:
+    """Build the layout whose bits have the given axis labels (or GAP), with
+    the bits of each axis in decreasing order."""
+    remaining = [int(log2(dim)) for dim in shape]
+    entries = []
+    start = 0
+    while start < len(labels):
+        end = start
+        while end < len(labels) and labels[end] == labels[start]:
+            end += 1
+        # Split runs at the boundary between ciphertext and slot bits, so that
+        # each entry is either wholly a ciphertext index or wholly slots.
+        boundary = len(labels) - int(log2(num_slots))
+        if start < boundary < end:
+            end = boundary
+
+        axis, length = labels[start], end - start
+        if axis == GAP:
+            entries.append(GapBlock(length))
+        else:
+            high = remaining[axis] - 1
+            remaining[axis] -= length
+            entries.append(AxisBitRange(axis=axis, start=high, end=high - length + 1))
+        start = end
+    return Layout(entries, num_slots=num_slots)
+
+
+def _interleavings(counts: dict[int, int]) -> Iterator[tuple[int, ...]]:
+    """All distinct sequences with counts[label] copies of each label."""
+    labels = sorted(label for label, count in counts.items() if count)
+    if not labels:
+        yield ()
+        return
+    for label in labels:
+        counts[label] -= 1
+        for rest in _interleavings(counts):
+            yield (label,) + rest
+        counts[label] += 1
+
+
+def _multisets(counts: dict[int, int], size: int) -> Iterator[dict[int, int]]:
+    """All sub-multisets of counts of the given size."""
+    pool = [label for label in sorted(counts) for _ in range(counts[label])]
+    seen = set()
+    for chosen in combinations(pool, size):
+        if chosen not in seen:
+            seen.add(chosen)
+            yield {label: chosen.count(label) for label in set(chosen)}
+
+
+def candidate_bit_orders(shape, num_slots: int) -> Iterator[tuple[int, ...]]:
+    """Enumerate the axis labels of the bit orders of candidate layouts, most
+    significant bit first, up to the symmetries described above."""
+    for dim in shape:
+        assert is_power_of_two(dim), f"{dim=} is not a power of two"
+    assert is_power_of_two(num_slots), f"{num_slots=} is not a power of two"
+
+    data_counts = {axis: int(log2(dim)) for axis, dim in enumerate(shape)}
+    data_bits = sum(data_counts.values())
+    slot_bits = int(log2(num_slots))
+    ciphertext_bits = max(0, data_bits - slot_bits)
+    num_gaps = max(0, slot_bits - data_bits)
+
+    for ciphertext_counts in _multisets(data_counts, ciphertext_bits):
+        prefix = tuple(
+            label
+            for label in sorted(ciphertext_counts)
+            for _ in range(ciphertext_counts[label])
+        )
+        slot_counts = {
+            axis: count - ciphertext_counts.get(axis, 0)
+            for axis, count in data_counts.items()
+        }
+        slot_counts[GAP] = num_gaps
+        for suffix in _interleavings(slot_counts):
+            yield prefix + suffix
+
+
+@dataclass(frozen=True)
+class AxisReduction:
+    """The kernel multiplying two tensors in the same layout and summing the
+    product over an axis, e.g., a matrix-vector product for axis=1 with the
+    vector replicated along axis 0.
+
+    Bits of the summed axis in the ciphertext index are summed by adding
+    ciphertexts. Bits in the slots are summed by a rotation and addition
+    each, followed by a mask keeping a single copy of each sum.
+    """
+
+    axis: int
+
+    def __call__(self, layout: Layout, shape) -> Estimate:
+        bit_string = layout.bit_string()
+        num_ciphertext_bits = len(bit_string) - int(log2(layout.num_slots))
+        summed = [
+            isinstance(bit, AxisBit) and bit.axis == self.axis for bit in bit_string
+        ]
+        ciphertext_sums = sum(summed[:num_ciphertext_bits])
+        slot_sums = sum(summed[num_ciphertext_bits:])
+
+        num_ciphertexts = layout.num_ciphertexts
+        num_outputs = num_ciphertexts >> ciphertext_sums
+        masks = num_outputs if slot_sums else 0
+        used = sum(index is not None for index in layout.expand(shape))
+        return Estimate(
+            rotations=num_outputs * slot_sums,
+            ct_ct_multiplications=num_ciphertexts,
+            ct_pt_multiplications=masks,
+            additions=num_ciphertexts - num_outputs + num_outputs * slot_sums,
+            depth=2 if masks else 1,
+            slot_utilization=used / (num_ciphertexts * layout.num_slots),
+        )
+
+
+@dataclass(frozen=True)
+class TunedLayout:
+    layout: Layout
+    estimate: Estimate
+    cost: float
+
+
+def _top_k(
+    bit_orders: list[tuple[int, ...]],
+    shape,
+    num_slots: int,
+    kernel: Callable,
+    cost_model: CostModel,
+    k: int,
+) -> list[tuple[float, tuple[int, ...], Estimate]]:
+    """Score the bit orders, returning the k cheapest as (cost, labels,
+    estimate), so that ties are broken deterministically by the labels."""
+    scored = []
+    for labels in bit_orders:
+        estimate = kernel(_to_layout(labels, shape, num_slots), shape)
+        scored.append((cost_model.cost(estimate), labels, estimate))
+    return heapq.nsmallest(k, scored, key=lambda s: s[:2])
+
+
+def _chunks(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def autotune(
+    shape,
+    num_slots: int,
+    kernel: Callable = AxisReduction(axis=1),
+    cost_model: CostModel = CostModel(),
+    k: int = 5,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 256,
+) -> list[TunedLayout]:
+    """Return the k cheapest layouts of a tensor for a kernel, cheapest first.
+
+    Args:
+        shape: the shape of the tensor, whose dimensions are powers of two.
+        num_slots: the number of slots in a ciphertext.
+        kernel: a picklable function estimating the ops of the kernel on a
+            layout of a tensor of the given shape, called as
+            kernel(layout, shape) and returning a planner.Estimate.
+        cost_model: the relative costs used to rank the layouts.
+        k: the number of layouts to return.
+        max_workers: the number of worker processes. If 1, the search runs
+            in this process.
+        chunk_size: the number of candidates evaluated per task.
+    """
+    assert k > 0
+    chunks = _chunks(candidate_bit_orders(shape, num_slots), chunk_size)
+    args = (shape, num_slots, kernel, cost_model, k)
+    if max_workers == 1:
+        results = [_top_k(chunk, *args) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_top_k, chunk, *args) for chunk in chunks]
+            results = [future.result() for future in futures]
+
+    best = heapq.nsmallest(
+        k, (s for result in results for s in result), key=lambda s: s[:2]
+    )
+    return [
+        TunedLayout(_to_layout(labels, shape, num_slots), estimate, cost)
+        for cost, labels, estimate in best
+    ]
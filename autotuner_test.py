@@ -0,0 +1,68 @@
+from math import comb
+
+from autotuner import (
+    GAP,
+    AxisReduction,
+    autotune,
+    candidate_bit_orders,
+)
+from fhelipe import AxisBitRange, Layout
+from planner import CostModel
+
+
+def test_candidate_bit_orders():
+    orders = list(candidate_bit_orders((4, 4), num_slots=16))
+    # The interleavings of two bits of each axis.
+    assert len(orders) == comb(4, 2)
+    assert len(set(orders)) == len(orders)
+
+    # One ciphertext bit, which is either axis, and never a gap.
+    orders = list(candidate_bit_orders((4, 4), num_slots=8))
+    assert len(orders) == 2 * comb(3, 1)
+    assert {order[0] for order in orders} == {0, 1}
+
+    # Two gap bits among the slots.
+    orders = list(candidate_bit_orders((4,), num_slots=16))
+    assert len(orders) == comb(4, 2)
+    assert (0, GAP, 0, GAP) in orders
+
+
+def test_axis_reduction_cost():
+    kernel = AxisReduction(axis=1)
+    row_major = Layout(
+        [AxisBitRange.parse("d0[1:0]"), AxisBitRange.parse("d1[1:0]")]
+    )
+    estimate = kernel(row_major, (4, 4))
+    assert estimate.rotations == 2
+    assert estimate.ct_pt_multiplications == 1
+    assert estimate.depth == 2
+    assert estimate.slot_utilization == 1.0
+
+    # Summing over the ciphertext index needs no rotations.
+    split = Layout(
+        [AxisBitRange.parse("d1[1:0]"), AxisBitRange.parse("d0[1:0]")], num_slots=4
+    )
+    estimate = kernel(split, (4, 4))
+    assert estimate.rotations == 0
+    assert estimate.ct_ct_multiplications == 4
+    assert estimate.additions == 3
+    assert estimate.depth == 1
+
+
+def test_autotune():
+    best = autotune((8, 4), num_slots=8, k=3, max_workers=1)
+    assert len(best) == 3
+    assert [b.cost for b in best] == sorted(b.cost for b in best)
+    # Both bits of the summed axis go to the ciphertext index.
+    assert best[0].estimate.rotations == 0
+    assert str(best[0].layout).startswith("[d1[1:0:-1] d0")
+
+
+def test_autotune_in_parallel_matches_serial():
+    kwargs = dict(
+        shape=(8, 8), num_slots=16, k=4, cost_model=CostModel(depth=2.0)
+    )
+    serial = autotune(max_workers=1, **kwargs)
+    parallel = autotune(max_workers=2, chunk_size=8, **kwargs)
+    assert [str(t.layout) for t in serial] == [str(t.layout) for t in parallel]
+    assert [t.cost for t in serial] == [t.cost for t in parallel]
@@ -0,0 +1,461 @@
+"""Benchmarks comparing the packing schemes across problem sizes.
+
+Each benchmark packs its inputs (untimed, since packing happens on the
+client) and then runs the scheme's kernel, recording its wall time, peak
+memory, the simulated FHE op counts and the multiplicative depth of the
+result.
+
+Usage:
+
+    python benchmark.py --sizes 4 8 16 --num-slots 64 256 --output results.json
+    python benchmark.py --output results.json --baseline baseline.json
+
+When a baseline is given, the results are compared against it and the
+process exits with status 1 if any benchmark regressed. Use --save-baseline
+to store the current results as the new baseline.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+import bicyclic
+import halevi_shoup
+import im2col_convolution
+import siso_convolution
+from computational_model import Ciphertext, count_ops, is_power_of_two
+
+
+@dataclass
+class BenchmarkResult:
+    scheme: str
+    size: int
+    num_slots: int
+    wall_time_s: float
+    peak_memory_bytes: int
+    rotations: int
+    ct_ct_multiplications: int
+    ct_pt_multiplications: int
+    additions: int
+    depth: int
+
+    @property
+    def key(self) -> tuple[str, int, int]:
+        return (self.scheme, self.size, self.num_slots)
+
+
+@dataclass
+class Scheme:
+    """A benchmarkable packing scheme.
+
+    setup(size, num_slots, rng) packs random inputs of the given size and
+    returns (slots, kernel), where slots is the number of slots in the
+    ciphertexts actually used, and kernel runs the scheme on the packed
+    inputs and returns the resulting ciphertext(s). It returns None if the
+    scheme does not support the given size and slot count.
+
+    If uses_num_slots is False, the scheme's slot count is determined by
+    the problem size alone, and it is run once per size.
+
+    If first_layer_only is True, the scheme transforms its input in the
+    clear before encryption (see im2col_convolution), which is only possible
+    for the first layer of a network. Work moved to the client is not
+    counted, so its op counts are not comparable to those of other schemes.
+    """
+
+    name: str
+    setup: Callable[[int, int, random.Random], Optional[tuple[int, Callable]]]
+    uses_num_slots: bool = False
+    first_layer_only: bool = False
+
+
+def random_matrix(shape, rng, low=-10, high=10):
+    rows, cols = shape
+    return [[rng.randint(low, high) for _ in range(cols)] for _ in range(rows)]
+
+
+def random_vector(dim, rng, low=-10, high=10):
+    return [rng.randint(low, high) for _ in range(dim)]
+
+
+def setup_halevi_shoup_naive(size, num_slots, rng):
+    if not is_power_of_two(size):
+        return None
+    packed = halevi_shoup.pack_naive(random_matrix((size, size), rng))
+    vector = Ciphertext(random_vector(size, rng))
+    return size, lambda: halevi_shoup.matrix_vector_multiply_naive(packed, vector)
+
+
+def setup_halevi_shoup_naive_packed(size, num_slots, rng):
+    if not is_power_of_two(size) or num_slots < size or num_slots % size:
+        return None
+    if not is_power_of_two(num_slots // size):
+        return None
+    matrix, vector = random_matrix((size, size), rng), random_vector(size, rng)
+    packed = halevi_shoup.pack_naive_packed(matrix, num_slots)
+    vector = halevi_shoup.pack_vector_naive_packed(vector, num_slots)
+    return num_slots, lambda: halevi_shoup.matrix_vector_multiply_naive_packed(
+        packed, vector
+    )
+
+
+def setup_halevi_shoup_diagonal(size, num_slots, rng):
+    packed = halevi_shoup.pack(random_matrix((size, size), rng))
+    vector = Ciphertext(random_vector(size, rng))
+    return size, lambda: halevi_shoup.matrix_vector_multiply(packed, vector)
+
+
+def setup_halevi_shoup_replicated(size, num_slots, rng):
+    if not is_power_of_two(size):
+        return None
+    packed = halevi_shoup.pack_row_major(random_matrix((size, size), rng), size)
+    vector = halevi_shoup.pack_vector_compact(random_vector(size, rng), size)
+    return size * size, lambda: halevi_shoup.matrix_vector_multiply_replicated(
+        packed, vector
+    )
+
+
+def setup_halevi_shoup_squat(size, num_slots, rng):
+    if not (is_power_of_two(size) and is_power_of_two(num_slots)):
+        return None
+    if size >= num_slots:
+        return None
+    packed = halevi_shoup.pack_squat(random_matrix((size, num_slots), rng))
+    vector = Ciphertext(random_vector(num_slots, rng))
+    return num_slots, lambda: halevi_shoup.matrix_vector_multiply_squat(
+        packed, vector
+    )
+
+
+def setup_halevi_shoup_blocked(size, num_slots, rng):
+    packed = halevi_shoup.pack_blocked(random_matrix((size, size), rng), num_slots)
+    block_size = len(packed[0][0][0])
+    vector = halevi_shoup.pack_vector_blocked(random_vector(size, rng), block_size)
+    return num_slots, lambda: halevi_shoup.matrix_vector_multiply_blocked(
+        packed, vector
+    )
+
+
+def setup_halevi_shoup_matmul(size, num_slots, rng):
+    plaintexts = halevi_shoup.prepare_matrix_multiply(size)
+    a = halevi_shoup.pack_row_major(random_matrix((size, size), rng), size)
+    b = halevi_shoup.pack_row_major(random_matrix((size, size), rng), size)
+    return size * size, lambda: halevi_shoup.matrix_multiply(a, b, plaintexts)
+
+
+def setup_bicyclic_matmul(size, num_slots, rng):
+    # For even size, (size - 1, size, size + 1) are pairwise coprime.
+    if size % 2:
+        return None
+    m, n, p = size - 1, size, size + 1
+    slots = m * n * p
+    a = bicyclic.pack(random_matrix((m, n), rng), slots)
+    b = bicyclic.pack(random_matrix((n, p), rng), slots)
+    return slots, lambda: bicyclic.matrix_multiply(a, b, m, n, p)
+
+
+def setup_siso_convolution(size, num_slots, rng, filter_size=3, pad=1):
+    if not is_power_of_two(size) or size < filter_size:
+        return None
+    matrix = random_matrix((size, size), rng)
+    filter = random_matrix((filter_size, filter_size), rng)
+    packed = siso_convolution.pack_rowwise(matrix)
+    filters = siso_convolution.prepare_filters((size, size), filter, pad)
+    return size * size, lambda: siso_convolution.siso_convolution(
+        packed, (size, size), filters, pad=pad
+    )
+
+
+def setup_toeplitz_diagonal(size, num_slots, rng, filter_size=3, pad=1):
+    if size < filter_size:
+        return None
+    matrix_shape = (size, size)
+    matrix = random_matrix(matrix_shape, rng)
+    filter = random_matrix((filter_size, filter_size), rng)
+    packed_filter = im2col_convolution.pack_toeplitz_diagonal(filter, matrix_shape, pad)
+    packed_input = im2col_convolution.pack_input(matrix, len(packed_filter))
+    return len(packed_input), lambda: halevi_shoup.matrix_vector_multiply(
+        packed_filter, packed_input
+    )
+
+
+def setup_toeplitz_bicyclic(size, num_slots, rng, filter_size=3, pad=1):
+    if size < filter_size:
+        return None
+    matrix_shape, filter_shape = (size, size), (filter_size, filter_size)
+    matrix = random_matrix(matrix_shape, rng)
+    filter = random_matrix(filter_shape, rng)
+    rows, cols = im2col_convolution.toeplitz_bicyclic_shape(
+        matrix_shape, filter_shape, pad
+    )
+    packed_filter = im2col_convolution.pack_toeplitz_bicyclic(filter, matrix_shape, pad)
+    packed_input = im2col_convolution.pack_input(matrix, rows * cols)
+    return rows * cols, lambda: im2col_convolution.convolve_toeplitz_bicyclic(
+        packed_filter, packed_input, matrix_shape, filter_shape, pad
+    )
+
+
+def setup_im2col_diagonal(size, num_slots, rng, filter_size=3, pad=1):
+    if size < filter_size:
+        return None
+    matrix_shape, filter_shape = (size, size), (filter_size, filter_size)
+    matrix = random_matrix(matrix_shape, rng)
+    filter = random_matrix(filter_shape, rng)
+    try:
+        packed = im2col_convolution.pack_diagonal(matrix, filter_shape, pad, num_slots)
+    except ValueError:
+        return None
+    filters = im2col_convolution.prepare_filter_diagonal(
+        filter, matrix_shape, pad, num_slots
+    )
+    return len(packed[0]), lambda: im2col_convolution.convolve_diagonal(
+        packed, filters, matrix_shape, filter_shape, pad
+    )
+
+
+def setup_im2col_bicyclic(size, num_slots, rng, filter_size=3, pad=1):
+    if size < filter_size:
+        return None
+    matrix_shape, filter_shape = (size, size), (filter_size, filter_size)
+    matrix = random_matrix(matrix_shape, rng)
+    filter = random_matrix(filter_shape, rng)
+    packed = im2col_convolution.pack_bicyclic(matrix, filter_shape, pad)
+    filters = im2col_convolution.prepare_filter_bicyclic(filter, matrix_shape, pad)
+    return len(packed), lambda: im2col_convolution.convolve_bicyclic(
+        packed, filters, matrix_shape, filter_shape, pad
+    )
+
+
+SCHEMES = [
+    Scheme("halevi_shoup_naive", setup_halevi_shoup_naive),
+    Scheme(
+        "halevi_shoup_naive_packed",
+        setup_halevi_shoup_naive_packed,
+        uses_num_slots=True,
+    ),
+    Scheme("halevi_shoup_diagonal", setup_halevi_shoup_diagonal),
+    Scheme("halevi_shoup_replicated", setup_halevi_shoup_replicated),
+    Scheme("halevi_shoup_squat", setup_halevi_shoup_squat, uses_num_slots=True),
+    Scheme("halevi_shoup_blocked", setup_halevi_shoup_blocked, uses_num_slots=True),
+    Scheme("halevi_shoup_matmul", setup_halevi_shoup_matmul),
+    Scheme("bicyclic_matmul", setup_bicyclic_matmul),
+    Scheme("siso_convolution", setup_siso_convolution),
+    Scheme("toeplitz_diagonal", setup_toeplitz_diagonal),
+    Scheme("toeplitz_bicyclic", setup_toeplitz_bicyclic),
+    Scheme(
+        "im2col_diagonal",
+        setup_im2col_diagonal,
+        uses_num_slots=True,
+        first_layer_only=True,
+    ),
+    Scheme("im2col_bicyclic", setup_im2col_bicyclic, first_layer_only=True),
+]
+
+
+def _max_depth(result) -> int:
+    if isinstance(result, Ciphertext):
+        return result.depth
+    return max(_max_depth(x) for x in result)
+
+
+def run_benchmark(
+    scheme: Scheme, size: int, num_slots: int, repeat: int = 3, seed: int = 0
+) -> Optional[BenchmarkResult]:
+    """Run a single benchmark, returning None if the scheme does not support
+    the given size and slot count."""
+    setup = scheme.setup(size, num_slots, random.Random(seed))
+    if setup is None:
+        return None
+    slots, kernel = setup
+
+    with count_ops() as counts:
+        result = kernel()
+
+    tracemalloc.start()
+    try:
+        kernel()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    wall_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kernel()
+        wall_time = min(wall_time, time.perf_counter() - start)
+
+    return BenchmarkResult(
+        scheme=scheme.name,
+        size=size,
+        num_slots=slots,
+        wall_time_s=wall_time,
+        peak_memory_bytes=peak_memory,
+        rotations=counts.rotations,
+        ct_ct_multiplications=counts.ct_ct_multiplications,
+        ct_pt_multiplications=counts.ct_pt_multiplications,
+        additions=counts.additions,
+        depth=_max_depth(result),
+    )
+
+
+def run_suite(
+    sizes: list[int],
+    num_slots: list[int],
+    schemes: Optional[list[Scheme]] = None,
+    repeat: int = 3,
+    seed: int = 0,
+) -> list[BenchmarkResult]:
+    """Run the given schemes (by default, all of SCHEMES) over the given
+    problem sizes and slot counts."""
+    if schemes is None:
+        schemes = SCHEMES
+    results = []
+    for scheme in schemes:
+        for size in sizes:
+            slot_counts = num_slots if scheme.uses_num_slots else num_slots[:1]
+            for slots in slot_counts:
+                result = run_benchmark(scheme, size, slots, repeat=repeat, seed=seed)
+                if result is not None:
+                    results.append(result)
+    return results
+
+
+def save_results(results: list[BenchmarkResult], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+
+
+def load_results(path: str) -> list[BenchmarkResult]:
+    with open(path) as f:
+        return [BenchmarkResult(**entry) for entry in json.load(f)]
+
+
+# Metrics that are deterministic, and regress on any increase.
+EXACT_METRICS = [
+    "rotations",
+    "ct_ct_multiplications",
+    "ct_pt_multiplications",
+    "additions",
+    "depth",
+]
+
+# Metrics that are noisy, and regress only on an increase beyond a tolerance.
+NOISY_METRICS = ["wall_time_s", "peak_memory_bytes"]
+
+
+def compare(
+    results: list[BenchmarkResult],
+    baseline: list[BenchmarkResult],
+    tolerance: float = 0.25,
+) -> list[str]:
+    """Compare results against a baseline, returning a description of each
+    regression found. Benchmarks missing from the baseline are ignored."""
+    baseline_by_key = {result.key: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_key.get(result.key)
+        if old is None:
+            continue
+
+        for metric in EXACT_METRICS + NOISY_METRICS:
+            new_value, old_value = getattr(result, metric), getattr(old, metric)
+            limit = old_value
+            if metric in NOISY_METRICS:
+                limit = old_value * (1 + tolerance)
+            if new_value > limit:
+                regressions.append(
+                    f"{result.scheme} (size={result.size}, "
+                    f"num_slots={result.num_slots}): {metric} regressed "
+                    f"from {old_value} to {new_value}"
+                )
+
+    return regressions
+
+
+def format_table(results: list[BenchmarkResult]) -> str:
+    """Format the results as a table. Schemes only applicable to a first
+    layer are marked with a *."""
+    first_layer_only = {scheme.name for scheme in SCHEMES if scheme.first_layer_only}
+    header = (
+        f"{'scheme':<28}{'size':>6}{'slots':>8}{'time (ms)':>12}{'peak KiB':>10}"
+        f"{'rot':>8}{'ct*ct':>8}{'ct*pt':>8}{'add':>8}{'depth':>7}"
+    )
+    lines = [header]
+    for r in results:
+        name = r.scheme + ("*" if r.scheme in first_layer_only else "")
+        lines.append(
+            f"{name:<28}{r.size:>6}{r.num_slots:>8}"
+            f"{r.wall_time_s * 1000:>12.3f}{r.peak_memory_bytes / 1024:>10.1f}"
+            f"{r.rotations:>8}{r.ct_ct_multiplications:>8}"
+            f"{r.ct_pt_multiplications:>8}{r.additions:>8}{r.depth:>7}"
+        )
+    if any(r.scheme in first_layer_only for r in results):
+        lines.append(
+            "* First layer only: the input is lowered on the client before "
+            "encryption, and that work is not counted."
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--num-slots", type=int, nargs="+", default=[64, 256])
+    parser.add_argument(
+        "--schemes",
+        nargs="+",
+        choices=[scheme.name for scheme in SCHEMES],
+        help="Schemes to run (default: all)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path to write the results as JSON")
+    parser.add_argument("--baseline", help="Path of a baseline to compare against")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Write the results to the --baseline path instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative increase in wall time and memory",
+    )
+    args = parser.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline requires --baseline")
+
+    schemes = SCHEMES
+    if args.schemes:
+        schemes = [scheme for scheme in SCHEMES if scheme.name in args.schemes]
+
+    results = run_suite(
+        args.sizes, args.num_slots, schemes=schemes, repeat=args.repeat, seed=args.seed
+    )
+    print(format_table(results))
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.baseline:
+        if args.save_baseline:
+            save_results(results, args.baseline)
+            return 0
+
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from benchmark import (
+    SCHEMES,
+    BenchmarkResult,
+    compare,
+    format_table,
+    load_results,
+    main,
+    run_suite,
+    save_results,
+)
+
+
+def make_result(**kwargs):
+    fields = dict(
+        scheme="halevi_shoup_diagonal",
+        size=4,
+        num_slots=4,
+        wall_time_s=1.0,
+        peak_memory_bytes=1000,
+        rotations=3,
+        ct_ct_multiplications=4,
+        ct_pt_multiplications=0,
+        additions=3,
+        depth=1,
+    )
+    fields.update(kwargs)
+    return BenchmarkResult(**fields)
+
+
+def test_run_suite_covers_every_scheme():
+    results = run_suite(sizes=[4], num_slots=[16], repeat=1)
+    assert {result.scheme for result in results} == {
+        scheme.name for scheme in SCHEMES
+    }
+    assert len({result.key for result in results}) == len(results)
+
+
+def test_run_suite_op_counts():
+    results = run_suite(sizes=[8], num_slots=[64], repeat=1)
+    by_scheme = {result.scheme: result for result in results}
+
+    diagonal = by_scheme["halevi_shoup_diagonal"]
+    assert diagonal.rotations == 7
+    assert diagonal.ct_ct_multiplications == 8
+    assert diagonal.depth == 1
+
+    naive = by_scheme["halevi_shoup_naive"]
+    assert naive.rotations == 8 * 3
+    assert naive.depth == 2
+
+
+def test_compare_flags_regressions():
+    baseline = [make_result()]
+    assert compare([make_result(wall_time_s=1.1)], baseline) == []
+
+    regressions = compare([make_result(wall_time_s=2.0, rotations=4)], baseline)
+    assert len(regressions) == 2
+    assert "rotations regressed from 3 to 4" in regressions[0]
+    assert "wall_time_s" in regressions[1]
+
+    # Benchmarks absent from the baseline are not regressions.
+    assert compare([make_result(size=8, rotations=100)], baseline) == []
+
+
+def test_save_and_load_results(tmp_path):
+    path = tmp_path / "results.json"
+    results = [make_result(), make_result(scheme="siso_convolution")]
+    save_results(results, path)
+    assert load_results(path) == results
+    assert json.loads(path.read_text())[1]["scheme"] == "siso_convolution"
+
+
+def test_main_baseline_roundtrip(tmp_path):
+    baseline = str(tmp_path / "baseline.json")
+    args = ["--sizes", "4", "--num-slots", "16", "--repeat", "1"]
+    args += ["--schemes", "halevi_shoup_diagonal", "--baseline", baseline]
+    assert main(args + ["--save-baseline"]) == 0
+
+    # Make the stored baseline better than anything achievable.
+    results = load_results(baseline)
+    for result in results:
+        result.rotations = 0
+    save_results(results, baseline)
+    assert main(args) == 1
+
+
+def test_main_save_baseline_requires_baseline():
+    with pytest.raises(SystemExit):
+        main(["--sizes", "4", "--repeat", "1", "--save-baseline"])
+
+
+def test_format_table_marks_first_layer_schemes():
+    table = format_table(
+        [
+            make_result(),
+            make_result(scheme="im2col_diagonal", num_slots=64),
+            make_result(scheme="toeplitz_diagonal", num_slots=64),
+        ]
+    )
+    lines = table.splitlines()
+    assert lines[1].startswith("halevi_shoup_diagonal ")
+    assert lines[2].startswith("im2col_diagonal* ")
+    assert lines[3].startswith("toeplitz_diagonal ")
+    assert lines[-1].startswith("* First layer only")
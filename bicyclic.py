@@ -8,7 +8,8 @@ https://eprint.iacr.org/2024/1762
 
 from math import gcd, ceil
 
-from computational_model import Ciphertext
+from computational_model import Ciphertext, mac, zeros_like
+from profiling import profiled, span
 
 
 def pairwise_coprime(*args: int) -> bool:
@@ -20,6 +21,7 @@ def pairwise_coprime(*args: int) -> bool:
     return True
 
 
+@profiled()
 def pack(matrix: list[list[int]], num_slots: int) -> Ciphertext:
     """
     Encode a matrix using bicyclic encoding.
@@ -45,6 +47,7 @@ def pack(matrix: list[list[int]], num_slots: int) -> Ciphertext:
     return Ciphertext(data)
 
 
+@profiled()
 def unpack(encoded: Ciphertext, m: int, n: int) -> list[list[int]]:
     """
     Decode a bicyclically encoded vector back to a matrix.
@@ -70,6 +73,16 @@ def unpack(encoded: Ciphertext, m: int, n: int) -> list[list[int]]:
     return matrix
 
 
+def rotation_amounts(m: int, n: int, p: int) -> list[tuple[int, int]]:
+    """The rotations of A and B used by each of the n steps of BMM-I."""
+    r = ceil(n / m)
+    while (r*n - m) % p != 0:
+        r += 1
+
+    return [((-i * m) % (m*n), (i * (r*n - m)) % (n*p)) for i in range(n)]
+
+
+@profiled()
 def matrix_multiply(
     packed_matrix_a: Ciphertext, packed_matrix_b: Ciphertext, m: int, n: int, p: int
 ) -> Ciphertext:
@@ -86,21 +99,13 @@ def matrix_multiply(
         packed_matrix_b
     ), "Both ciphertexts must have the same number of slots"
 
-    result = Ciphertext([0] * len(packed_matrix_a))
-    print(f"m={m}, n={n}, p={p}")
+    result = zeros_like(packed_matrix_a)
 
-    r = ceil(n / m)
-    while (r*n - m) % p != 0:
-        r += 1
-    print(f"Using r = {r} for BMM-I")
-
-    for i in range(n):
-        a_rot = (-i * m) % (m*n)
-        b_rot = (i * (r*n - m)) % (n*p)
-        rotated_a = packed_matrix_a.rotate(a_rot)
-        rotated_b = packed_matrix_b.rotate(b_rot)
-        prod = (rotated_a * rotated_b)
-        print(f"step={i}, i_a={a_rot}, i_b={b_rot}, rotated_a={rotated_a}, rotated_b={rotated_b}, prod={prod}")
-        result += prod
+    for a_rot, b_rot in rotation_amounts(m, n, p):
+        with span("rotate"):
+            rotated_a = packed_matrix_a.rotate(a_rot)
+            rotated_b = packed_matrix_b.rotate(b_rot)
+        with span("multiply_accumulate"):
+            result = mac(result, rotated_a, rotated_b)
 
     return result
@@ -3,6 +3,7 @@ from hypothesis.strategies import composite, integers, lists
 import math
 import pytest
 
+from computational_model import plaintext_modulus
 from bicyclic import (
     matrix_multiply,
     pack,
@@ -167,3 +168,27 @@ def test_free_transpose_property():
     encoded_original = pack(matrix, 15)
     encoded_transpose = pack(transpose, 15)
     assert encoded_original == encoded_transpose
+
+
+def test_matrix_multiply_plaintext_modulus():
+    t = 257
+    A = [[i * 5 + j for j in range(5)] for i in range(3)]
+    B = [[i * 2 + j for j in range(2)] for i in range(5)]
+    with plaintext_modulus(t):
+        result = matrix_multiply(pack(A, 30), pack(B, 30), 3, 5, 2)
+    expected = naive_matrix_multiply(A, B)
+    assert unpack(result, 3, 2) == [[x % t for x in row] for row in expected]
+
+
+def test_matrix_multiply_outside_plaintext_modulus_context():
+    # The modulus is a property of the packed ciphertexts, not of the context
+    # the kernel runs in.
+    t = 257
+    A = [[i * 5 + j for j in range(5)] for i in range(3)]
+    B = [[i * 2 + j for j in range(2)] for i in range(5)]
+    with plaintext_modulus(t):
+        packed_a, packed_b = pack(A, 30), pack(B, 30)
+    result = matrix_multiply(packed_a, packed_b, 3, 5, 2)
+    assert result.modulus == t
+    expected = naive_matrix_multiply(A, B)
+    assert unpack(result, 3, 2) == [[x % t for x in row] for row in expected]
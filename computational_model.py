@@ -1,51 +1,530 @@
 """The arithmetic/SIMD model of FHE."""
 
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import chain, islice
+import os
+import sys
+
+from profiling import profiled
+
+
+@dataclass
+class OpCounts:
+    """Counts of the FHE operations performed on ciphertexts."""
+
+    rotations: int = 0
+    ct_ct_multiplications: int = 0
+    ct_pt_multiplications: int = 0
+    additions: int = 0
+    # The number of rotations by each amount, normalized to [0, dim).
+    rotation_amounts: Counter = field(default_factory=Counter)
+
+
+# The OpCounts of each active count_ops context.
+_active_counts: list[OpCounts] = []
+
+
+def _record(op: str) -> None:
+    for counts in _active_counts:
+        setattr(counts, op, getattr(counts, op) + 1)
+
+
+def _record_rotation(amount: int) -> None:
+    for counts in _active_counts:
+        counts.rotations += 1
+        counts.rotation_amounts[amount] += 1
+
+
+def record_counts(counts: OpCounts) -> None:
+    """Record ops counted elsewhere, e.g., in another process, in the active
+    count_ops contexts."""
+    for active in _active_counts:
+        active.rotations += counts.rotations
+        active.ct_ct_multiplications += counts.ct_ct_multiplications
+        active.ct_pt_multiplications += counts.ct_pt_multiplications
+        active.additions += counts.additions
+        active.rotation_amounts.update(counts.rotation_amounts)
+
+
+@contextmanager
+def count_ops():
+    """Count the ciphertext operations performed within the context.
+
+    Example:
+        with count_ops() as counts:
+            matrix_vector_multiply(packed_matrix, vector)
+        print(counts.rotations)
+    """
+    counts = OpCounts()
+    _active_counts.append(counts)
+    try:
+        yield counts
+    finally:
+        _active_counts.remove(counts)
+
+
+# The plaintext modulus of the active plaintext_modulus context, if any.
+_plaintext_modulus = None
+
+# The largest supported plaintext modulus, so that residues fit in a uint64.
+MAX_PLAINTEXT_MODULUS = 1 << 64
+
+
+@contextmanager
+def plaintext_modulus(t: int):
+    """Reduce all slot arithmetic of ciphertexts created within the context
+    modulo t, as in BFV and BGV.
+
+    Ciphertexts created in the context (including by the packing functions)
+    store their slot values as residues in [0, t), and all operations on
+    them reduce their results mod t, so values wrap around rather than grow
+    without bound. Use centered() to decode residues as signed integers.
+    """
+    global _plaintext_modulus
+    assert 2 <= t <= MAX_PLAINTEXT_MODULUS, f"{t=} must fit in 64 bits"
+    previous = _plaintext_modulus
+    _plaintext_modulus = t
+    try:
+        yield
+    finally:
+        _plaintext_modulus = previous
+
+
+def centered(values: list[int], t: int) -> list[int]:
+    """Map residues mod t to their representatives in (-t/2, t/2]."""
+    half = t // 2
+    return [x - t if x > half else x for x in values]
+
+
+def _common_modulus(a: "Ciphertext", b) -> int:
+    if isinstance(b, Ciphertext):
+        assert a.modulus == b.modulus, f"{a.modulus=} != {b.modulus=}"
+    return a.modulus
+
+
+@dataclass
+class BootstrapEvent:
+    """A ciphertext bootstrapped because a multiplication needed a level."""
+
+    # The file, line and function of the multiplication, e.g.,
+    # "halevi_shoup.py:43 (matrix_vector_multiply_naive)".
+    site: str
+    # The multiplicative depth of the ciphertext when it was bootstrapped.
+    depth: int
+
+
+@dataclass
+class LevelReport:
+    """The level consumption of the computation within a level_budget."""
+
+    # The level of freshly encrypted ciphertexts.
+    levels: int
+    # The level of a ciphertext after bootstrapping. Bootstrapping itself
+    # consumes levels, so this is typically lower than levels.
+    bootstrap_level: int
+    # The cost of a bootstrap, relative to a rotation.
+    bootstrap_cost: float
+    bootstraps: list[BootstrapEvent] = field(default_factory=list)
+    # The number of additions whose operands were at different levels, so that
+    # the higher one was brought down (modulus switched) to the lower one.
+    level_alignments: int = 0
+    # The lowest level reached by any ciphertext.
+    min_level: int = None
+
+    @property
+    def num_bootstraps(self) -> int:
+        return len(self.bootstraps)
+
+    @property
+    def total_bootstrap_cost(self) -> float:
+        return self.bootstrap_cost * self.num_bootstraps
+
+    def sites(self) -> Counter:
+        """The number of bootstraps at each site."""
+        return Counter(event.site for event in self.bootstraps)
+
+
+# The LevelReport of the active level_budget context, if any.
+_level_report = None
+
+
+@contextmanager
+def level_budget(levels: int, bootstrap_level: int = None, bootstrap_cost=100.0):
+    """Simulate the modulus chain of a leveled scheme such as CKKS.
+
+    Ciphertexts created within the context start at the given number of
+    levels, and each multiplication adding to the multiplicative depth (by a
+    ciphertext or a plaintext vector, but not a scalar) consumes one level.
+    The rescale after each multiplication keeps the scale of every ciphertext
+    at the same nominal value, so the level alone determines the state of a
+    ciphertext. Adding ciphertexts at different levels brings the result down
+    to the lower level.
+
+    A multiplication of a ciphertext with no levels left first bootstraps it
+    to bootstrap_level (by default, levels), in place, so that later uses of
+    the same ciphertext, including by the caller, see the bootstrapped level.
+    The yielded LevelReport records where bootstrapping was needed and its
+    estimated cost.
+
+    Example:
+        with level_budget(levels=1) as report:
+            matrix_vector_multiply_naive(packed_matrix, vector)
+        print(report.num_bootstraps, report.sites())
+    """
+    global _level_report
+    if bootstrap_level is None:
+        bootstrap_level = levels
+    assert 0 < bootstrap_level <= levels, f"{bootstrap_level=} {levels=}"
+    previous = _level_report
+    _level_report = LevelReport(levels, bootstrap_level, bootstrap_cost)
+    try:
+        yield _level_report
+    finally:
+        _level_report = previous
+
+
+def _caller_site() -> str:
+    """The site of the innermost call from outside this module."""
+    frame = sys._getframe(1)
+    while frame.f_globals.get("__name__") == __name__:
+        frame = frame.f_back
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} ({code.co_name})"
+
+
+def _align_levels(*levels: int) -> int:
+    """The level of the result of adding ciphertexts at the given levels,
+    which may be None if levels are not tracked."""
+    tracked = [level for level in levels if level is not None]
+    if not tracked:
+        return None
+    if _level_report is not None and len(set(tracked)) > 1:
+        _level_report.level_alignments += 1
+    return min(tracked)
+
+
+def _consume_level(*operands: "Ciphertext") -> int:
+    """The level of the product of the operands, which consumes one level,
+    after bootstrapping any operand with no levels left.
+
+    Bootstrapping sets the level of the operand itself, which may be owned by
+    the caller. This models reusing the bootstrapped ciphertext, so that a
+    ciphertext multiplied several times is bootstrapped only once.
+    """
+    report = _level_report
+    if report is None:
+        return None
+    for operand in operands:
+        if operand.level == 0:
+            report.bootstraps.append(BootstrapEvent(_caller_site(), operand.depth))
+            operand.level = report.bootstrap_level
+    level = _align_levels(*(operand.level for operand in operands))
+    if level is None:
+        return None
+    level -= 1
+    if report.min_level is None or level < report.min_level:
+        report.min_level = level
+    return level
+
+
+# Slot-wise arithmetic, reduced mod t unless t is None.
+
+
+def _add_slots(xs, ys, t):
+    if t is None:
+        return [x + y for (x, y) in zip(xs, ys)]
+    return [(x + y) % t for (x, y) in zip(xs, ys)]
+
+
+def _shift_slots(c, xs, t):
+    if t is None:
+        return [x + c for x in xs]
+    return [(x + c) % t for x in xs]
+
+
+def _mul_slots(xs, ys, t):
+    if t is None:
+        return [x * y for (x, y) in zip(xs, ys)]
+    return [(x * y) % t for (x, y) in zip(xs, ys)]
+
+
+def _scale_slots(c, xs, t):
+    if t is None:
+        return [c * x for x in xs]
+    return [(c * x) % t for x in xs]
+
+
+def _mac_slots(accs, xs, ys, t):
+    """Compute accs[i] += xs[i] * ys[i] in place, for iterables xs and ys."""
+    if t is None:
+        for i, x, y in zip(range(len(accs)), xs, ys):
+            accs[i] += x * y
+    else:
+        for i, x, y in zip(range(len(accs)), xs, ys):
+            accs[i] = (accs[i] + x * y) % t
+
+
+def _scale_mac_slots(accs, c, xs, t):
+    """Compute accs[i] += c * xs[i] in place, for an iterable xs."""
+    if t is None:
+        for i, x in zip(range(len(accs)), xs):
+            accs[i] += c * x
+    else:
+        for i, x in zip(range(len(accs)), xs):
+            accs[i] = (accs[i] + c * x) % t
+
 
 class Ciphertext:
-    def __init__(self, data: list[int], original_shape: tuple[int, int] = None):
-        self.data = data[:]
+    """A ciphertext, modeled by its slot values.
+
+    Rotation is O(1): the rotated ciphertext is a view sharing the slot buffer
+    of its input, with the rotation stored as an offset. Chained rotations
+    only compose their offsets, and the next operation reading a view applies
+    its offset with a single copy of the buffer. Accessing .data materializes
+    the view. In-place operations copy a shared buffer before writing it
+    (copy-on-write).
+    """
+
+    __slots__ = (
+        "_buffer",
+        "_offset",
+        "_shared",
+        "dim",
+        "original_shape",
+        "depth",
+        "modulus",
+        "level",
+    )
+
+    def __init__(
+        self,
+        data: list[int],
+        original_shape: tuple[int, int] = None,
+        depth: int = 0,
+        modulus: int = None,
+        level: int = None,
+    ):
+        # The plaintext modulus, or None for unbounded integer arithmetic.
+        # Defaults to that of the active plaintext_modulus context.
+        self.modulus = modulus if modulus is not None else _plaintext_modulus
+        if self.modulus is None:
+            self._buffer = data[:]
+        else:
+            self._buffer = [x % self.modulus for x in data]
+        # Slot i holds _buffer[(i - _offset) % dim].
+        self._offset = 0
+        # Whether _buffer may be shared with other ciphertexts.
+        self._shared = False
         self.dim = len(data)
         self.original_shape = original_shape
+        # The multiplicative depth of the computation producing this
+        # ciphertext. Plaintext-ciphertext multiplications by a vector count
+        # toward the depth (they require a rescale in CKKS), while scalar
+        # multiplications do not.
+        self.depth = depth
+        # The number of multiplications the ciphertext can undergo before it
+        # must be bootstrapped, or None if levels are not tracked. Defaults to
+        # the fresh level of the active level_budget context.
+        if level is None and _level_report is not None:
+            level = _level_report.levels
+        self.level = level
+
+    @classmethod
+    def _wrap(
+        cls,
+        data: list[int],
+        original_shape: tuple[int, int],
+        depth: int,
+        modulus: int,
+        level: int,
+    ) -> "Ciphertext":
+        """Create a ciphertext taking ownership of data, without copying or
+        reducing it."""
+        result = cls.__new__(cls)
+        result._buffer = data
+        result._offset = 0
+        result._shared = False
+        result.dim = len(data)
+        result.original_shape = original_shape
+        result.depth = depth
+        result.modulus = modulus
+        result.level = level
+        return result
+
+    @property
+    def data(self) -> list[int]:
+        """The slot values, materializing a rotation view if needed.
+
+        The caller may mutate the returned list, so a buffer shared with other
+        ciphertexts is copied first.
+        """
+        return self._own()
+
+    @data.setter
+    def data(self, data: list[int]) -> None:
+        self._buffer = data
+        self._offset = 0
+        self._shared = False
+        self.dim = len(data)
+
+    def _slots(self, shift: int = 0) -> list[int]:
+        """The slot values of self.rotate(shift), for reading only.
+
+        This is the buffer itself if it is not rotated. Otherwise, the offset
+        is applied by a single copy of the buffer into a new list, which is
+        much faster than iterating over the rotated slots in Python.
+        """
+        k = (self._offset + shift) % self.dim
+        if k == 0:
+            return self._buffer
+        # Slot i holds _buffer[i - k], i.e., the last k entries then the rest.
+        buffer, start = self._buffer, self.dim - k
+        return buffer[start:] + buffer[:start]
+
+    def _iter_slots(self, shift: int = 0):
+        """Iterate over the slot values of self.rotate(shift), without
+        copying the buffer."""
+        k = (self._offset + shift) % self.dim
+        if k == 0:
+            return iter(self._buffer)
+        buffer, start = self._buffer, self.dim - k
+        return chain(islice(buffer, start, None), islice(buffer, start))
+
+    def _own(self) -> list[int]:
+        """Return the buffer for writing in place, copying it first if it is
+        shared or rotated."""
+        if self._offset or self._shared:
+            slots = self._slots()
+            self._buffer = slots[:] if slots is self._buffer else slots
+            self._offset = 0
+            self._shared = False
+        return self._buffer
+
+    def _assign(self, values: list[int]) -> None:
+        """Replace the slot values in place, copying on write if the buffer
+        is shared or rotated."""
+        if self._offset or self._shared:
+            self._buffer = values
+            self._offset = 0
+            self._shared = False
+        else:
+            self._buffer[:] = values
 
     def __len__(self) -> int:
         return self.dim
 
     def __eq__(self, other: "Ciphertext") -> bool:
-        return self.data == other.data
+        if self.dim != other.dim:
+            return False
+        if self._buffer is other._buffer and self._offset == other._offset:
+            return True
+        return self._slots() == other._slots()
 
     def __add__(self, other: "Ciphertext") -> "Ciphertext":
+        if isinstance(other, int):
+            # Plaintext-ciphertext addition of a constant to every slot
+            _record("additions")
+            return Ciphertext._wrap(
+                _shift_slots(other, self._slots(), self.modulus),
+                self.original_shape,
+                self.depth,
+                self.modulus,
+                self.level,
+            )
+        if not isinstance(other, Ciphertext):
+            return NotImplemented
         assert self.dim == other.dim
-        return Ciphertext(
-            [self.data[i] + other.data[i] for i in range(len(self.data))],
-            original_shape=self.original_shape,
+        _record("additions")
+        t = _common_modulus(self, other)
+        return Ciphertext._wrap(
+            _add_slots(self._slots(), other._slots(), t),
+            self.original_shape,
+            max(self.depth, other.depth),
+            t,
+            _align_levels(self.level, other.level),
         )
 
-    def __mul__(self, other) -> "Ciphertext":
+    def __radd__(self, other: int) -> "Ciphertext":
+        return self.__add__(other)
+
+    def __iadd__(self, other: "Ciphertext") -> "Ciphertext":
+        if not isinstance(other, Ciphertext):
+            return NotImplemented
+        assert self.dim == other.dim
+        _record("additions")
+        t = _common_modulus(self, other)
+        self._assign(_add_slots(self._slots(), other._slots(), t))
+        self.depth = max(self.depth, other.depth)
+        self.level = _align_levels(self.level, other.level)
+        return self
+
+    def _check_multiplicand(self, other) -> tuple[str, int]:
+        """Check other can be multiplied by self, and return the kind of
+        multiplication and the depth of its result. The kind is None if other
+        is not a supported multiplicand."""
         if isinstance(other, Ciphertext):
             assert self.dim == other.dim
-            return Ciphertext(
-                [self.data[i] * other.data[i] for i in range(len(self.data))],
-                original_shape=self.original_shape,
-            )
-        elif isinstance(other, list):
+            _common_modulus(self, other)
+            return "ct_ct_multiplications", max(self.depth, other.depth) + 1
+        elif isinstance(other, (list, tuple)):
             # Plaintext-ciphertext multiplication
             assert self.dim == len(other) and isinstance(other[0], int)
-            return Ciphertext(
-                [x * y for (x, y) in zip(self.data, other)],
-                original_shape=self.original_shape,
-            )
+            return "ct_pt_multiplications", self.depth + 1
         elif isinstance(other, int):
             # Plaintext-ciphertext multiplication
-            return Ciphertext(
-                [other * x for x in self.data], original_shape=self.original_shape
-            )
+            return "ct_pt_multiplications", self.depth
+        return None, None
+
+    def _product_level(self, other) -> int:
+        """The level of the product of self and a supported multiplicand."""
+        if isinstance(other, Ciphertext):
+            return _consume_level(self, other)
+        elif isinstance(other, int):
+            return self.level
+        return _consume_level(self)
+
+    def _multiply_slots(self, other) -> list[int]:
+        if isinstance(other, int):
+            return _scale_slots(other, self._slots(), self.modulus)
+        return _mul_slots(self._slots(), _slots(other), self.modulus)
+
+    def __mul__(self, other) -> "Ciphertext":
+        kind, depth = self._check_multiplicand(other)
+        if kind is None:
+            return NotImplemented
+        _record(kind)
+        return Ciphertext._wrap(
+            self._multiply_slots(other),
+            self.original_shape,
+            depth,
+            self.modulus,
+            self._product_level(other),
+        )
+
+    def __imul__(self, other) -> "Ciphertext":
+        kind, depth = self._check_multiplicand(other)
+        if kind is None:
+            return NotImplemented
+        _record(kind)
+        self.level = self._product_level(other)
+        self._assign(self._multiply_slots(other))
+        self.depth = depth
+        return self
 
     def rotate(self, n: int) -> "Ciphertext":
-        """Rotate a ciphertext rightward n positions."""
+        """Rotate a ciphertext rightward n positions, returning a view sharing
+        its slot buffer."""
         n = n % self.dim
-        return Ciphertext(
-            self.data[-n:] + self.data[:-n], original_shape=self.original_shape
+        if n:
+            _record_rotation(n)
+        result = Ciphertext._wrap(
+            self._buffer, self.original_shape, self.depth, self.modulus, self.level
         )
+        result._offset = (self._offset + n) % self.dim
+        result._shared = self._shared = True
+        return result
 
     def __repr__(self) -> str:
         return f"Ciphertext({self.data})"
@@ -54,22 +533,157 @@ class Ciphertext:
         return f"Ciphertext({self.data})"
 
 
+def zeros_like(ciphertext: Ciphertext) -> Ciphertext:
+    """An all-zero ciphertext with the dimension, shape, plaintext modulus and
+    level of the given ciphertext, e.g., to start an accumulation.
+
+    For other ciphertext types, such as lazy ciphertexts (whose zeros are
+    folded away), this is a zero ciphertext of the same dimension and shape.
+    """
+    if not isinstance(ciphertext, Ciphertext):
+        return Ciphertext([0] * len(ciphertext), ciphertext.original_shape)
+    return Ciphertext._wrap(
+        [0] * ciphertext.dim,
+        ciphertext.original_shape,
+        0,
+        ciphertext.modulus,
+        ciphertext.level,
+    )
+
+
+def _slots(value):
+    """The slot values of a ciphertext or plaintext vector (a list or tuple)."""
+    return value._slots() if isinstance(value, Ciphertext) else value
+
+
+def _read_slots(value, shift: int, buffer: list[int]):
+    """Iterate over the slot values of a ciphertext rotated by shift, or a
+    plaintext vector, while buffer is written in place.
+
+    A rotated read of the buffer being written is copied first, since its
+    slots would otherwise be overwritten before they are read.
+    """
+    if not isinstance(value, Ciphertext):
+        return value
+    if value._buffer is buffer and (value._offset + shift) % value.dim:
+        return value._slots(shift)
+    return value._iter_slots(shift)
+
+
+def _accumulate(
+    acc: Ciphertext,
+    ciphertext: Ciphertext,
+    shift: int,
+    multiplicand,
+    kind: str,
+    depth: int,
+    level: int,
+) -> None:
+    """Compute acc += ciphertext.rotate(shift) * multiplicand in place, slot
+    by slot, for a product at the given level."""
+    t = _common_modulus(acc, multiplicand)
+    _record(kind)
+    _record("additions")
+    buffer = acc._own()
+    xs = _read_slots(ciphertext, shift, buffer)
+    if isinstance(multiplicand, int):
+        _scale_mac_slots(buffer, multiplicand, xs, t)
+    else:
+        _mac_slots(buffer, xs, _read_slots(multiplicand, 0, buffer), t)
+    acc.depth = max(acc.depth, depth)
+    acc.level = _align_levels(acc.level, level)
+
+
+def mac(acc: Ciphertext, ciphertext: Ciphertext, multiplicand) -> Ciphertext:
+    """Multiply-accumulate: compute acc += ciphertext * multiplicand in place,
+    slot by slot, without allocating the intermediate product. Only a shared
+    or rotated accumulator is copied (on write).
+
+    The multiplicand may be a ciphertext, a plaintext vector, or a scalar. If
+    the operands are not all eager ciphertexts (e.g., they are lazy), this
+    falls back to computing acc + ciphertext * multiplicand. In either case,
+    the accumulated result is returned.
+    """
+    if not (isinstance(acc, Ciphertext) and isinstance(ciphertext, Ciphertext)):
+        return acc + ciphertext * multiplicand
+    kind, depth = ciphertext._check_multiplicand(multiplicand)
+    if kind is None:
+        return acc + ciphertext * multiplicand
+    assert acc.dim == ciphertext.dim
+    _common_modulus(acc, ciphertext)
+
+    level = ciphertext._product_level(multiplicand)
+    _accumulate(acc, ciphertext, 0, multiplicand, kind, depth, level)
+    return acc
+
+
+def rotate_mac(
+    acc: Ciphertext, ciphertext: Ciphertext, n: int, multiplicand
+) -> Ciphertext:
+    """Rotate-multiply-accumulate: compute acc += ciphertext.rotate(n) *
+    multiplicand in place, without materializing the rotated ciphertext or
+    the product. See mac."""
+    if not (isinstance(acc, Ciphertext) and isinstance(ciphertext, Ciphertext)):
+        return acc + ciphertext.rotate(n) * multiplicand
+    kind, depth = ciphertext._check_multiplicand(multiplicand)
+    if kind is None:
+        return acc + ciphertext.rotate(n) * multiplicand
+    assert acc.dim == ciphertext.dim
+    _common_modulus(acc, ciphertext)
+
+    n = n % ciphertext.dim
+    if n:
+        _record_rotation(n)
+
+    level = ciphertext._product_level(multiplicand)
+    _accumulate(acc, ciphertext, n, multiplicand, kind, depth, level)
+    return acc
+
+
 def is_power_of_two(n: int) -> bool:
     """Check if n is a power of two."""
     return n & (n - 1) == 0
 
 
+@profiled()
 def rotate_and_sum(ciphertext: Ciphertext) -> Ciphertext:
     """Return a ciphertext where each entry contains the sum of all entries in
     the input ciphertext."""
-    n = len(ciphertext.data)
+    n = len(ciphertext)
     assert is_power_of_two(n)
-    # copy so as not to mutate the input
-    result = Ciphertext(ciphertext.data[:], original_shape=ciphertext.original_shape)
 
+    if n == 1:
+        # A view sharing the input's buffer, which is copied on write, so
+        # that the input isn't mutated through the result.
+        return ciphertext.rotate(0)
+
+    # The first addition creates a new ciphertext, so the input isn't mutated
+    # by the in-place additions that follow.
     shift = n // 2
+    result = ciphertext + ciphertext.rotate(shift)
+    shift //= 2
     while shift > 0:
         result += result.rotate(shift)
         shift //= 2
 
     return result
+
+
+@profiled()
+def replicate(ciphertext: Ciphertext, block_size: int, copies: int) -> Ciphertext:
+    """Return a ciphertext holding copies of the first block_size slots of the
+    input, which must be zero elsewhere, in consecutive blocks.
+
+    Each step doubles the number of copies, so this takes log2(copies)
+    rotations and additions.
+    """
+    assert is_power_of_two(copies)
+    assert block_size * copies <= len(ciphertext)
+
+    result = ciphertext
+    shift = block_size
+    while shift < block_size * copies:
+        result = result + result.rotate(shift)
+        shift *= 2
+
+    return result
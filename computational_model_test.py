@@ -1,4 +1,18 @@
-from computational_model import Ciphertext, is_power_of_two, rotate_and_sum
+import pytest
+
+from computational_model import (
+    Ciphertext,
+    centered,
+    count_ops,
+    is_power_of_two,
+    level_budget,
+    mac,
+    plaintext_modulus,
+    replicate,
+    rotate_and_sum,
+    rotate_mac,
+    zeros_like,
+)
 
 
 
@@ -15,3 +29,256 @@ def test_rotate_and_sum():
     x = Ciphertext(list(range(512)))
     y = rotate_and_sum(x)
     assert y.data == [sum(x.data)] * x.dim
+
+
+def test_count_ops():
+    x = Ciphertext(list(range(8)))
+    with count_ops() as counts:
+        y = rotate_and_sum(x)
+        y = y * x
+        y = y * ([1] * 8)
+        y = y.rotate(8)
+    assert counts.rotations == 3
+    assert counts.additions == 3
+    assert counts.ct_ct_multiplications == 1
+    assert counts.ct_pt_multiplications == 1
+
+
+def test_rotate_and_sum_does_not_mutate_input():
+    x = Ciphertext(list(range(8)))
+    rotate_and_sum(x)
+    assert x.data == list(range(8))
+
+
+def test_rotate_and_sum_single_slot_returns_copy():
+    x = Ciphertext([5])
+    y = rotate_and_sum(x)
+    assert y is not x
+    y += Ciphertext([1])
+    assert y.data == [6]
+    assert x.data == [5]
+
+
+def test_in_place_operations():
+    x = Ciphertext([1, 2, 3, 4])
+    y = Ciphertext([5, 6, 7, 8])
+    data = x.data
+    x += y
+    assert x.data == [6, 8, 10, 12]
+    x *= y
+    assert x.data == [30, 48, 70, 96]
+    assert x.depth == 1
+    x *= [1, 0, 1, 0]
+    assert x.data == [30, 0, 70, 0]
+    assert x.depth == 2
+    x *= 2
+    assert x.data == [60, 0, 140, 0]
+    # The accumulator's buffer was updated in place.
+    assert x.data is data
+    assert y.data == [5, 6, 7, 8]
+
+
+def test_mac():
+    acc = Ciphertext([1, 1, 1, 1])
+    x = Ciphertext([1, 2, 3, 4])
+    with count_ops() as counts:
+        result = mac(acc, x, Ciphertext([2, 2, 2, 2]))
+        result = mac(result, x, [1, 0, 0, 1])
+        result = mac(result, x, 3)
+    assert result is acc
+    assert acc.data == [7, 11, 16, 25]
+    assert acc.depth == 1
+    assert counts.additions == 3
+    assert counts.ct_ct_multiplications == 1
+    assert counts.ct_pt_multiplications == 2
+
+
+def test_rotate_mac():
+    x = Ciphertext(list(range(8)))
+    filter = Ciphertext([1, -1, 2, 0, 3, 5, -2, 4])
+    for n in range(-9, 10):
+        acc = Ciphertext([1] * 8)
+        expected = Ciphertext([1] * 8) + x.rotate(n) * filter
+        with count_ops() as counts:
+            rotate_mac(acc, x, n, filter)
+        assert acc == expected
+        assert counts.rotations == (1 if n % 8 else 0)
+    assert x.data == list(range(8))
+
+
+def test_mac_updates_accumulator_in_place():
+    acc = Ciphertext([1] * 8)
+    buffer = acc._buffer
+    x = Ciphertext(list(range(8)))
+    rotate_mac(acc, x.rotate(2), 3, x.rotate(-1))
+    mac(acc, x, 2)
+    assert acc._buffer is buffer
+    assert acc == Ciphertext([1] * 8) + x.rotate(5) * x.rotate(-1) + x * 2
+
+    # The accumulator may also be an operand.
+    expected = x + x.rotate(3) * x
+    rotate_mac(x, x, 3, x)
+    assert x == expected
+
+
+def test_plaintext_addition():
+    x = Ciphertext([1, 2, 3, 4], depth=1)
+    with count_ops() as counts:
+        y = x + 3
+        z = -1 + x.rotate(1)
+    assert y.data == [4, 5, 6, 7] and y.depth == 1
+    assert z.data == [3, 0, 1, 2]
+    assert counts.additions == 2 and counts.ct_pt_multiplications == 0
+    with plaintext_modulus(5):
+        assert (Ciphertext([1, 4]) + 3).data == [4, 2]
+
+
+def test_plaintext_modulus_wraps_around():
+    with plaintext_modulus(17):
+        x = Ciphertext([1, 5, 16, -1])
+        assert x.data == [1, 5, 16, 16]
+        assert (x + x).data == [2, 10, 15, 15]
+        assert (x * x).data == [1, 8, 1, 1]
+        assert (x * [2, 2, 2, 2]).data == (x * 2).data == [2, 10, 15, 15]
+        assert rotate_and_sum(x).data == [4] * 4
+        assert centered((x * 3).data, 17) == [3, -2, -3, -3]
+
+        acc = Ciphertext([0] * 4)
+        rotate_mac(acc, x, 1, x)
+        mac(acc, x, 4)
+        # [16, 1, 5, 16] * [1, 5, 16, 16] + 4 * [1, 5, 16, 16], mod 17
+        assert acc.data == [3, 8, 8, 14]
+
+    # The modulus is a property of the ciphertext, not of the context.
+    assert (x + x).data == [2, 10, 15, 15]
+    assert Ciphertext([20]).data == [20]
+    zeros = zeros_like(x)
+    assert zeros.modulus == 17 and zeros.data == [0] * 4
+    mac(zeros, x, 2)
+    assert zeros.data == [2, 10, 15, 15]
+
+
+def test_plaintext_modulus_mismatch():
+    with plaintext_modulus(17):
+        x = Ciphertext([1, 2])
+    with plaintext_modulus(19):
+        y = Ciphertext([1, 2])
+    with pytest.raises(AssertionError):
+        x + y
+
+
+def test_plaintext_modulus_too_large():
+    with pytest.raises(AssertionError):
+        with plaintext_modulus(1 << 65):
+            pass
+
+
+def test_levels():
+    x = Ciphertext([1, 2, 3, 4])
+    assert x.level is None
+
+    with level_budget(levels=3) as report:
+        x = Ciphertext([1, 2, 3, 4])
+        y = Ciphertext([5, 6, 7, 8])
+        assert x.level == 3
+        assert (x * 2).level == 3
+        assert x.rotate(1).level == 3
+        z = x * y
+        assert z.level == 2
+        z = z * [1, 0, 1, 0]
+        assert z.level == 1
+
+        # The sum is brought down to the lower level.
+        assert (z + x).level == 1
+        assert report.level_alignments == 1
+
+        acc = Ciphertext([0] * 4)
+        mac(acc, z, y)
+        assert acc.level == 0
+        assert report.min_level == 0
+        assert report.num_bootstraps == 0
+
+
+def test_bootstrapping():
+    with level_budget(levels=2, bootstrap_level=1, bootstrap_cost=10) as report:
+        x = Ciphertext([1, 2, 3, 4])
+        for _ in range(4):
+            x = x * x
+
+    # Levels 2 -> 1 -> 0, bootstrap to 1 -> 0, bootstrap to 1 -> 0.
+    assert x.data == [1, 2**16, 3**16, 4**16]
+    assert x.level == 0
+    assert [event.depth for event in report.bootstraps] == [2, 3]
+    assert report.total_bootstrap_cost == 20
+    [(site, count)] = report.sites().items()
+    assert site.startswith("computational_model_test.py:")
+    assert count == 2
+
+
+def test_bootstrapping_depth_two_kernel():
+    from halevi_shoup import matrix_vector_multiply_naive, pack_naive
+
+    matrix = [[1, 2], [3, 4]]
+    with level_budget(levels=1) as report:
+        packed = pack_naive(matrix)
+        result = matrix_vector_multiply_naive(packed, Ciphertext([1, 1]))
+    assert result.data == [3, 7]
+    # Each row product uses the only level, so each mask needs a bootstrap.
+    assert report.num_bootstraps == 2
+    assert "halevi_shoup.py" in next(iter(report.sites()))
+
+
+def test_replicate():
+    x = Ciphertext([1, 2, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    with count_ops() as counts:
+        y = replicate(x, 4, 4)
+    assert y.data == [1, 2, 3, 0] * 4
+    assert counts.rotations == 2
+    assert x.data[3:] == [0] * 13
+
+
+def test_rotation_views_share_buffers():
+    x = Ciphertext([1, 2, 3, 4])
+    y = x.rotate(1)
+    z = y.rotate(2)
+    # Rotations share the buffer of their input, without copying it.
+    assert y._buffer is x._buffer and z._buffer is x._buffer
+    assert (y + x).data == [5, 3, 5, 7]
+    assert (z * [1, 10, 100, 1000]).data == [2, 30, 400, 1000]
+    assert y == Ciphertext([4, 1, 2, 3])
+    assert z.rotate(1) == x
+
+    # In-place operations copy a shared buffer before writing.
+    x += x
+    assert x.data == [2, 4, 6, 8]
+    assert y.data == [4, 1, 2, 3]
+    z *= 2
+    assert z.data == [4, 6, 8, 2]
+    assert y.data == [4, 1, 2, 3]
+
+    acc = y.rotate(-1)
+    mac(acc, y, 1)
+    assert acc.data == [5, 3, 5, 7]
+    assert y.data == [4, 1, 2, 3]
+
+
+def test_bootstrapping_updates_operand_level():
+    with level_budget(levels=1) as report:
+        x = Ciphertext([1, 2]) * [1, 1]
+        assert x.level == 0
+        y = x * [2, 2]
+        z = x * [3, 3]
+    # x is bootstrapped in place, once, and reused by both products.
+    assert report.num_bootstraps == 1
+    assert x.level == 1 and y.level == z.level == 0
+
+
+def test_data_copies_shared_buffers():
+    for amount in [0, 4]:
+        x = Ciphertext([1, 2, 3, 4])
+        y = x.rotate(amount)
+        x.data[0] = 99
+        assert y == Ciphertext([1, 2, 3, 4])
+        y.data[1] = 77
+        assert x.data == [99, 2, 3, 4]
+        assert y.data == [1, 77, 3, 4]
@@ -2,6 +2,10 @@
 from abc import ABC, abstractmethod
 from typing import Optional
 from dataclasses import dataclass
+from math import log2, prod
+
+from computational_model import Ciphertext
+from profiling import profiled, span
 
 
 def is_power_of_two(n: int) -> bool:
@@ -21,13 +25,25 @@ class AxisBit:
         return self.__str__()
 
 
+@dataclass
+class ReplicaBit:
+    """A bit whose value does not affect the tensor index, so that the slots
+    differing only in this bit hold copies of the same tensor entry."""
+
+    def __str__(self):
+        return "r"
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class LayoutEntry(ABC):
     @abstractmethod
     def entry_type(self) -> str:
         ...
 
     @abstractmethod
-    def expand(self) -> list[Optional[AxisBit]]:
+    def expand(self) -> list[Optional[AxisBit | ReplicaBit]]:
         ...
 
     @abstractmethod
@@ -112,56 +128,187 @@ class GapBlock(LayoutEntry):
         return f"{self.size}*g"
 
 
+class ReplicaBlock(LayoutEntry):
+    def __init__(self, size: int = 1):
+        assert size > 0
+        self.size = size
+
+    def entry_type(self) -> str:
+        return "Replica"
+
+    def expand(self):
+        return [ReplicaBit() for _ in range(self.size)]
+
+    def __str__(self):
+        if self.size == 1:
+            return "(r)"
+        return f"{self.size}*r"
+
+
+def entries_from_bits(bits: list) -> list[LayoutEntry]:
+    """Layout entries for a bit string, merging runs of consecutive bits."""
+    entries = []
+    start = 0
+    while start < len(bits):
+        bit, end = bits[start], start + 1
+        if bit is None or isinstance(bit, ReplicaBit):
+            while end < len(bits) and type(bits[end]) is type(bit):
+                end += 1
+            block = GapBlock if bit is None else ReplicaBlock
+            entries.append(block(end - start))
+        else:
+            while (
+                end < len(bits)
+                and isinstance(bits[end], AxisBit)
+                and bits[end].axis == bit.axis
+                and bits[end].bit == bits[end - 1].bit - 1
+            ):
+                end += 1
+            entries.append(
+                AxisBitRange(axis=bit.axis, start=bit.bit, end=bits[end - 1].bit)
+            )
+        start = end
+    return entries
+
+
 class Layout:
-    def __init__(self, entries: list[LayoutEntry]):
+    def __init__(self, entries: list[LayoutEntry], num_slots: int = None):
+        """Create a layout from its bit string entries, ordered from most
+        significant bit to least.
+
+        Args:
+            entries: the entries of the bit string.
+            num_slots: the number of slots in a ciphertext. If the bit string
+              has more than log2(num_slots) bits, its leading bits select the
+              index of a ciphertext, and the remaining bits the slot within
+              it. By default, the layout describes a single ciphertext with
+              one slot per bit string value.
+        """
         self.entries = entries
+        num_bits = len(self.bit_string())
+        if num_slots is None:
+            num_slots = 1 << num_bits
+        assert is_power_of_two(num_slots), f"{num_slots=} is not a power of two"
+        assert num_slots <= 1 << num_bits, (
+            f"{num_slots=} exceeds the {1 << num_bits} values of the bit string"
+        )
+        self.num_slots = num_slots
+
+    def bit_string(self) -> list[Optional[AxisBit | ReplicaBit]]:
+        bit_string = []
+        for entry in self.entries:
+            bit_string.extend(entry.expand())
+        return bit_string
+
+    def split_bits(self) -> tuple[list, list]:
+        """The ciphertext index bits and slot bits of the bit string."""
+        bit_string = self.bit_string()
+        num_ciphertext_bits = len(bit_string) - int(log2(self.num_slots))
+        return bit_string[:num_ciphertext_bits], bit_string[num_ciphertext_bits:]
 
-    def expand(self, shape) -> list[Optional[int]]:
+    @property
+    def num_ciphertexts(self) -> int:
+        return (1 << len(self.bit_string())) // self.num_slots
+
+    def _offsets(self, shape) -> list[Optional[int]]:
+        """The row-major offset into a tensor of the given shape of each value
+        of the bit string, or None for values with a gap bit set."""
+        for dim in shape:
+            assert is_power_of_two(dim), f"{dim=} is not a power of two"
+
+        strides = [1] * len(shape)
+        for axis in range(len(shape) - 2, -1, -1):
+            strides[axis] = strides[axis + 1] * shape[axis + 1]
+
+        # The offset contributed by each bit of the bit string, least
+        # significant first, or None for gap bits.
+        weights = []
+        for bit in reversed(self.bit_string()):
+            if bit is None:
+                weights.append(None)
+            elif isinstance(bit, ReplicaBit):
+                weights.append(0)
+            else:
+                assert 1 << bit.bit < shape[bit.axis], f"{bit} exceeds {shape=}"
+                weights.append(strides[bit.axis] << bit.bit)
+
+        # The offset of value v is that of v with its highest set bit cleared,
+        # plus the weight of that bit, so each offset takes O(1) to compute.
+        offsets = [0]
+        for weight in weights:
+            if weight is None:
+                offsets.extend([None] * len(offsets))
+            else:
+                offsets += [None if o is None else o + weight for o in offsets]
+        return offsets
+
+    @staticmethod
+    def _unravel(offset: Optional[int], shape) -> Optional[tuple[int, ...]]:
+        if offset is None:
+            return None
+        indices = []
+        for dim in reversed(shape):
+            offset, index = divmod(offset, dim)
+            indices.append(index)
+        return tuple(reversed(indices))
+
+    @profiled()
+    def expand(self, shape) -> list[Optional[tuple[int, ...]]]:
         """Expand the layout to a list of tuples of integers indexing a tensor.
 
         Gap values are expanded to None, while others are expanded to tuples of
         integers indexing a tensor of the given input shape.
+
+        Each value of the bit string, i.e., each slot of the packed
+        ciphertexts in order, is interpreted according to the layout: each
+        bit of the value corresponds to a bit of an index into the tensor, or
+        to a gap. A value with any gap bit set is a gap, and values differing
+        only in replica bits hold the same tensor index.
         """
-        for dim in shape:
-            assert is_power_of_two(dim), f"{dim=} is not a power of two"
+        with span("offsets"):
+            offsets = self._offsets(shape)
+        with span("unravel"):
+            return [self._unravel(offset, shape) for offset in offsets]
+
+    def expand_ciphertexts(self, shape) -> list[list[Optional[tuple[int, ...]]]]:
+        """Expand the layout to a [num_ciphertexts][num_slots] array of the
+        tensor indices held by each slot of each ciphertext. See expand."""
+        expanded = self.expand(shape)
+        n = self.num_slots
+        return [expanded[i : i + n] for i in range(0, len(expanded), n)]
+
+    @profiled()
+    def pack(self, tensor, shape=None) -> list[Ciphertext]:
+        """Pack a tensor, given as nested lists, into ciphertexts according to
+        the layout, in one pass over the slots. Gaps are filled with zeros, and
+        replicas with copies of their tensor entry."""
+        if shape is None:
+            shape = _shape(tensor)
+        flat = _flatten(tensor, len(shape))
+        assert len(flat) == prod(shape), f"The tensor does not have {shape=}"
+        slots = [0 if o is None else flat[o] for o in self._offsets(shape)]
+        n = self.num_slots
+        return [Ciphertext(slots[i : i + n]) for i in range(0, len(slots), n)]
 
-        bit_string = []
-        for entry in self.entries:
-            bit_string.extend(entry.expand())
+    def __str__(self):
+        entries = " ".join(str(entry) for entry in self.entries)
+        if self.num_ciphertexts == 1:
+            return f"[{entries}]"
+        return f"[{entries}] ({self.num_slots} slots)"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _shape(tensor) -> tuple[int, ...]:
+    shape = []
+    while isinstance(tensor, list):
+        shape.append(len(tensor))
+        tensor = tensor[0]
+    return tuple(shape)
 
-        # Iterate over all indexes into the slots of the RLWE ciphertext.
-        result = []
-        last_non_gap_result = None
-        for ciphertext_index in range(1 << len(bit_string)):
-            # ciphertext_index is an index into an FHE ciphertext slot.
-            # The bits of that index are interpreted according to the layout
-            # defined by bit_string, i.e., each bit in ciphertext_index
-            # corresponds to a bit of an index into the tensor that was packed
-            # into the ciphertext. bit_string's entries describe how to
-            # reconstruct the indices into the original tensor.
-            indices = [0] * len(shape)
-            for i, bit in enumerate(bit_string):
-                if bit is None:
-                    continue
-
-                # the bit_string entries are ordered from most significant to
-                # least significant bit, so the enumeration is in reverse order
-                # of the bit we'd like to extract.
-                i = len(bit_string) - i - 1
-                extracted_bit = (ciphertext_index & (1 << i)) != 0
-
-                # bit.bit describes how to interpret extracted_bit as a bit of
-                # the index into the tensor.
-                indices[bit.axis] |= (extracted_bit << bit.bit)
-
-            # If the current index is the same as the previously stored
-            # non-None index, then all the newly chnaged bits were gap bits.
-            # This signifies striding, we add None to represent that.t
-            tensor_index = tuple(indices)
-            if last_non_gap_result is not None and tensor_index == last_non_gap_result:
-                result.append(None)
-            else:
-                result.append(tensor_index)
-                last_non_gap_result = tensor_index
 
-        return result
+def _flatten(tensor, ndim: int) -> list[int]:
+    for _ in range(ndim - 1):
+        tensor = [x for row in tensor for x in row]
+    return tensor
@@ -0,0 +1,145 @@
+"""Operations moving data between gapped Fhelipe layouts and dense ones.
+
+Strided computations, such as strided convolutions and pooling, leave their
+output in a layout with gap bits, whose slots are mostly unused. compact()
+squeezes the gap bits out of the slots of such a layout, moving the data
+into the low slots and leaving the gaps as the most significant slot bits,
+and expand() inserts them back.
+
+A gap bit at position g is removed by moving the data down one bit at a
+time: for each bit p > g holding data, the slots with bit p set are masked
+out and rotated left by 2^(p-1), clearing bit p and setting bit p - 1. So
+removing a gap bit takes one rotation per slot bit above it, rather than one
+per element. Expansion undoes the same moves in reverse order.
+
+The masks select only the slots holding data, so anything left in the gaps
+is cleared. Each move consumes a level, as its masks are plaintext vectors.
+"""
+
+from computational_model import Ciphertext, OpCounts
+from fhelipe import AxisBit, Layout, entries_from_bits
+
+
+def compact_layout(layout: Layout) -> Layout:
+    """The layout of the output of compact(): the slot bits of the layout
+    with its gap bits moved to the most significant positions."""
+    ciphertext_bits, slot_bits = layout.split_bits()
+    data_bits = [bit for bit in slot_bits if bit is not None]
+    gap_bits = [None] * (len(slot_bits) - len(data_bits))
+    return Layout(
+        entries_from_bits(ciphertext_bits + gap_bits + data_bits),
+        num_slots=layout.num_slots,
+    )
+
+
+def _compaction_moves(layout: Layout) -> list[tuple[int, int]]:
+    """The (bit, shift) moves compacting the layout: the slots with the bit
+    set are rotated by shift."""
+    _, slot_bits = layout.split_bits()
+    # The positions of the gap bits, least significant bit at position 0.
+    gaps = [p for p, bit in enumerate(reversed(slot_bits)) if bit is None]
+
+    moves = []
+    width = len(slot_bits)
+    # Removing a gap does not move the bits below it, so the gaps are removed
+    # from the most significant down, and each is followed only by data bits.
+    for gap in reversed(gaps):
+        for p in range(gap + 1, width):
+            moves.append((p, -(1 << (p - 1))))
+        width -= 1
+    return moves
+
+
+def _expansion_moves(layout: Layout) -> list[tuple[int, int]]:
+    """The moves undoing those of _compaction_moves, in reverse order."""
+    return [(p - 1, -shift) for p, shift in reversed(_compaction_moves(layout))]
+
+
+def _occupied(layout: Layout) -> list[bool]:
+    """Whether each slot of a ciphertext holds data in the layout."""
+    _, slot_bits = layout.split_bits()
+    slot_layout = Layout(entries_from_bits(slot_bits), num_slots=layout.num_slots)
+    return [index is not None for index in slot_layout.expand(_shape(slot_bits))]
+
+
+def _shape(bits: list) -> tuple[int, ...]:
+    """A tensor shape containing every index of the bit string's axes."""
+    axis_bits = [bit for bit in bits if isinstance(bit, AxisBit)]
+    num_axes = 1 + max((bit.axis for bit in axis_bits), default=0)
+    shape = [1] * num_axes
+    for bit in axis_bits:
+        shape[bit.axis] = max(shape[bit.axis], 2 << bit.bit)
+    return tuple(shape)
+
+
+def _plan(
+    occupied: list[bool], moves: list[tuple[int, int]]
+) -> list[tuple[tuple, tuple, int]]:
+    """The (staying mask, moving mask, shift) of each move that moves data,
+    given the slots initially holding data."""
+    n = len(occupied)
+    steps = []
+    for bit, shift in moves:
+        moving = tuple(int(occ and (s >> bit) & 1) for s, occ in enumerate(occupied))
+        if not any(moving):
+            continue
+        staying = tuple(int(occ and not m) for occ, m in zip(occupied, moving))
+        steps.append((staying, moving, shift))
+
+        occupied = [bool(x) for x in staying]
+        for s in range(n):
+            if moving[s]:
+                occupied[(s + shift) % n] = True
+    return steps
+
+
+def _apply(ciphertexts: list[Ciphertext], steps) -> list[Ciphertext]:
+    result = []
+    for ciphertext in ciphertexts:
+        for staying, moving, shift in steps:
+            moved = (ciphertext * moving).rotate(shift)
+            if any(staying):
+                ciphertext = ciphertext * staying + moved
+            else:
+                ciphertext = moved
+        result.append(ciphertext)
+    return result
+
+
+def _cost(steps, num_ciphertexts: int) -> OpCounts:
+    counts = OpCounts()
+    for staying, _, shift in steps:
+        keeps = any(staying)
+        counts.rotations += num_ciphertexts
+        counts.rotation_amounts[shift % len(staying)] += num_ciphertexts
+        counts.ct_pt_multiplications += num_ciphertexts * (1 + keeps)
+        counts.additions += num_ciphertexts * keeps
+    return counts
+
+
+def compact(ciphertexts: list[Ciphertext], layout: Layout) -> list[Ciphertext]:
+    """Move the data of ciphertexts packed with the gapped layout into the
+    dense layout compact_layout(layout)."""
+    assert len(ciphertexts) == layout.num_ciphertexts
+    steps = _plan(_occupied(layout), _compaction_moves(layout))
+    return _apply(ciphertexts, steps)
+
+
+def expand(ciphertexts: list[Ciphertext], layout: Layout) -> list[Ciphertext]:
+    """Move the data of ciphertexts packed with compact_layout(layout) into
+    the gapped layout. This is the inverse of compact()."""
+    assert len(ciphertexts) == layout.num_ciphertexts
+    steps = _plan(_occupied(compact_layout(layout)), _expansion_moves(layout))
+    return _apply(ciphertexts, steps)
+
+
+def compaction_cost(layout: Layout) -> OpCounts:
+    """The ops performed by compact() on ciphertexts with the layout."""
+    steps = _plan(_occupied(layout), _compaction_moves(layout))
+    return _cost(steps, layout.num_ciphertexts)
+
+
+def expansion_cost(layout: Layout) -> OpCounts:
+    """The ops performed by expand() into ciphertexts with the layout."""
+    steps = _plan(_occupied(compact_layout(layout)), _expansion_moves(layout))
+    return _cost(steps, layout.num_ciphertexts)
@@ -0,0 +1,75 @@
+from computational_model import Ciphertext, count_ops
+from fhelipe import AxisBitRange, GapBlock, Layout
+from fhelipe_ops import (
+    compact,
+    compact_layout,
+    compaction_cost,
+    expand,
+    expansion_cost,
+)
+
+
+def check_round_trip(layout, shape, tensor):
+    packed = layout.pack(tensor, shape)
+    dense_layout = compact_layout(layout)
+
+    with count_ops() as counts:
+        dense = compact(packed, layout)
+    assert [ct.data for ct in dense] == [
+        ct.data for ct in dense_layout.pack(tensor, shape)
+    ]
+    cost = compaction_cost(layout)
+    assert counts == cost
+
+    with count_ops() as counts:
+        expanded = expand(dense, layout)
+    assert expanded == packed
+    assert counts == expansion_cost(layout)
+    return cost
+
+
+def test_fhelipe_paper_fig_3b():
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), GapBlock(2)])
+    assert str(compact_layout(layout)) == "[2*g d0[1:0:-1]]"
+    cost = check_round_trip(layout, (4,), [5, 6, 7, 8])
+    # Two data bits above each of the two gap bits.
+    assert cost.rotations == 4
+
+
+def test_interleaved_gaps():
+    layout = Layout(
+        [
+            AxisBitRange.parse("d0[1:1]"),
+            GapBlock(1),
+            AxisBitRange.parse("d1[1:0]"),
+            AxisBitRange.parse("d0[0:0]"),
+            GapBlock(1),
+        ]
+    )
+    tensor = [[i * 4 + j for j in range(4)] for i in range(4)]
+    cost = check_round_trip(layout, (4, 4), tensor)
+    assert cost.rotations == 5
+    assert str(compact_layout(layout)) == "[2*g d0[1:1:-1] d1[1:0:-1] d0[0:0:-1]]"
+
+
+def test_multiple_ciphertexts():
+    layout = Layout(
+        [AxisBitRange.parse("d0[2:0]"), GapBlock(1)],
+        num_slots=8,
+    )
+    assert layout.num_ciphertexts == 2
+    cost = check_round_trip(layout, (8,), list(range(1, 9)))
+    assert cost.rotations == 2 * 2
+
+
+def test_compact_clears_gaps():
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), GapBlock(1)])
+    garbage = Ciphertext([1, 9, 2, 9, 3, 9, 4, 9])
+    [dense] = compact([garbage], layout)
+    assert dense.data == [1, 2, 3, 4, 0, 0, 0, 0]
+
+
+def test_dense_layout_is_free():
+    layout = Layout([AxisBitRange.parse("d0[2:0]")])
+    assert compaction_cost(layout).rotations == 0
+    assert compact_layout(layout).bit_string() == layout.bit_string()
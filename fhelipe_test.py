@@ -1,5 +1,5 @@
 import itertools
-from fhelipe import Layout, GapBlock, AxisBitRange
+from fhelipe import Layout, GapBlock, AxisBitRange, ReplicaBlock, entries_from_bits
 
 
 def test_row_major_layout():
@@ -47,6 +47,88 @@ def test_gap_example_from_fhelipe_paper_fig_3b():
     assert actual == expected, actual
 
 
+def test_leading_gap_bits():
+    tensor_shape = (4,)
+    layout = Layout([GapBlock(1), AxisBitRange.parse("d0[1:0]")])
+    actual = layout.expand(tensor_shape)
+    expected = [(0,), (1,), (2,), (3,), None, None, None, None]
+    assert actual == expected, actual
+
+
+def test_multi_ciphertext_row_major_layout():
+    tensor_shape = (8, 4)
+    # The two most significant bits of d0 select the ciphertext.
+    layout = Layout(
+        [
+            AxisBitRange.parse("d0[2:0]"),
+            AxisBitRange.parse("d1[1:0]"),
+        ],
+        num_slots=8,
+    )
+    assert layout.num_ciphertexts == 4
+    actual = layout.expand_ciphertexts(tensor_shape)
+    expected = [
+        [(i, j) for i in range(2 * c, 2 * c + 2) for j in range(4)]
+        for c in range(4)
+    ]
+    assert actual == expected, actual
+
+
+def test_multi_ciphertext_interleaved_layout():
+    tensor_shape = (4, 4)
+    # The low bit of d0 selects the ciphertext, so each ciphertext holds
+    # every other row, and gaps separate the rows.
+    layout = Layout(
+        [
+            AxisBitRange.parse("d0[0:0]"),
+            AxisBitRange.parse("d0[1:1]"),
+            GapBlock(1),
+            AxisBitRange.parse("d1[1:0]"),
+        ],
+        num_slots=16,
+    )
+    assert layout.num_ciphertexts == 2
+    [even, odd] = layout.expand_ciphertexts(tensor_shape)
+    assert even == [(0, 0), (0, 1), (0, 2), (0, 3)] + [None] * 4 + [
+        (2, 0), (2, 1), (2, 2), (2, 3)
+    ] + [None] * 4
+    assert odd[:4] == [(1, 0), (1, 1), (1, 2), (1, 3)]
+
+
+def test_pack():
+    tensor_shape = (8, 4)
+    tensor = [[i * 4 + j for j in range(4)] for i in range(8)]
+    layout = Layout(
+        [
+            AxisBitRange.parse("d1[1:0]"),
+            AxisBitRange.parse("d0[2:0]"),
+        ],
+        num_slots=16,
+    )
+    packed = layout.pack(tensor)
+    assert len(packed) == 2
+    for ciphertext, indices in zip(packed, layout.expand_ciphertexts(tensor_shape)):
+        assert ciphertext.data == [tensor[i][j] for (i, j) in indices]
+
+    gapped = Layout([AxisBitRange.parse("d0[1:0]"), GapBlock(1)], num_slots=4)
+    assert [ct.data for ct in gapped.pack([5, 6, 7, 8])] == [[5, 0, 6, 0], [7, 0, 8, 0]]
+    assert str(gapped) == "[d0[1:0:-1] (g)] (4 slots)"
+
+
+def test_replicated_layout():
+    tensor_shape = (4,)
+    layout = Layout([ReplicaBlock(1), AxisBitRange.parse("d0[1:0]")])
+    actual = layout.expand(tensor_shape)
+    expected = [(0,), (1,), (2,), (3,)] * 2
+    assert actual == expected, actual
+    assert str(layout) == "[(r) d0[1:0:-1]]"
+
+    # Replicas interleaved with a gap.
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), ReplicaBlock(1), GapBlock(1)])
+    expected = [5, 0, 5, 0, 6, 0, 6, 0, 7, 0, 7, 0, 8, 0, 8, 0]
+    assert layout.pack([5, 6, 7, 8])[0].data == expected
+
+
 # FIXME: can this support halevi-shoup?
 # def test_halevi_shoup_diagonal_order():
 #     tensor_shape = (4,4)
@@ -65,3 +147,22 @@ def test_gap_example_from_fhelipe_paper_fig_3b():
 #     ]
 #
 #    assert actual == expected, actual
+
+
+def test_split_bits_and_entries_from_bits():
+    layout = Layout(
+        [
+            AxisBitRange.parse("d0[2:1]"),
+            AxisBitRange.parse("d0[0:0]"),
+            GapBlock(1),
+            ReplicaBlock(1),
+            AxisBitRange.parse("d1[1:0]"),
+        ],
+        num_slots=16,
+    )
+    ciphertext_bits, slot_bits = layout.split_bits()
+    assert len(ciphertext_bits) == 3 and len(slot_bits) == 4
+    # Consecutive bits of the same axis are merged into one range.
+    rebuilt = Layout(entries_from_bits(ciphertext_bits + slot_bits), num_slots=16)
+    assert len(rebuilt.entries) == 4
+    assert rebuilt.expand_ciphertexts((8, 4)) == layout.expand_ciphertexts((8, 4))
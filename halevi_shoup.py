@@ -1,12 +1,22 @@
 """Halevi-Shoup matrix packing technique."""
 
+from dataclasses import dataclass
 from math import log2
+from typing import Iterable, Sequence
 
 from computational_model import Ciphertext
+from computational_model import mac
+from computational_model import replicate
 from computational_model import rotate_and_sum
+from computational_model import rotate_mac
 from computational_model import is_power_of_two
+from plaintext_cache import block_mask
+from plaintext_cache import one_hot_mask
+from plaintext_cache import prefix_mask
+from profiling import profiled, span
 
 
+@profiled()
 def pack_naive(matrix: list[list[int]]) -> list[Ciphertext]:
     """Naively pack the matrix into a list of ciphertexts."""
     assert len(matrix) == len(matrix[0])
@@ -14,6 +24,7 @@ def pack_naive(matrix: list[list[int]]) -> list[Ciphertext]:
     return [Ciphertext(matrix[i]) for i in range(n)]
 
 
+@profiled()
 def matrix_vector_multiply_naive(
     packed_matrix: list[Ciphertext], vector: Ciphertext
 ) -> Ciphertext:
@@ -22,27 +33,104 @@ def matrix_vector_multiply_naive(
 
     n = len(packed_matrix)
     row_products = []
-    for i in range(n):
-        row_products.append(packed_matrix[i] * vector)
+    with span("multiply"):
+        for i in range(n):
+            row_products.append(packed_matrix[i] * vector)
 
     # Each row_product needs to be sum-reduced
     reduced_row_products = []
-    for row in row_products:
-        reduced_row_products.append(rotate_and_sum(row))
+    with span("reduce"):
+        for row in row_products:
+            reduced_row_products.append(rotate_and_sum(row))
 
     # Now we need to "select" the i-th entry of each reduced_row_product and
     # sum the extracted values together.
 
     extracted = []
-    for i, row in enumerate(reduced_row_products):
-        mask = [0] * n
-        mask[i] = 1
-        extracted.append(row * Ciphertext(mask))
+    with span("mask"):
+        for i, row in enumerate(reduced_row_products):
+            extracted.append(row * one_hot_mask(n, i))
 
     # Sum the masked values together
-    result = extracted[0]
-    for i in range(1, n):
-        result += extracted[i]
+    with span("accumulate"):
+        result = extracted[0]
+        for i in range(1, n):
+            result += extracted[i]
+
+    return result
+
+
+@profiled()
+def pack_naive_packed(matrix: list[list[int]], num_slots: int) -> list[Ciphertext]:
+    """Pack k = num_slots / n rows of the matrix into each ciphertext.
+
+    The rows are interleaved, so that slot j * k + r of the c-th ciphertext
+    holds matrix[c * k + r][j].
+    """
+    assert len(matrix) == len(matrix[0])
+    n = len(matrix)
+    assert is_power_of_two(n)
+    assert num_slots % n == 0 and is_power_of_two(num_slots // n)
+    k = num_slots // n
+
+    ciphertexts = []
+    for c in range(-(-n // k)):
+        data = [0] * num_slots
+        for r in range(min(k, n - c * k)):
+            data[r::k] = matrix[c * k + r]
+        ciphertexts.append(Ciphertext(data, original_shape=(n, n)))
+
+    return ciphertexts
+
+
+def pack_vector_naive_packed(vector: list[int], num_slots: int) -> Ciphertext:
+    """Pack the vector to match pack_naive_packed, repeating each entry in k
+    = num_slots / n consecutive slots."""
+    k = num_slots // len(vector)
+    return Ciphertext([x for x in vector for _ in range(k)])
+
+
+@profiled()
+def matrix_vector_multiply_naive_packed(
+    packed_matrix: list[Ciphertext], vector: Ciphertext
+) -> Ciphertext:
+    """Multiply the pack_naive_packed matrix by the pack_vector_naive_packed
+    vector.
+
+    Each ciphertext holds k interleaved row products, which are reduced
+    together by a rotate-and-sum with stride k. Since the rotations wrap
+    around, every slot x of the c-th reduced ciphertext then holds the dot
+    product for row c * k + (x mod k), and in particular slots c * k through
+    c * k + k - 1 hold exactly the entries the c-th ciphertext contributes to
+    the result. These are extracted with a single level of masking.
+
+    This uses n^2 / num_slots products and masks and log(n) rotations per
+    product, compared to n products, n masks, and n log(n) rotations for
+    matrix_vector_multiply_naive.
+
+    The first n entries of the result hold the matrix-vector product, and the
+    remaining entries are zero.
+    """
+    n, _ = packed_matrix[0].original_shape
+    num_slots = len(vector)
+    assert len(packed_matrix[0]) == num_slots
+    k = num_slots // n
+
+    result = None
+    for c, packed_rows in enumerate(packed_matrix):
+        with span("multiply"):
+            reduced = packed_rows * vector
+        with span("reduce"):
+            shift = k
+            while shift < num_slots:
+                reduced += reduced.rotate(-shift)
+                shift *= 2
+
+        with span("mask"):
+            mask = block_mask(num_slots, c * k, min((c + 1) * k, n))
+            extracted = reduced * mask
+        with span("accumulate"):
+            result = extracted if result is None else result + extracted
 
     return result
 
@@ -50,16 +138,42 @@ def matrix_vector_multiply_naive(
 def pack(matrix: list[list[int]]) -> list[Ciphertext]:
     """Pack the matrix into a list of ciphertexts via Halevi-Shoup."""
     assert len(matrix) == len(matrix[0])
+    return pack_streaming(matrix)
 
-    n = len(matrix)
-    ciphertexts = [[None] * n for _ in range(n)]
-    for i in range(n):
-        for j in range(n):
-            ciphertexts[i][j] = matrix[j][(i + j) % n]
 
-    return [Ciphertext(ciphertexts[i]) for i in range(n)]
+def _diagonals_to_ciphertexts(diagonals: list[list[int]]) -> list[Ciphertext]:
+    # Replace each diagonal as it is encrypted, so that only one is copied at
+    # a time.
+    for i, diagonal in enumerate(diagonals):
+        diagonals[i] = Ciphertext(diagonal)
+    return diagonals
+
 
+@profiled()
+def pack_streaming(rows: Iterable[Sequence[int]]) -> list[Ciphertext]:
+    """Pack a square matrix given as an iterable of its rows, such as
+    serialization.iter_rows over a file, via Halevi-Shoup.
 
+    Row j holds slot j of every diagonal, so each row is consumed as soon as
+    it is read, and the memory used is that of the output and a single row.
+    """
+    diagonals = None
+    n = 0
+    num_read = 0
+    for j, row in enumerate(rows):
+        if diagonals is None:
+            n = len(row)
+            diagonals = [[0] * n for _ in range(n)]
+        assert len(row) == n and j < n, "The matrix must be square"
+        for i in range(n):
+            diagonals[i][j] = row[(i + j) % n]
+        num_read = j + 1
+
+    assert num_read == n > 0, "The matrix must be square"
+    return _diagonals_to_ciphertexts(diagonals)
+
+
+@profiled()
 def matrix_vector_multiply(
     packed_matrix: list[Ciphertext], vector: Ciphertext
 ) -> Ciphertext:
@@ -67,36 +181,115 @@ def matrix_vector_multiply(
     assert len(packed_matrix) == len(vector)
 
     n = len(packed_matrix)
-    row_products = []
-    for i in range(n):
-        row_products.append(packed_matrix[i] * vector.rotate(-i))
+    # Accumulate the products of each diagonal with the rotated vector
+    with span("multiply"):
+        result = packed_matrix[0] * vector
+    with span("rotate_multiply_accumulate"):
+        for i in range(1, n):
+            result = rotate_mac(result, vector, -i, packed_matrix[i])
 
-    # Sum the results together
-    result = row_products[0]
-    for i in range(1, n):
-        result += row_products[i]
+    return result
+
+
+def batch_capacity(n: int, num_slots: int) -> int:
+    """The number of vectors of length n a batched ciphertext holds."""
+    return num_slots // (2 * n)
+
+
+@profiled()
+def pack_batched(matrix: list[list[int]], num_slots: int) -> list[Ciphertext]:
+    """Pack the n x n matrix via Halevi-Shoup for multiplying a batch of
+    vectors at once, see pack_vectors_batched.
+
+    The slots are split into segments of 2n slots, one per vector, and the
+    first n slots of each segment hold the diagonal.
+    """
+    n = len(matrix)
+    capacity = batch_capacity(n, num_slots)
+    assert capacity > 0, f"{num_slots=} cannot hold a batch of vectors of {n=}"
+    padding = [0] * (num_slots - 2 * n * capacity)
+    return [
+        Ciphertext((diagonal.data + [0] * n) * capacity + padding)
+        for diagonal in pack(matrix)
+    ]
+
+
+def pack_vectors_batched(vectors: list[list[int]], num_slots: int) -> Ciphertext:
+    """Pack vectors of length n into the 2n-slot segments of a ciphertext, each
+    segment holding two copies of its vector, so that rotating the whole
+    ciphertext leftward by less than n rotates each vector cyclically within
+    the first n slots of its segment."""
+    n = len(vectors[0])
+    assert 0 < len(vectors) <= batch_capacity(n, num_slots)
+    data = []
+    for vector in vectors:
+        assert len(vector) == n
+        data.extend(vector + vector)
+    return Ciphertext(data + [0] * (num_slots - len(data)))
+
+
+@profiled()
+def matrix_vector_multiply_batched(
+    packed_matrix: list[Ciphertext], vectors: Ciphertext
+) -> Ciphertext:
+    """Multiply the batch-packed matrix by each of the batched vectors, with
+    the n - 1 rotations shared by the whole batch."""
+    assert len(packed_matrix[0]) == len(vectors)
+
+    with span("multiply"):
+        result = packed_matrix[0] * vectors
+    with span("rotate_multiply_accumulate"):
+        for i in range(1, len(packed_matrix)):
+            result = rotate_mac(result, vectors, -i, packed_matrix[i])
 
     return result
 
 
+def unpack_batched(result: Ciphertext, n: int, count: int) -> list[list[int]]:
+    """Extract the first count products of matrix_vector_multiply_batched."""
+    return [result.data[2 * n * b : 2 * n * b + n] for b in range(count)]
+
+
 def pack_squat(matrix: list[list[int]]) -> list[Ciphertext]:
     """Pack the matrix into a list of ciphertexts via
     Juvekar-Vaikuntanathan-Chandrakasan squat diagonal packing.
     """
-    n, m = len(matrix), len(matrix[0])
-    assert n < m
-    assert is_power_of_two(n)
-    assert is_power_of_two(m)
-
-    ciphertexts = [[None] * m for _ in range(n)]
-    for i in range(n):
-        for j in range(m):
-            # wraps around the bottom of the matrix as well as the right.
-            ciphertexts[i][j] = matrix[j % n][(i + j) % m]
-
-    return [Ciphertext(ciphertexts[i]) for i in range(n)]
+    return pack_squat_streaming(matrix, len(matrix))
 
 
+@profiled()
+def pack_squat_streaming(
+    rows: Iterable[Sequence[int]], num_rows: int
+) -> list[Ciphertext]:
+    """Pack an n x m matrix given as an iterable of its n = num_rows rows via
+    squat diagonal packing, using the memory of the output and a single row.
+    See pack_streaming.
+    """
+    n = num_rows
+    diagonals = None
+    m = 0
+    num_read = 0
+    for r, row in enumerate(rows):
+        if diagonals is None:
+            m = len(row)
+            assert n < m
+            assert is_power_of_two(n)
+            assert is_power_of_two(m)
+            diagonals = [[0] * m for _ in range(n)]
+        assert len(row) == m and r < n, f"Expected {n} rows of length {m}"
+        # Slot j of diagonal i holds matrix[j % n][(i + j) % m], which wraps
+        # around the bottom of the matrix as well as the right, so row r
+        # fills slots r, r + n, r + 2n, ...
+        for j in range(r, m, n):
+            for i in range(n):
+                diagonals[i][j] = row[(i + j) % m]
+        num_read = r + 1
+
+    assert num_read == n, f"Expected {n} rows, got {num_read}"
+    return _diagonals_to_ciphertexts(diagonals)
+
+
+@profiled()
 def matrix_vector_multiply_squat(
     packed_matrix: list[Ciphertext], vector: Ciphertext
 ) -> Ciphertext:
@@ -105,26 +298,332 @@ def matrix_vector_multiply_squat(
     assert m == len(vector)
     assert n < m
 
-    row_products = []
-    for i in range(n):
-        row_products.append(packed_matrix[i] * vector.rotate(-i))
-
-    # Sum the results together
-    partial_sums = row_products[0]
-    for i in range(1, n):
-        partial_sums += row_products[i]
+    # Accumulate the products of each diagonal with the rotated vector
+    with span("multiply"):
+        partial_sums = packed_matrix[0] * vector
+    with span("rotate_multiply_accumulate"):
+        for i in range(1, n):
+            partial_sums = rotate_mac(partial_sums, vector, -i, packed_matrix[i])
 
     # Reduce the result to combine partial sums
-    result = partial_sums
-    num_shifts = int(log2(m) - log2(n))
-    shift = m // 2
-    for _ in range(num_shifts):
-        result += result.rotate(shift)
-        shift //= 2
+    with span("reduce"):
+        result = partial_sums
+        num_shifts = int(log2(m) - log2(n))
+        shift = m // 2
+        for _ in range(num_shifts):
+            result += result.rotate(shift)
+            shift //= 2
 
     # Mask out the first n entries
-    mask = [0] * m
-    for i in range(n):
-        mask[i] = 1
+    with span("mask"):
+        return result * prefix_mask(m, n)
+
+
+def blocked_cost(
+    shape: tuple[int, int],
+    block_size: int,
+    rotation_cost: float = 1.0,
+    multiply_cost: float = 1.0,
+    addition_cost: float = 0.1,
+) -> float:
+    """Estimate the cost of a blocked Halevi-Shoup matrix-vector product.
+
+    The rotations of each vector block are shared by every block in the same
+    block column, so only the multiplications and additions scale with the
+    total number of blocks.
+    """
+    n, m = shape
+    block_rows = -(-n // block_size)
+    block_cols = -(-m // block_size)
+    rotations = block_cols * (block_size - 1)
+    multiplications = block_rows * block_cols * block_size
+    additions = block_rows * block_cols * (block_size - 1) + block_rows * (
+        block_cols - 1
+    )
+    return (
+        rotation_cost * rotations
+        + multiply_cost * multiplications
+        + addition_cost * additions
+    )
+
+
+def choose_block_size(shape: tuple[int, int], num_slots: int, **cost_kwargs) -> int:
+    """Choose the block size minimizing blocked_cost, subject to each block
+    diagonal fitting in a ciphertext of num_slots slots."""
+    largest = min(num_slots, max(shape))
+    return min(
+        range(1, largest + 1),
+        key=lambda b: (blocked_cost(shape, b, **cost_kwargs), -b),
+    )
+
+
+@profiled()
+def pack_blocked(
+    matrix: list[list[int]], num_slots: int, block_size: int = None
+) -> list[list[list[Ciphertext]]]:
+    """Tile the matrix into square blocks and pack each block via Halevi-Shoup.
+
+    The matrix need not be square, and its dimensions may exceed num_slots.
+    Blocks on the bottom and right edges are zero-padded. If block_size is
+    not given, it is chosen by choose_block_size.
+
+    Returns a grid of packed blocks, indexed as [block_row][block_col].
+    """
+    n, m = len(matrix), len(matrix[0])
+    if block_size is None:
+        block_size = choose_block_size((n, m), num_slots)
+    assert block_size <= num_slots
+
+    block_rows = -(-n // block_size)
+    block_cols = -(-m // block_size)
+
+    def entry(i, j):
+        return matrix[i][j] if i < n and j < m else 0
+
+    packed = []
+    for r in range(block_rows):
+        packed.append([])
+        for c in range(block_cols):
+            block = [
+                [
+                    entry(r * block_size + i, c * block_size + j)
+                    for j in range(block_size)
+                ]
+                for i in range(block_size)
+            ]
+            packed[r].append(pack(block))
+
+    return packed
+
+
+def pack_vector_blocked(vector: list[int], block_size: int) -> list[Ciphertext]:
+    """Split the vector into zero-padded ciphertexts of block_size slots."""
+    num_blocks = -(-len(vector) // block_size)
+    padded = vector + [0] * (num_blocks * block_size - len(vector))
+    return [
+        Ciphertext(padded[c * block_size : (c + 1) * block_size])
+        for c in range(num_blocks)
+    ]
+
+
+def block_matrix_vector_products(
+    packed_blocks: list[list[list[Ciphertext]]], vector_blocks: list[Ciphertext]
+) -> list[list[Ciphertext]]:
+    """Compute the partial product of every block with its vector block.
+
+    The partial products are independent of each other, and may be computed
+    in parallel. The rotations of each vector block are computed once and
+    shared across all blocks in the same block column.
+    """
+    assert len(packed_blocks[0]) == len(vector_blocks)
+    block_size = len(vector_blocks[0])
+
+    with span("rotate"):
+        rotated_vectors = [
+            [vector.rotate(-i) for i in range(block_size)] for vector in vector_blocks
+        ]
+
+    partials = []
+    with span("multiply_accumulate"):
+        for block_row in packed_blocks:
+            partials.append([])
+            for block, rotations in zip(block_row, rotated_vectors):
+                result = block[0] * rotations[0]
+                for i in range(1, block_size):
+                    result = mac(result, rotations[i], block[i])
+                partials[-1].append(result)
+
+    return partials
+
+
+@profiled()
+def matrix_vector_multiply_blocked(
+    packed_blocks: list[list[list[Ciphertext]]], vector_blocks: list[Ciphertext]
+) -> list[Ciphertext]:
+    """Multiply the block-packed matrix by the block-packed vector.
+
+    Returns one ciphertext per block row, containing the corresponding
+    block_size entries of the result (zero-padded past the matrix's rows).
+    """
+    partials = block_matrix_vector_products(packed_blocks, vector_blocks)
+
+    # Reduce the partial results across each block row
+    results = []
+    with span("accumulate"):
+        for row_partials in partials:
+            result = row_partials[0]
+            for partial in row_partials[1:]:
+                result += partial
+            results.append(result)
+
+    return results
+
+
+def pack_row_major(matrix: list[list[int]], dim: int) -> Ciphertext:
+    """Pack the matrix row-major into a single ciphertext of dim * dim slots,
+    zero-padding it to a dim x dim matrix."""
+    n, m = len(matrix), len(matrix[0])
+    assert n <= dim and m <= dim
+    return Ciphertext(
+        [
+            matrix[i][j] if i < n and j < m else 0
+            for i in range(dim)
+            for j in range(dim)
+        ]
+    )
+
+
+def unpack_row_major(packed: Ciphertext, n: int, m: int) -> list[list[int]]:
+    """Unpack the leading n x m submatrix of a row-major packed matrix."""
+    dim = int(len(packed) ** 0.5)
+    return [[packed.data[i * dim + j] for j in range(m)] for i in range(n)]
+
+
+def pack_vector_compact(vector: list[int], dim: int) -> Ciphertext:
+    """Pack the vector into the first slots of a ciphertext of dim * dim
+    slots, zero elsewhere."""
+    assert len(vector) <= dim
+    return Ciphertext(vector + [0] * (dim * dim - len(vector)))
+
+
+@profiled()
+def matrix_vector_multiply_replicated(
+    packed_matrix: Ciphertext, vector: Ciphertext
+) -> Ciphertext:
+    """Multiply the row-major packed n x n matrix by the compact packed vector.
+
+    The vector is replicated into every row of the matrix, i.e., from the
+    Fhelipe layout [d0] to [r d0], in log2(n) rotations, multiplied by the
+    matrix, and each row is summed in log2(n) rotations. This trades the n - 1
+    rotations of the diagonal method for 2 log2(n) rotations, at the cost of
+    n * n slots.
+
+    The result is strided: entry i is in slot i * n. See unpack_replicated.
+    """
+    dim = len(packed_matrix)
+    n = int(dim**0.5)
+    assert n * n == dim and is_power_of_two(n)
+    assert len(vector) == dim
+
+    with span("replicate"):
+        replicated = replicate(vector, n, n)
+    with span("multiply"):
+        result = replicated * packed_matrix
+
+    # Sum each row into its first slot.
+    with span("reduce"):
+        shift = n // 2
+        while shift > 0:
+            result += result.rotate(-shift)
+            shift //= 2
+
+    return result
+
 
-    return result * Ciphertext(mask)
+def unpack_replicated(result: Ciphertext, n: int) -> list[int]:
+    """Extract the output of matrix_vector_multiply_replicated."""
+    return result.data[::n][:n]
+
+
+def permutation_diagonals(source: list[int]) -> dict[int, list[int]]:
+    """Express the slot permutation out[k] = in[source[k]] in Halevi-Shoup form.
+
+    Returns the nonzero diagonals of the permutation's matrix as plaintexts,
+    keyed by offset, so that the permutation of a ciphertext x is the sum of
+    x.rotate(-offset) * diagonal over all entries.
+    """
+    size = len(source)
+    diagonals = {}
+    for k, s in enumerate(source):
+        offset = (s - k) % size
+        diagonals.setdefault(offset, [0] * size)[k] = 1
+    return diagonals
+
+
+@dataclass(frozen=True)
+class MatrixMultiplyPlaintexts:
+    """Precomputed plaintexts for matrix_multiply on dim x dim matrices.
+
+    lhs[k] and rhs[k] are the permutation_diagonals of the composite
+    permutations phi^k . sigma and psi^k . tau from Jiang-Kim-Lauter-Song,
+    where
+
+        sigma(A)[i][j] = A[i][i + j]     tau(B)[i][j] = B[i + j][j]
+        phi(A)[i][j] = A[i][j + 1]       psi(B)[i][j] = B[i + 1][j]
+
+    with all indices taken mod dim.
+    """
+
+    dim: int
+    lhs: list[dict[int, list[int]]]
+    rhs: list[dict[int, list[int]]]
+
+
+@profiled()
+def prepare_matrix_multiply(dim: int) -> MatrixMultiplyPlaintexts:
+    """Precompute the permutation plaintexts for matrix_multiply."""
+    lhs, rhs = [], []
+    for k in range(dim):
+        lhs.append(
+            permutation_diagonals(
+                [i * dim + (i + j + k) % dim for i in range(dim) for j in range(dim)]
+            )
+        )
+        rhs.append(
+            permutation_diagonals(
+                [((i + j + k) % dim) * dim + j for i in range(dim) for j in range(dim)]
+            )
+        )
+    return MatrixMultiplyPlaintexts(dim=dim, lhs=lhs, rhs=rhs)
+
+
+def _apply_diagonals(
+    rotations: dict[int, Ciphertext], diagonals: dict[int, list[int]]
+) -> Ciphertext:
+    """Apply a linear transformation given by its diagonals, where
+    rotations[offset] holds the input ciphertext rotated by -offset."""
+    terms = [rotations[offset] * diagonal for offset, diagonal in diagonals.items()]
+    result = terms[0]
+    for term in terms[1:]:
+        result += term
+    return result
+
+
+@profiled()
+def matrix_multiply(
+    packed_matrix_a: Ciphertext,
+    packed_matrix_b: Ciphertext,
+    plaintexts: MatrixMultiplyPlaintexts,
+) -> Ciphertext:
+    """Multiply two row-major packed dim x dim matrices via Jiang-Kim-Lauter-Song.
+
+    Computes AB = sum_k phi^k(sigma(A)) * psi^k(tau(B)), applying each
+    composite permutation directly to A and B with the diagonal method. The
+    diagonals of every phi^k . sigma lie at the same 2 * dim - 1 offsets, and
+    those of every psi^k . tau at the same dim offsets, so each rotation of A
+    and B is computed once and shared by all dim terms of the sum.
+
+    The result is packed row-major, and has multiplicative depth 2.
+    """
+    dim = plaintexts.dim
+    assert len(packed_matrix_a) == len(packed_matrix_b) == dim * dim
+
+    def rotations(packed, all_diagonals):
+        offsets = {offset for diagonals in all_diagonals for offset in diagonals}
+        return {offset: packed.rotate(-offset) for offset in offsets}
+
+    with span("rotate"):
+        rotated_a = rotations(packed_matrix_a, plaintexts.lhs)
+        rotated_b = rotations(packed_matrix_b, plaintexts.rhs)
+
+    result = None
+    for k in range(dim):
+        with span("permute"):
+            lhs = _apply_diagonals(rotated_a, plaintexts.lhs[k])
+            rhs = _apply_diagonals(rotated_b, plaintexts.rhs[k])
+        with span("multiply"):
+            prod = lhs * rhs
+        with span("accumulate"):
+            result = prod if result is None else result + prod
+
+    return result
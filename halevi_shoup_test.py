@@ -2,12 +2,29 @@ import pytest
 from hypothesis import given
 from hypothesis.strategies import composite, integers, lists
 
-from computational_model import Ciphertext
+import bicyclic
+from computational_model import Ciphertext, centered, count_ops, plaintext_modulus
 from halevi_shoup import (
+    choose_block_size,
+    matrix_multiply,
+    matrix_vector_multiply_blocked,
     pack,
+    pack_blocked,
+    pack_row_major,
+    pack_vector_blocked,
+    pack_vector_naive_packed,
+    prepare_matrix_multiply,
+    unpack_row_major,
     pack_naive,
+    pack_naive_packed,
     pack_squat,
+    pack_squat_streaming,
+    pack_streaming,
+    pack_vector_compact,
+    matrix_vector_multiply_replicated,
+    unpack_replicated,
     matrix_vector_multiply_naive,
+    matrix_vector_multiply_naive_packed,
     matrix_vector_multiply,
     matrix_vector_multiply_squat,
 )
@@ -65,3 +82,205 @@ for n in [2, 4, 8, 16]:
     @given(random_matrix(shape=(n, 2 * n)), random_vector(dim=2 * n))
     def test_matmul_squat(matrix, vector):
         run_test(matrix, vector, pack_squat, matrix_vector_multiply_squat)
+
+
+def run_naive_packed_test(matrix, vector, num_slots):
+    result = matrix_vector_multiply_naive_packed(
+        pack_naive_packed(matrix, num_slots),
+        pack_vector_naive_packed(vector, num_slots),
+    )
+    expected = [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+    expected += [0] * (num_slots - len(expected))
+    assert result.data == expected
+
+
+@pytest.mark.parametrize("num_slots", [4, 8, 16, 32])
+def test_matmul_naive_packed(num_slots):
+    matrix = [[1, 2, 3, 4], [3, 4, 5, 6], [5, 6, 7, 8], [6, 7, 8, 9]]
+    vector = [1, -1, 2, 0]
+    run_naive_packed_test(matrix, vector, num_slots)
+
+
+for n in [2, 4, 8]:
+
+    @given(random_matrix(shape=(n, n)), random_vector(dim=n))
+    def test_matmul_naive_packed_random(matrix, vector):
+        run_naive_packed_test(matrix, vector, num_slots=4 * len(matrix))
+
+
+def test_naive_packed_op_counts():
+    n, num_slots = 8, 32
+    matrix = [[i + j for j in range(n)] for i in range(n)]
+    vector = list(range(n))
+    packed_matrix = pack_naive_packed(matrix, num_slots)
+    packed_vector = pack_vector_naive_packed(vector, num_slots)
+    with count_ops() as counts:
+        matrix_vector_multiply_naive_packed(packed_matrix, packed_vector)
+
+    # Two ciphertexts, each with 4 rows.
+    assert counts.rotations == 2 * 3
+    # The extraction masks are plaintexts.
+    assert counts.ct_ct_multiplications == 2
+    assert counts.ct_pt_multiplications == 2
+
+
+def run_blocked_test(matrix, vector, num_slots, block_size=None):
+    packed_matrix = pack_blocked(matrix, num_slots, block_size=block_size)
+    block_size = len(packed_matrix[0][0][0])
+    assert block_size <= num_slots
+
+    results = matrix_vector_multiply_blocked(
+        packed_matrix, pack_vector_blocked(vector, block_size)
+    )
+    actual = [x for result in results for x in result.data][: len(matrix)]
+
+    expected = [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+    assert actual == expected
+
+
+def test_matmul_blocked_larger_than_slots():
+    matrix = [[i * 10 + j for j in range(10)] for i in range(10)]
+    vector = list(range(-5, 5))
+    run_blocked_test(matrix, vector, num_slots=4)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 4])
+def test_matmul_blocked_explicit_block_size(block_size):
+    matrix = [[i - j for j in range(7)] for i in range(5)]
+    vector = [1, -1, 2, 0, 3, 5, -2]
+    run_blocked_test(matrix, vector, num_slots=4, block_size=block_size)
+
+
+@given(random_matrix(shape=(9, 6)), random_vector(dim=6))
+def test_matmul_blocked_rectangular(matrix, vector):
+    run_blocked_test(matrix, vector, num_slots=4)
+
+
+def test_choose_block_size():
+    # Two 50x50 blocks per axis need less padding than two 64x64 blocks.
+    assert choose_block_size((100, 100), num_slots=64) == 50
+    # The matrix fits in one block.
+    assert choose_block_size((10, 10), num_slots=64) == 10
+
+
+def naive_matrix_multiply(a, b):
+    return [
+        [sum(a[i][k] * b[k][j] for k in range(len(b))) for j in range(len(b[0]))]
+        for i in range(len(a))
+    ]
+
+
+def run_matrix_multiply(a, b):
+    dim = max(len(a), len(b), len(b[0]))
+    result = matrix_multiply(
+        pack_row_major(a, dim), pack_row_major(b, dim), prepare_matrix_multiply(dim)
+    )
+    return unpack_row_major(result, len(a), len(b[0]))
+
+
+@pytest.mark.parametrize("dim", [1, 2, 3, 4])
+def test_matrix_multiply_identity(dim):
+    identity = [[int(i == j) for j in range(dim)] for i in range(dim)]
+    matrix = [[i * dim + j for j in range(dim)] for i in range(dim)]
+    assert run_matrix_multiply(identity, matrix) == matrix
+    assert run_matrix_multiply(matrix, identity) == matrix
+
+
+@given(random_matrix(shape=(4, 4)), random_matrix(shape=(4, 4)))
+def test_matrix_multiply_square(a, b):
+    assert run_matrix_multiply(a, b) == naive_matrix_multiply(a, b)
+
+
+@given(random_matrix(shape=(3, 5)), random_matrix(shape=(5, 2)))
+def test_matrix_multiply_rectangular(a, b):
+    assert run_matrix_multiply(a, b) == naive_matrix_multiply(a, b)
+
+
+def test_matrix_multiply_versus_bicyclic():
+    m, n, p = 3, 5, 7
+    a = [[i * n + j for j in range(n)] for i in range(m)]
+    b = [[i - j for j in range(p)] for i in range(n)]
+    expected = naive_matrix_multiply(a, b)
+
+    dim = max(m, n, p)
+    plaintexts = prepare_matrix_multiply(dim)
+    packed_a, packed_b = pack_row_major(a, dim), pack_row_major(b, dim)
+    with count_ops() as diagonal_counts:
+        result = matrix_multiply(packed_a, packed_b, plaintexts)
+    assert unpack_row_major(result, m, p) == expected
+
+    num_slots = m * n * p
+    packed_a, packed_b = bicyclic.pack(a, num_slots), bicyclic.pack(b, num_slots)
+    with count_ops() as bicyclic_counts:
+        result = bicyclic.matrix_multiply(packed_a, packed_b, m, n, p)
+    assert bicyclic.unpack(result, m, p) == expected
+
+    # 2 * dim - 2 nonzero rotations of A, dim - 1 of B, each shared by all
+    # dim terms of the sum.
+    assert diagonal_counts.rotations == 3 * dim - 3
+    assert diagonal_counts.ct_ct_multiplications == dim
+    # Bicyclic rotates both operands once per term, except the first.
+    assert bicyclic_counts.rotations == 2 * (n - 1)
+    assert bicyclic_counts.ct_ct_multiplications == n
+
+
+@given(random_matrix(shape=(8, 8)), random_vector(dim=8))
+def test_matmul_plaintext_modulus(matrix, vector):
+    t = 1 << 20
+    with plaintext_modulus(t):
+        result = matrix_vector_multiply(pack(matrix), Ciphertext(vector))
+    expected = [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+    assert result.data == [x % t for x in expected]
+    # The result is small enough to decode without wrapping around.
+    assert centered(result.data, t) == expected
+
+
+def test_pack_streaming():
+    n = 8
+    matrix = [[i * n + j for j in range(n)] for i in range(n)]
+    # The rows are consumed from a generator, one at a time.
+    packed = pack_streaming(list(row) for row in matrix)
+    assert packed == pack(matrix)
+    assert packed[1].data == [matrix[j][(1 + j) % n] for j in range(n)]
+
+    with pytest.raises(AssertionError):
+        pack_streaming(iter(matrix[:-1]))
+    with pytest.raises(AssertionError):
+        pack_streaming(iter([]))
+
+
+def test_pack_squat_streaming():
+    n, m = 4, 16
+    matrix = [[i * m + j for j in range(m)] for i in range(n)]
+    packed = pack_squat_streaming(iter(matrix), num_rows=n)
+    expected = [
+        [matrix[j % n][(i + j) % m] for j in range(m)] for i in range(n)
+    ]
+    assert [ct.data for ct in packed] == expected
+    assert packed == pack_squat(matrix)
+
+    with pytest.raises(AssertionError):
+        pack_squat_streaming(iter(matrix), num_rows=2)
+
+
+def test_replicated_matvec():
+    from fhelipe import AxisBitRange, Layout, ReplicaBlock
+
+    n = 8
+    matrix = [[(i * 3 + j * 5) % 7 - 3 for j in range(n)] for i in range(n)]
+    vector = [j - 4 for j in range(n)]
+    packed_vector = pack_vector_compact(vector, n)
+    with count_ops() as counts:
+        result = matrix_vector_multiply_replicated(
+            pack_row_major(matrix, n), packed_vector
+        )
+    expected = [sum(matrix[i][j] * vector[j] for j in range(n)) for i in range(n)]
+    assert unpack_replicated(result, n) == expected
+    assert counts.rotations == 2 * 3
+    assert counts.ct_ct_multiplications == 1
+
+    # Packing the vector replicated in the clear gives the same product.
+    replicated = Layout([ReplicaBlock(3), AxisBitRange.parse("d0[2:0]")])
+    [packed_vector] = replicated.pack(vector)
+    product = packed_vector * pack_row_major(matrix, n)
+    assert [sum(product.data[i * n : (i + 1) * n]) for i in range(n)] == expected
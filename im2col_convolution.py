@@ -0,0 +1,416 @@
+"""Convolution lowered to a matrix-vector product (Toeplitz / im2col).
+
+A convolution is linear in its input, so it is the product of the Toeplitz
+matrix of the filter by the flattened input. Row r of the (n_out * m_out) x
+(n * m) Toeplitz matrix holds the filter taps applied to each input entry at
+output position r. The server builds it in the clear from its filter, so this
+applies to the encrypted input of any layer, flattened row-major as
+siso_convolution packs it. The product is run by one of two kernels:
+
+ - DIAGONAL: halevi_shoup.matrix_vector_multiply, with the Toeplitz matrix
+   zero-padded to a square.
+ - BICYCLIC: bicyclic.matrix_multiply of the Toeplitz matrix by the input as
+   a column, with the matrix zero-padded to a number of columns coprime with
+   its number of rows. The bicyclic encoding of the column repeats it once
+   per row, which the server does with at most 2 log2(rows) rotations (see
+   tile_rotations).
+
+For a first layer, whose input the client holds in the clear, the client can
+instead lower the input to its patch matrix (im2col), whose row r holds the
+fn * fm entries under the filter at output position r, so the convolution is
+the product of the patch matrix and the flattened filter. The duplication of
+the input entries across patches is then done before encryption, so the
+product needs few or no rotations, at the cost of packing each input entry up
+to fn * fm times. The input of a later layer is the encrypted output of the
+previous one, which the server cannot lower to patches without the rotations
+this avoids, so the rotation counts of this variant are not comparable to
+those of siso_convolution or of the Toeplitz kernels. It has its own two
+kernels:
+
+ - DIAGONAL (pack_diagonal): the Halevi-Shoup diagonal method on the
+   extended diagonals of the tall patch matrix. Slot r of diagonal i holds
+   patches[r][(r + i) % k], where the k columns are zero-padded to a power
+   of two, and is multiplied by the filter rotated by -i. This does not use
+   halevi_shoup.matrix_vector_multiply, which would pad the patch matrix to
+   a square of n_out * m_out diagonals and rotate the vector once per
+   diagonal: here the vector is the filter, which the server holds in the
+   clear, so its rotations are computed in the clear, as siso_convolution
+   does for its punctured filters, and only the k diagonals are multiplied.
+   The diagonals are packed side by side into as few ciphertexts as fit,
+   and summed by rotate-and-sum, so the kernel takes log2 of the number of
+   diagonals per ciphertext rotations.
+ - BICYCLIC (pack_bicyclic): bicyclic.matrix_multiply of the patch matrix by
+   the filter as a column, with the patch matrix zero-padded to a number of
+   columns coprime with its number of rows.
+
+Only stride 1 is supported.
+
+Example:
+
+    packed_filter = pack_toeplitz_diagonal(filter, matrix_shape, pad=1)
+    packed_input = pack_input(matrix, len(packed_filter))
+    result = halevi_shoup.matrix_vector_multiply(packed_filter, packed_input)
+    output = unpack_toeplitz_diagonal(result, matrix_shape, (3, 3), pad=1)
+
+or, choosing the kernel, convolution(matrix, filter, pad, kernel), with
+first_layer=True for the patch matrix variant.
+"""
+
+from math import gcd, log2
+
+import bicyclic
+import halevi_shoup
+from computational_model import Ciphertext, mac
+from plaintext_cache import default_cache
+from profiling import profiled, span
+from util import pad_zeros
+
+DIAGONAL = "diagonal"
+BICYCLIC = "bicyclic"
+KERNELS = [DIAGONAL, BICYCLIC]
+
+
+def output_shape(matrix_shape, filter_shape, pad) -> tuple[int, int]:
+    (n, m), (fn, fm) = matrix_shape, filter_shape
+    return n + 2 * pad - fn + 1, m + 2 * pad - fm + 1
+
+
+def im2col(matrix: list[list[int]], filter_shape, pad: int) -> list[list[int]]:
+    """The patch matrix of the matrix: row i * m_out + j holds the entries
+    under the filter at output position (i, j), in row-major order."""
+    fn, fm = filter_shape
+    n_out, m_out = output_shape((len(matrix), len(matrix[0])), filter_shape, pad)
+    padded = pad_zeros(matrix, pad)
+    return [
+        [padded[i + fi][j + fj] for fi in range(fn) for fj in range(fm)]
+        for i in range(n_out)
+        for j in range(m_out)
+    ]
+
+
+def toeplitz(filter: list[list[int]], matrix_shape, pad: int) -> list[list[int]]:
+    """The Toeplitz matrix of the filter: row i * m_out + j holds, at column
+    k * m + l, the filter tap applied to input entry (k, l) at output
+    position (i, j)."""
+    (n, m), (fn, fm) = matrix_shape, (len(filter), len(filter[0]))
+    n_out, m_out = output_shape(matrix_shape, (fn, fm), pad)
+    rows = [[0] * (n * m) for _ in range(n_out * m_out)]
+    for i in range(n_out):
+        for j in range(m_out):
+            row = rows[i * m_out + j]
+            for fi in range(fn):
+                k = i + fi - pad
+                if not 0 <= k < n:
+                    continue
+                for fj in range(fm):
+                    l = j + fj - pad
+                    if 0 <= l < m:
+                        row[k * m + l] = filter[fi][fj]
+    return rows
+
+
+def pack_input(matrix: list[list[int]], num_slots: int) -> Ciphertext:
+    """Pack the matrix flattened row-major, zero-padded to num_slots slots."""
+    flat = [x for row in matrix for x in row]
+    assert len(flat) <= num_slots
+    return Ciphertext(flat + [0] * (num_slots - len(flat)))
+
+
+def toeplitz_dim(matrix_shape, filter_shape, pad) -> int:
+    """The dimension of the square Toeplitz matrix of the DIAGONAL kernel,
+    which is also the number of slots of its ciphertexts."""
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    return max(n_out * m_out, matrix_shape[0] * matrix_shape[1])
+
+
+@profiled()
+def pack_toeplitz_diagonal(
+    filter: list[list[int]], matrix_shape, pad: int
+) -> list[Ciphertext]:
+    """Pack the filter's Toeplitz matrix, zero-padded to a square, via
+    Halevi-Shoup, to multiply pack_input(matrix, toeplitz_dim(...)) by."""
+    filter_shape = (len(filter), len(filter[0]))
+    dim = toeplitz_dim(matrix_shape, filter_shape, pad)
+    rows = toeplitz(filter, matrix_shape, pad)
+    padded = [row + [0] * (dim - len(row)) for row in rows]
+    padded += [[0] * dim for _ in range(dim - len(rows))]
+    return halevi_shoup.pack(padded)
+
+
+def unpack_toeplitz_diagonal(result: Ciphertext, matrix_shape, filter_shape, pad):
+    return unpack_diagonal(result, matrix_shape, filter_shape, pad)
+
+
+def toeplitz_bicyclic_shape(matrix_shape, filter_shape, pad) -> tuple[int, int]:
+    """The shape of the Toeplitz matrix of the BICYCLIC kernel, whose columns
+    are zero-padded to a number coprime with its rows. The kernel's
+    ciphertexts have rows * cols slots."""
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    rows, cols = n_out * m_out, matrix_shape[0] * matrix_shape[1]
+    while gcd(rows, cols) != 1:
+        cols += 1
+    return rows, cols
+
+
+@profiled()
+def pack_toeplitz_bicyclic(
+    filter: list[list[int]], matrix_shape, pad: int
+) -> Ciphertext:
+    """Bicyclically pack the filter's Toeplitz matrix, to multiply
+    pack_input(matrix, rows * cols) by."""
+    filter_shape = (len(filter), len(filter[0]))
+    rows, cols = toeplitz_bicyclic_shape(matrix_shape, filter_shape, pad)
+    matrix = toeplitz(filter, matrix_shape, pad)
+    padding = [0] * (cols - len(matrix[0]))
+    return bicyclic.pack([row + padding for row in matrix], rows * cols)
+
+
+def tile_rotations(copies: int) -> int:
+    """The number of rotations (and additions) of _tile."""
+    return copies.bit_length() + bin(copies).count("1") - 2
+
+
+def _tile(ciphertext: Ciphertext, block_size: int, copies: int) -> Ciphertext:
+    """Return a ciphertext holding copies of the first block_size slots of the
+    input, which must be zero elsewhere, in consecutive blocks.
+
+    A block of 2^b copies is built by doubling for each bit b of copies, and
+    placed after the copies so far if the bit is set.
+    """
+    result = None
+    block, size, filled = ciphertext, 1, 0
+    while True:
+        if copies & size:
+            placed = block.rotate(filled * block_size)
+            result = placed if result is None else result + placed
+            filled += size
+        if filled == copies:
+            return result
+        block = block + block.rotate(size * block_size)
+        size *= 2
+
+
+@profiled()
+def convolve_toeplitz_bicyclic(
+    packed_toeplitz: Ciphertext,
+    packed_input: Ciphertext,
+    matrix_shape,
+    filter_shape,
+    pad: int,
+) -> Ciphertext:
+    """Multiply the packed Toeplitz matrix by the input packed by pack_input,
+    after repeating the input into its bicyclic encoding as a column."""
+    rows, cols = toeplitz_bicyclic_shape(matrix_shape, filter_shape, pad)
+    with span("replicate"):
+        column = _tile(packed_input, cols, rows)
+    return bicyclic.matrix_multiply(packed_toeplitz, column, rows, cols, 1)
+
+
+def unpack_toeplitz_bicyclic(result: Ciphertext, matrix_shape, filter_shape, pad):
+    return unpack_bicyclic(result, matrix_shape, filter_shape, pad)
+
+
+def _next_power_of_two(x: int) -> int:
+    return 1 << (x - 1).bit_length()
+
+
+def _diagonal_length(matrix_shape, filter_shape, pad) -> int:
+    """The slots of an extended diagonal: the rows of the patch matrix, padded
+    to a multiple of the number of diagonals so that the diagonals wrap
+    around the padded rows."""
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    num_diagonals = _next_power_of_two(filter_shape[0] * filter_shape[1])
+    return -(-n_out * m_out // num_diagonals) * num_diagonals
+
+
+def diagonal_geometry(matrix_shape, filter_shape, pad, num_slots) -> tuple:
+    """The (number of diagonals, slots per diagonal, diagonals per
+    ciphertext) of the DIAGONAL kernel."""
+    num_diagonals = _next_power_of_two(filter_shape[0] * filter_shape[1])
+    length = _diagonal_length(matrix_shape, filter_shape, pad)
+    per_ciphertext = min(num_diagonals, num_slots // length)
+    if per_ciphertext == 0:
+        raise ValueError(f"A diagonal of {length} slots exceeds {num_slots=}")
+    per_ciphertext = 1 << int(log2(per_ciphertext))
+    return num_diagonals, length, per_ciphertext
+
+
+def _extended_diagonals(rows: list[list[int]], num_diagonals, length):
+    """Slot r of diagonal i holds rows[r][(r + i) % num_diagonals], zero
+    outside rows."""
+
+    def entry(r, c):
+        return rows[r][c] if r < len(rows) and c < len(rows[r]) else 0
+
+    return [
+        [entry(r, (r + i) % num_diagonals) for r in range(length)]
+        for i in range(num_diagonals)
+    ]
+
+
+def _side_by_side(diagonals, per_ciphertext) -> list[Ciphertext]:
+    return [
+        Ciphertext(
+            [x for diagonal in diagonals[c : c + per_ciphertext] for x in diagonal]
+        )
+        for c in range(0, len(diagonals), per_ciphertext)
+    ]
+
+
+@profiled()
+def pack_diagonal(
+    matrix: list[list[int]], filter_shape, pad: int, num_slots: int
+) -> list[Ciphertext]:
+    """Pack the extended diagonals of the matrix's patch matrix."""
+    matrix_shape = (len(matrix), len(matrix[0]))
+    num_diagonals, length, per_ciphertext = diagonal_geometry(
+        matrix_shape, filter_shape, pad, num_slots
+    )
+    patches = im2col(matrix, filter_shape, pad)
+    diagonals = _extended_diagonals(patches, num_diagonals, length)
+    return _side_by_side(diagonals, per_ciphertext)
+
+
+@profiled()
+def prepare_filter_diagonal(
+    filter: list[list[int]], matrix_shape, pad: int, num_slots: int
+) -> list[Ciphertext]:
+    """The filter, flattened and rotated in the clear, to multiply each
+    ciphertext of pack_diagonal by."""
+    filter_shape = (len(filter), len(filter[0]))
+    geometry = diagonal_geometry(matrix_shape, filter_shape, pad, num_slots)
+    flat = tuple(x for row in filter for x in row)
+    slots = default_cache.get(
+        "im2col_filter",
+        geometry[1],
+        (flat, geometry),
+        lambda: _prepared_filter_slots(flat, *geometry),
+    )
+    return [Ciphertext(list(s)) for s in slots]
+
+
+def _prepared_filter_slots(flat, num_diagonals, length, per_ciphertext):
+    # Diagonal i is multiplied by the filter, replicated to the length of a
+    # diagonal and rotated by -i.
+    rotated = _extended_diagonals([flat] * length, num_diagonals, length)
+    return tuple(tuple(ct.data) for ct in _side_by_side(rotated, per_ciphertext))
+
+
+@profiled()
+def convolve_diagonal(
+    packed: list[Ciphertext],
+    prepared_filter: list[Ciphertext],
+    matrix_shape,
+    filter_shape,
+    pad: int,
+) -> Ciphertext:
+    """Multiply the packed patch matrix by the prepared filter. The result
+    holds the convolution, flattened row-major, in its first slots."""
+    assert len(packed) == len(prepared_filter)
+    _, length, _ = diagonal_geometry(matrix_shape, filter_shape, pad, len(packed[0]))
+
+    result = packed[0] * prepared_filter[0]
+    for diagonals, filters in zip(packed[1:], prepared_filter[1:]):
+        result = mac(result, diagonals, filters)
+
+    # Sum the diagonals packed side by side into the first.
+    shift = len(result) // 2
+    while shift >= length:
+        result += result.rotate(-shift)
+        shift //= 2
+    return result
+
+
+def unpack_diagonal(result: Ciphertext, matrix_shape, filter_shape, pad: int):
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    data = result.data
+    return [data[i * m_out : (i + 1) * m_out] for i in range(n_out)]
+
+
+def bicyclic_shape(matrix_shape, filter_shape, pad) -> tuple[int, int]:
+    """The shape of the patch matrix of the BICYCLIC kernel, whose columns
+    are zero-padded to a number coprime with its rows."""
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    rows, cols = n_out * m_out, filter_shape[0] * filter_shape[1]
+    while gcd(rows, cols) != 1:
+        cols += 1
+    return rows, cols
+
+
+@profiled()
+def pack_bicyclic(matrix: list[list[int]], filter_shape, pad: int) -> Ciphertext:
+    """Bicyclically pack the matrix's patch matrix."""
+    matrix_shape = (len(matrix), len(matrix[0]))
+    rows, cols = bicyclic_shape(matrix_shape, filter_shape, pad)
+    patches = im2col(matrix, filter_shape, pad)
+    padding = [0] * (cols - len(patches[0]))
+    return bicyclic.pack([row + padding for row in patches], rows * cols)
+
+
+@profiled()
+def prepare_filter_bicyclic(
+    filter: list[list[int]], matrix_shape, pad: int
+) -> Ciphertext:
+    """Bicyclically pack the filter as a column to multiply pack_bicyclic by."""
+    filter_shape = (len(filter), len(filter[0]))
+    rows, cols = bicyclic_shape(matrix_shape, filter_shape, pad)
+    flat = [x for row in filter for x in row]
+    column = [[x] for x in flat + [0] * (cols - len(flat))]
+    return bicyclic.pack(column, rows * cols)
+
+
+@profiled()
+def convolve_bicyclic(
+    packed: Ciphertext, prepared_filter: Ciphertext, matrix_shape, filter_shape, pad
+) -> Ciphertext:
+    rows, cols = bicyclic_shape(matrix_shape, filter_shape, pad)
+    return bicyclic.matrix_multiply(packed, prepared_filter, rows, cols, 1)
+
+
+def unpack_bicyclic(result: Ciphertext, matrix_shape, filter_shape, pad: int):
+    n_out, m_out = output_shape(matrix_shape, filter_shape, pad)
+    column = bicyclic.unpack(result, n_out * m_out, 1)
+    return [[column[i * m_out + j][0] for j in range(m_out)] for i in range(n_out)]
+
+
+def convolution(
+    matrix: list[list[int]],
+    filter: list[list[int]],
+    pad: int = 1,
+    kernel: str = DIAGONAL,
+    num_slots: int = None,
+    first_layer: bool = False,
+) -> list[list[int]]:
+    """Pack, convolve and unpack with the given kernel, on the Toeplitz matrix
+    of the filter, or on the patch matrix of the input if first_layer is set.
+    For the DIAGONAL kernel of the first layer variant, num_slots defaults to
+    the slots of a single diagonal."""
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown {kernel=}, expected one of {KERNELS}")
+    matrix_shape = (len(matrix), len(matrix[0]))
+    filter_shape = (len(filter), len(filter[0]))
+    if not first_layer:
+        if kernel == DIAGONAL:
+            packed_filter = pack_toeplitz_diagonal(filter, matrix_shape, pad)
+            packed_input = pack_input(matrix, len(packed_filter))
+            result = halevi_shoup.matrix_vector_multiply(packed_filter, packed_input)
+            return unpack_toeplitz_diagonal(result, matrix_shape, filter_shape, pad)
+        rows, cols = toeplitz_bicyclic_shape(matrix_shape, filter_shape, pad)
+        packed_filter = pack_toeplitz_bicyclic(filter, matrix_shape, pad)
+        packed_input = pack_input(matrix, rows * cols)
+        result = convolve_toeplitz_bicyclic(
+            packed_filter, packed_input, matrix_shape, filter_shape, pad
+        )
+        return unpack_toeplitz_bicyclic(result, matrix_shape, filter_shape, pad)
+
+    if kernel == DIAGONAL:
+        if num_slots is None:
+            num_slots = _diagonal_length(matrix_shape, filter_shape, pad)
+        packed = pack_diagonal(matrix, filter_shape, pad, num_slots)
+        filters = prepare_filter_diagonal(filter, matrix_shape, pad, num_slots)
+        result = convolve_diagonal(packed, filters, matrix_shape, filter_shape, pad)
+        return unpack_diagonal(result, matrix_shape, filter_shape, pad)
+    packed = pack_bicyclic(matrix, filter_shape, pad)
+    filters = prepare_filter_bicyclic(filter, matrix_shape, pad)
+    result = convolve_bicyclic(packed, filters, matrix_shape, filter_shape, pad)
+    return unpack_bicyclic(result, matrix_shape, filter_shape, pad)
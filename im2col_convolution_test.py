@@ -0,0 +1,133 @@
+import random
+
+import pytest
+
+import halevi_shoup
+from computational_model import Ciphertext, count_ops
+from im2col_convolution import (
+    BICYCLIC,
+    DIAGONAL,
+    KERNELS,
+    _tile,
+    convolution,
+    convolve_diagonal,
+    im2col,
+    pack_diagonal,
+    pack_input,
+    pack_toeplitz_diagonal,
+    prepare_filter_diagonal,
+    tile_rotations,
+    toeplitz,
+)
+from siso_convolution import plaintext_convolution
+
+
+def random_matrix(shape, rng):
+    return [[rng.randint(-5, 5) for _ in range(shape[1])] for _ in range(shape[0])]
+
+
+def test_im2col():
+    matrix = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert im2col(matrix, (2, 2), pad=0) == [
+        [1, 2, 4, 5],
+        [2, 3, 5, 6],
+        [4, 5, 7, 8],
+        [5, 6, 8, 9],
+    ]
+    assert im2col(matrix, (3, 3), pad=1)[0] == [0, 0, 0, 0, 1, 2, 0, 4, 5]
+
+
+def test_toeplitz():
+    # Row r of the Toeplitz matrix is the filter laid over the input.
+    filter = [[1, 2], [3, 4]]
+    assert toeplitz(filter, (3, 3), pad=0) == [
+        [1, 2, 0, 3, 4, 0, 0, 0, 0],
+        [0, 1, 2, 0, 3, 4, 0, 0, 0],
+        [0, 0, 0, 1, 2, 0, 3, 4, 0],
+        [0, 0, 0, 0, 1, 2, 0, 3, 4],
+    ]
+    rng = random.Random(0)
+    matrix = random_matrix((4, 5), rng)
+    filter = random_matrix((3, 3), rng)
+    flat = [x for row in matrix for x in row]
+    products = [
+        sum(a * b for a, b in zip(row, flat)) for row in toeplitz(filter, (4, 5), 1)
+    ]
+    expected = plaintext_convolution(matrix, filter, 1)
+    assert products == [x for row in expected for x in row]
+
+
+@pytest.mark.parametrize("first_layer", [False, True])
+@pytest.mark.parametrize("kernel", KERNELS)
+@pytest.mark.parametrize(
+    "matrix_shape,filter_shape,pad",
+    [
+        ((4, 4), (3, 3), 1),
+        ((8, 8), (3, 3), 1),
+        ((5, 7), (3, 2), 0),
+        ((8, 8), (5, 5), 2),
+        ((6, 6), (1, 1), 0),
+    ],
+)
+def test_convolution(first_layer, kernel, matrix_shape, filter_shape, pad):
+    rng = random.Random(0)
+    matrix = random_matrix(matrix_shape, rng)
+    filter = random_matrix(filter_shape, rng)
+    expected = plaintext_convolution(matrix, filter, pad)
+    result = convolution(matrix, filter, pad, kernel=kernel, first_layer=first_layer)
+    assert result == expected
+
+
+def test_toeplitz_diagonal_rotations():
+    rng = random.Random(0)
+    matrix, filter = random_matrix((4, 4), rng), random_matrix((3, 3), rng)
+    packed_filter = pack_toeplitz_diagonal(filter, (4, 4), 1)
+    packed_input = pack_input(matrix, len(packed_filter))
+    with count_ops() as counts:
+        result = halevi_shoup.matrix_vector_multiply(packed_filter, packed_input)
+
+    # The Halevi-Shoup kernel on the 16 x 16 Toeplitz matrix.
+    assert len(packed_filter) == 16
+    assert counts.rotations == 15
+    assert counts.ct_ct_multiplications == 16
+    assert result.depth == 1
+
+
+@pytest.mark.parametrize("copies", [1, 2, 3, 5, 8, 13])
+def test_tile(copies):
+    x = Ciphertext([1, 2, 3] + [0] * (3 * copies - 3))
+    with count_ops() as counts:
+        result = _tile(x, 3, copies)
+    assert result.data == [1, 2, 3] * copies
+    assert counts.rotations == tile_rotations(copies)
+
+
+@pytest.mark.parametrize("num_slots", [16, 32, 64, 128, 256, 1024])
+def test_diagonal_rotations(num_slots):
+    rng = random.Random(0)
+    matrix, filter = random_matrix((4, 4), rng), random_matrix((3, 3), rng)
+    packed = pack_diagonal(matrix, (3, 3), 1, num_slots)
+    filters = prepare_filter_diagonal(filter, (4, 4), 1, num_slots)
+    with count_ops() as counts:
+        result = convolve_diagonal(packed, filters, (4, 4), (3, 3), 1)
+
+    # 16 diagonals of 16 slots, as many per ciphertext as fit.
+    per_ciphertext = min(16, num_slots // 16)
+    assert len(packed) == 16 // per_ciphertext
+    assert counts.rotations == per_ciphertext.bit_length() - 1
+    assert counts.ct_ct_multiplications == len(packed)
+    assert result.depth == 1
+    assert convolution(matrix, filter, 1, DIAGONAL, num_slots) == (
+        plaintext_convolution(matrix, filter, 1)
+    )
+
+
+def test_diagonal_does_not_fit():
+    with pytest.raises(ValueError):
+        pack_diagonal([[1] * 8] * 8, (3, 3), 1, num_slots=32)
+
+
+def test_unknown_kernel():
+    with pytest.raises(ValueError):
+        convolution([[1]], [[1]], pad=0, kernel="winograd")
+    assert convolution([[2]], [[3]], pad=0, kernel=BICYCLIC) == [[6]]
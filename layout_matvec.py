@@ -0,0 +1,279 @@
+"""A matrix-vector multiplication kernel derived from Fhelipe layouts.
+
+Given the layouts of an n x m matrix and of a length m vector, derive_matvec
+derives a schedule computing their product, which can be costed and
+executed without writing a kernel for the layouts:
+
+ 1. Alignment: the vector is moved into the matrix layout, so that the slot
+    holding matrix[i][j] holds vector[j]. The slots of each matrix
+    ciphertext are grouped by the vector ciphertext and rotation they are
+    read from; each group is a masked rotation. Where the vector layout has
+    several copies of an entry, the copy read with the most common rotation
+    is chosen, to minimize the number of groups. A ciphertext filled by a
+    single group needs no mask, since the matrix is zero outside its data.
+ 2. Multiplication of each matrix ciphertext by its aligned vector.
+ 3. Reduction over the column bits of the matrix layout: the ciphertexts
+    differing only in column bits of the ciphertext index are added, and
+    each column bit of the slots is summed by a rotation and an addition.
+
+The output is left in the matrix layout with its column bits turned into
+gaps, i.e., entry i of the product is in the slot of matrix[i][0]. The gap
+slots are not cleared; see fhelipe_ops.compact to pack the output densely.
+
+Example:
+
+    matrix_layout = Layout([AxisBitRange.parse("d0[3:0]"),
+                            AxisBitRange.parse("d1[3:0]")])
+    vector_layout = Layout([ReplicaBlock(4), AxisBitRange.parse("d0[3:0]")])
+    schedule = derive_matvec(matrix_layout, vector_layout, (16, 16))
+    outputs = schedule.execute(matrix_layout.pack(matrix),
+                               vector_layout.pack(vector))
+    print(schedule.cost(), schedule.unpack(outputs))
+
+MatVecKernel scores matrix layouts by the cost of their derived schedule,
+for autotuner.autotune(shape, num_slots, kernel=MatVecKernel(vector_layout)).
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from computational_model import Ciphertext, OpCounts, mac
+from fhelipe import AxisBit, Layout, entries_from_bits
+from planner import Estimate
+from profiling import profiled
+
+# The axes of a matrix.
+ROW, COLUMN = 0, 1
+
+
+@dataclass(frozen=True)
+class AlignmentGroup:
+    """The slots of an aligned ciphertext read from the vector ciphertext
+    source, rotated by shift, and selected by mask (None if unmasked)."""
+
+    source: int
+    shift: int
+    mask: Optional[tuple[int, ...]]
+
+
+@dataclass(frozen=True)
+class MatVecSchedule:
+    num_slots: int
+    # The groups forming the aligned vector of each matrix ciphertext.
+    alignment: list[list[AlignmentGroup]]
+    # The matrix ciphertexts summed into each output ciphertext.
+    ciphertext_sums: list[list[int]]
+    # The rotations summing the column bits of the slots.
+    slot_shifts: list[int]
+    output_layout: Layout
+    # For each row, the (output ciphertext, slot) holding its entry.
+    output_slots: list[tuple[int, int]]
+
+    def cost(self) -> OpCounts:
+        """The ops performed by execute()."""
+        counts = OpCounts()
+        rotations = {
+            (group.source, group.shift)
+            for groups in self.alignment
+            for group in groups
+            if group.shift
+        }
+        for _, shift in sorted(rotations):
+            counts.rotations += 1
+            counts.rotation_amounts[shift] += 1
+        for groups in self.alignment:
+            counts.ct_pt_multiplications += sum(g.mask is not None for g in groups)
+            counts.additions += max(len(groups) - 1, 0)
+        counts.ct_ct_multiplications += sum(bool(groups) for groups in self.alignment)
+
+        for summands in self.ciphertext_sums:
+            counts.additions += len(summands) - 1
+        for shift in self.slot_shifts:
+            amount = shift % self.num_slots
+            counts.rotations += len(self.ciphertext_sums)
+            counts.rotation_amounts[amount] += len(self.ciphertext_sums)
+            counts.additions += len(self.ciphertext_sums)
+        return counts
+
+    @profiled()
+    def execute(
+        self, packed_matrix: list[Ciphertext], packed_vector: list[Ciphertext]
+    ) -> list[Ciphertext]:
+        """Multiply the packed matrix by the packed vector, returning the
+        ciphertexts of the output layout."""
+        assert len(packed_matrix) == len(self.alignment)
+
+        # Rotations of the vector shared by the matrix ciphertexts.
+        rotated = {}
+        products = []
+        for groups, matrix_ct in zip(self.alignment, packed_matrix):
+            if not groups:
+                # The ciphertext holds no entries of the matrix.
+                products.append(matrix_ct)
+                continue
+            aligned = None
+            for group in groups:
+                key = (group.source, group.shift)
+                if key not in rotated:
+                    rotated[key] = packed_vector[group.source].rotate(group.shift)
+                term = rotated[key]
+                if group.mask is None:
+                    aligned = term
+                elif aligned is None:
+                    aligned = term * group.mask
+                else:
+                    aligned = mac(aligned, term, group.mask)
+            products.append(matrix_ct * aligned)
+
+        outputs = []
+        for summands in self.ciphertext_sums:
+            result = products[summands[0]]
+            for index in summands[1:]:
+                result = result + products[index]
+            for shift in self.slot_shifts:
+                result = result + result.rotate(shift)
+            outputs.append(result)
+        return outputs
+
+    def unpack(self, outputs: list[Ciphertext]) -> list[int]:
+        """The entries of the product from the output ciphertexts."""
+        return [outputs[ct].data[slot] for ct, slot in self.output_slots]
+
+
+def _positions(layout: Layout, shape) -> dict:
+    """Map each tensor index to the (ciphertext, slot) positions holding it."""
+    positions = {}
+    for ct, indices in enumerate(layout.expand_ciphertexts(shape)):
+        for slot, index in enumerate(indices):
+            if index is not None:
+                positions.setdefault(index, []).append((ct, slot))
+    return positions
+
+
+def _align(matrix_indices, vector_positions, num_slots):
+    """Choose the vector position read by each matrix slot, grouped into
+    masked rotations per matrix ciphertext."""
+    # Count how often each (source, shift) could be used, to prefer the most
+    # common ones when an entry has several copies.
+    options = {}
+    popularity = Counter()
+    for ct, indices in enumerate(matrix_indices):
+        for slot, index in enumerate(indices):
+            if index is None:
+                continue
+            candidates = {
+                (source, (slot - source_slot) % num_slots)
+                for source, source_slot in vector_positions[(index[COLUMN],)]
+            }
+            options[(ct, slot)] = candidates
+            popularity.update(candidates)
+
+    alignment = []
+    for ct, indices in enumerate(matrix_indices):
+        chosen = {}
+        for slot, index in enumerate(indices):
+            if index is None:
+                continue
+            best = min(
+                options[(ct, slot)],
+                key=lambda option: (-popularity[option], option[1], option[0]),
+            )
+            chosen.setdefault(best, []).append(slot)
+
+        groups = []
+        for (source, shift), slots in sorted(chosen.items()):
+            mask = None
+            if len(chosen) > 1:
+                selected = set(slots)
+                mask = tuple(int(s in selected) for s in range(num_slots))
+            groups.append(AlignmentGroup(source, shift, mask))
+        alignment.append(groups)
+    return alignment
+
+
+def _is_column(bit) -> bool:
+    return isinstance(bit, AxisBit) and bit.axis == COLUMN
+
+
+def _output_layout(matrix_layout: Layout) -> Layout:
+    """The matrix layout with its column slot bits turned into gaps, and its
+    column ciphertext index bits, which are summed away, removed."""
+    ciphertext_bits, slot_bits = matrix_layout.split_bits()
+    bits = [bit for bit in ciphertext_bits if not _is_column(bit)]
+    bits += [None if _is_column(bit) else bit for bit in slot_bits]
+    return Layout(entries_from_bits(bits), num_slots=matrix_layout.num_slots)
+
+
+def derive_matvec(
+    matrix_layout: Layout, vector_layout: Layout, shape: tuple[int, int]
+) -> MatVecSchedule:
+    """Derive the schedule multiplying a matrix of the given shape packed with
+    matrix_layout by a vector packed with vector_layout."""
+    n, m = shape
+    num_slots = matrix_layout.num_slots
+    assert vector_layout.num_slots == num_slots, "The layouts' slot counts differ"
+
+    vector_positions = _positions(vector_layout, (m,))
+    missing = [j for j in range(m) if (j,) not in vector_positions]
+    if missing:
+        raise ValueError(f"The vector layout does not hold entries {missing}")
+    matrix_indices = matrix_layout.expand_ciphertexts(shape)
+    alignment = _align(matrix_indices, vector_positions, num_slots)
+
+    # The matrix ciphertexts are grouped by their index with the column bits
+    # cleared, and slot s gathers slot s + 2^p for each column slot bit p.
+    ciphertext_bits, slot_bits = matrix_layout.split_bits()
+    column_mask = 0
+    for p, bit in enumerate(reversed(ciphertext_bits)):
+        if _is_column(bit):
+            column_mask |= 1 << p
+    slot_shifts = [
+        -(1 << p) for p, bit in enumerate(reversed(slot_bits)) if _is_column(bit)
+    ]
+
+    groups = {}
+    for ct in range(matrix_layout.num_ciphertexts):
+        groups.setdefault(ct & ~column_mask, []).append(ct)
+    ciphertext_sums = [groups[key] for key in sorted(groups)]
+
+    # Entry i of the product is in the slot of matrix[i][0], in the output
+    # ciphertext of the matrix ciphertext holding it.
+    output_of = {ct: k for k, cts in enumerate(ciphertext_sums) for ct in cts}
+    output_slots = [None] * n
+    for ct, indices in enumerate(matrix_indices):
+        for slot, index in enumerate(indices):
+            if index is not None and index[COLUMN] == 0:
+                if output_slots[index[ROW]] is None:
+                    output_slots[index[ROW]] = (output_of[ct], slot)
+
+    return MatVecSchedule(
+        num_slots=num_slots,
+        alignment=alignment,
+        ciphertext_sums=ciphertext_sums,
+        slot_shifts=slot_shifts,
+        output_layout=_output_layout(matrix_layout),
+        output_slots=output_slots,
+    )
+
+
+@dataclass(frozen=True)
+class MatVecKernel:
+    """An autotuner kernel estimating the ops of the derived matrix-vector
+    multiplication of a matrix in a layout by a vector in vector_layout."""
+
+    vector_layout: Layout
+
+    def __call__(self, layout: Layout, shape) -> Estimate:
+        schedule = derive_matvec(layout, self.vector_layout, shape)
+        counts = schedule.cost()
+        masked = counts.ct_pt_multiplications > 0
+        used = sum(index is not None for index in layout.expand(shape))
+        return Estimate(
+            rotations=counts.rotations,
+            ct_ct_multiplications=counts.ct_ct_multiplications,
+            ct_pt_multiplications=counts.ct_pt_multiplications,
+            additions=counts.additions,
+            depth=2 if masked else 1,
+            slot_utilization=used / (layout.num_ciphertexts * layout.num_slots),
+        )
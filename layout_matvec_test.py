@@ -0,0 +1,125 @@
+import pytest
+
+from autotuner import autotune
+from computational_model import count_ops
+from fhelipe import AxisBitRange, GapBlock, Layout, ReplicaBlock
+from layout_matvec import MatVecKernel, derive_matvec
+
+
+def matrix_of(n, m):
+    return [[(3 * i + 5 * j) % 7 - 3 for j in range(m)] for i in range(n)]
+
+
+def vector_of(m):
+    return [(2 * j) % 5 - 1 for j in range(m)]
+
+
+def check(matrix_layout, vector_layout, shape):
+    n, m = shape
+    matrix, vector = matrix_of(n, m), vector_of(m)
+    schedule = derive_matvec(matrix_layout, vector_layout, shape)
+
+    packed_matrix = matrix_layout.pack(matrix, shape)
+    packed_vector = vector_layout.pack(vector, (m,))
+    with count_ops() as counts:
+        outputs = schedule.execute(packed_matrix, packed_vector)
+    assert counts == schedule.cost()
+
+    expected = [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+    assert schedule.unpack(outputs) == expected
+    assert len(outputs) == schedule.output_layout.num_ciphertexts
+    # The output layout places each entry where unpack() reads it.
+    for ct, indices in enumerate(schedule.output_layout.expand_ciphertexts((n,))):
+        for slot, index in enumerate(indices):
+            if index is not None:
+                assert outputs[ct].data[slot] == expected[index[0]]
+    return schedule
+
+
+def test_row_major_replicated_vector():
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), AxisBitRange.parse("d1[1:0]")])
+    vector_layout = Layout([ReplicaBlock(2), AxisBitRange.parse("d0[1:0]")])
+    schedule = check(layout, vector_layout, (4, 4))
+
+    cost = schedule.cost()
+    # The vector is already aligned, and each column bit takes a rotation.
+    assert cost.ct_pt_multiplications == 0
+    assert cost.ct_ct_multiplications == 1
+    assert cost.rotations == 2
+    assert str(schedule.output_layout) == "[d0[1:0:-1] 2*g]"
+
+
+def test_row_major_compact_vector():
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), AxisBitRange.parse("d1[1:0]")])
+    vector_layout = Layout([GapBlock(2), AxisBitRange.parse("d0[1:0]")])
+    cost = check(layout, vector_layout, (4, 4)).cost()
+    # Each row reads the vector with its own rotation.
+    assert cost.ct_pt_multiplications == 4
+    assert cost.rotations == 3 + 2
+
+
+def test_column_major():
+    layout = Layout([AxisBitRange.parse("d1[1:0]"), AxisBitRange.parse("d0[2:0]")])
+    vector_layout = Layout([AxisBitRange.parse("d0[1:0]"), ReplicaBlock(3)])
+    cost = check(layout, vector_layout, (8, 4)).cost()
+    assert cost.ct_pt_multiplications == 0
+    assert cost.rotation_amounts == {32 - 16: 1, 32 - 8: 1}
+
+
+def test_multiple_ciphertexts():
+    # Rows 0-3 and 4-7 are in separate ciphertexts, as are columns 0-1
+    # and 2-3, whose products are added.
+    layout = Layout(
+        [
+            AxisBitRange.parse("d1[1:1]"),
+            AxisBitRange.parse("d0[2:0]"),
+            AxisBitRange.parse("d1[0:0]"),
+        ],
+        num_slots=8,
+    )
+    vector_layout = Layout(
+        [AxisBitRange.parse("d0[1:1]"), ReplicaBlock(2), AxisBitRange.parse("d0[0:0]")],
+        num_slots=8,
+    )
+    schedule = check(layout, vector_layout, (8, 4))
+    assert schedule.ciphertext_sums == [[0, 2], [1, 3]]
+    assert schedule.output_layout.num_ciphertexts == 2
+
+
+def test_gapped_matrix_layout():
+    layout = Layout(
+        [AxisBitRange.parse("d0[1:0]"), GapBlock(1), AxisBitRange.parse("d1[1:0]")]
+    )
+    vector_layout = Layout([ReplicaBlock(3), AxisBitRange.parse("d0[1:0]")])
+    check(layout, vector_layout, (4, 4))
+
+
+def test_missing_vector_entries():
+    layout = Layout([AxisBitRange.parse("d0[1:0]"), AxisBitRange.parse("d1[1:0]")])
+    vector_layout = Layout([GapBlock(3), AxisBitRange.parse("d0[0:0]")])
+    with pytest.raises(ValueError):
+        derive_matvec(layout, vector_layout, (4, 4))
+
+
+def test_empty_matrix_ciphertexts():
+    layout = Layout(
+        [GapBlock(1), AxisBitRange.parse("d0[1:0]"), AxisBitRange.parse("d1[1:0]")],
+        num_slots=16,
+    )
+    vector_layout = Layout(
+        [ReplicaBlock(2), AxisBitRange.parse("d0[1:0]")], num_slots=16
+    )
+    schedule = check(layout, vector_layout, (4, 4))
+    assert schedule.cost().ct_ct_multiplications == 1
+
+
+def test_autotune_with_derived_kernel():
+    vector_layout = Layout(
+        [ReplicaBlock(2), AxisBitRange.parse("d0[1:0]")], num_slots=16
+    )
+    kernel = MatVecKernel(vector_layout)
+    best = autotune((4, 4), num_slots=16, kernel=kernel, k=1, max_workers=1)[0]
+    # The row-major layout needs no alignment.
+    assert str(best.layout) == "[d0[1:0:-1] d1[1:0:-1]]"
+    assert best.estimate.ct_pt_multiplications == 0
+    assert best.estimate.rotations == 2
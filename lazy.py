@@ -0,0 +1,379 @@
+"""Lazy evaluation of ciphertext operations via an optimized expression DAG.
+
+Wrapping ciphertexts with wrap() makes every operation on them build a node
+of an expression DAG instead of executing eagerly. The kernels in this
+repository work unchanged on wrapped inputs, e.g.,
+
+    packed = lazy.wrap(halevi_shoup.pack(matrix))
+    result = halevi_shoup.matrix_vector_multiply(packed, lazy.wrap(vector))
+    [output] = lazy.evaluate(result)
+
+Before evaluation the DAG is optimized:
+
+ - Common subexpressions, such as identical rotations of the same input
+   across kernel calls, are computed once.
+ - Nested rotations are folded into a single rotation, and rotations by a
+   multiple of the slot count are removed.
+ - Additions of, and multiplications by, zero are removed, and anything not
+   reachable from the requested outputs is never computed.
+ - Chains of additions are reassociated into balanced trees.
+
+The optimized DAG is evaluated once, with each intermediate result released
+as soon as its last consumer has been computed, and op_counts reports the
+operations the evaluation performs.
+"""
+
+from computational_model import Ciphertext, OpCounts
+
+INPUT = "input"
+ZERO = "zero"
+ROTATE = "rotate"
+ADD = "add"
+MUL = "mul"
+MUL_PLAIN = "mul_plain"
+
+
+class Node:
+    """A node of the expression DAG.
+
+    The value of an INPUT node is its Ciphertext, of a ROTATE node the
+    rotation amount, and of a MUL_PLAIN node the plaintext (a list of slot
+    values or a scalar). ADD nodes may have any number of args.
+    """
+
+    __slots__ = ("op", "args", "value", "dim", "original_shape")
+
+    def __init__(self, op, args=(), value=None, dim=None, original_shape=None):
+        self.op = op
+        self.args = tuple(args)
+        self.value = value
+        self.dim = dim if dim is not None else args[0].dim
+        self.original_shape = original_shape
+        if original_shape is None and args:
+            self.original_shape = args[0].original_shape
+
+
+class LazyCiphertext:
+    """A ciphertext whose value is computed by an expression DAG."""
+
+    def __init__(self, node: Node):
+        self.node = node
+
+    @property
+    def dim(self) -> int:
+        return self.node.dim
+
+    @property
+    def original_shape(self):
+        return self.node.original_shape
+
+    def __len__(self) -> int:
+        return self.dim
+
+    def __add__(self, other) -> "LazyCiphertext":
+        other_node = _as_node(other)
+        if other_node is None:
+            return NotImplemented
+        assert self.dim == other_node.dim
+        return LazyCiphertext(Node(ADD, (self.node, other_node)))
+
+    __radd__ = __add__
+
+    def __mul__(self, other) -> "LazyCiphertext":
+        if isinstance(other, (list, tuple, int)):
+            if not isinstance(other, int):
+                assert self.dim == len(other)
+            return LazyCiphertext(Node(MUL_PLAIN, (self.node,), value=other))
+
+        other_node = _as_node(other)
+        if other_node is None:
+            return NotImplemented
+        assert self.dim == other_node.dim
+        return LazyCiphertext(Node(MUL, (self.node, other_node)))
+
+    __rmul__ = __mul__
+
+    def rotate(self, n: int) -> "LazyCiphertext":
+        """Rotate a ciphertext rightward n positions."""
+        return LazyCiphertext(Node(ROTATE, (self.node,), value=n))
+
+    def evaluate(self) -> Ciphertext:
+        return evaluate(self)[0]
+
+    @property
+    def data(self) -> list[int]:
+        """The slot values, which forces evaluation of the DAG."""
+        return self.evaluate().data
+
+    def __repr__(self) -> str:
+        return f"LazyCiphertext({self.node.op}, dim={self.dim})"
+
+
+def _as_node(value):
+    if isinstance(value, LazyCiphertext):
+        return value.node
+    if isinstance(value, Ciphertext):
+        return wrap(value).node
+    return None
+
+
+def wrap(value):
+    """Wrap a Ciphertext, or a (nested) list of Ciphertexts, for lazy
+    evaluation."""
+    if isinstance(value, Ciphertext):
+        op = INPUT if any(value.data) else ZERO
+        return LazyCiphertext(
+            Node(op, value=value, dim=value.dim, original_shape=value.original_shape)
+        )
+    if isinstance(value, list):
+        return [wrap(x) for x in value]
+    raise TypeError(f"Cannot wrap {type(value)}")
+
+
+def _postorder(roots: list[Node]) -> list[Node]:
+    """Return the nodes reachable from roots, each after all its args."""
+    order, seen = [], set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        stack.extend((arg, False) for arg in reversed(node.args) if id(arg) not in seen)
+    return order
+
+
+def _use_counts(order: list[Node]) -> dict[int, int]:
+    uses = {id(node): 0 for node in order}
+    for node in order:
+        for arg in node.args:
+            uses[id(arg)] += 1
+    return uses
+
+
+def _plaintext_key(plaintext):
+    return plaintext if isinstance(plaintext, int) else tuple(plaintext)
+
+
+class _Builder:
+    """Builds hash-consed nodes, so that structurally identical nodes are
+    shared, applying local simplifications along the way."""
+
+    def __init__(self):
+        self.nodes = {}
+
+    def intern(self, key, make) -> Node:
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = make()
+        return node
+
+    def zero(self, like: Node) -> Node:
+        return self.intern(
+            (ZERO, like.dim, like.original_shape),
+            lambda: Node(ZERO, dim=like.dim, original_shape=like.original_shape),
+        )
+
+    def input(self, node: Node) -> Node:
+        return self.intern((INPUT, id(node.value)), lambda: node)
+
+    def rotate(self, arg: Node, amount: int) -> Node:
+        if arg.op == ROTATE:
+            arg, amount = arg.args[0], arg.value + amount
+        amount %= arg.dim
+        if arg.op == ZERO or amount == 0:
+            return arg
+        return self.intern(
+            (ROTATE, id(arg), amount), lambda: Node(ROTATE, (arg,), value=amount)
+        )
+
+    def add(self, args: list[Node], like: Node) -> Node:
+        args = [arg for arg in args if arg.op != ZERO]
+        if not args:
+            return self.zero(like)
+        if len(args) == 1:
+            return args[0]
+        args.sort(key=id)
+        return self.intern(
+            (ADD, tuple(id(arg) for arg in args)), lambda: Node(ADD, args)
+        )
+
+    def mul(self, lhs: Node, rhs: Node) -> Node:
+        if lhs.op == ZERO or rhs.op == ZERO:
+            return self.zero(lhs)
+        lhs, rhs = sorted((lhs, rhs), key=id)
+        return self.intern((MUL, id(lhs), id(rhs)), lambda: Node(MUL, (lhs, rhs)))
+
+    def mul_plain(self, arg: Node, plaintext) -> Node:
+        key = _plaintext_key(plaintext)
+        if arg.op == ZERO or key == 0 or (not isinstance(key, int) and not any(key)):
+            return self.zero(arg)
+        if key == 1:
+            return arg
+        return self.intern(
+            (MUL_PLAIN, id(arg), key),
+            lambda: Node(MUL_PLAIN, (arg,), value=plaintext),
+        )
+
+
+def _rewrite(roots: list[Node], rewrite_node) -> list[Node]:
+    new = {}
+    for node in _postorder(roots):
+        new[id(node)] = rewrite_node(node, [new[id(arg)] for arg in node.args])
+    return [new[id(root)] for root in roots]
+
+
+def _optimize_nodes(roots: list[Node]) -> list[Node]:
+    # First pass: common subexpression elimination and local simplifications.
+    builder = _Builder()
+
+    def simplify(node, args):
+        if node.op == INPUT:
+            return builder.input(node)
+        if node.op == ZERO:
+            return builder.zero(node)
+        if node.op == ROTATE:
+            return builder.rotate(args[0], node.value)
+        if node.op == ADD:
+            return builder.add(args, node)
+        if node.op == MUL:
+            return builder.mul(*args)
+        if node.op == MUL_PLAIN:
+            return builder.mul_plain(args[0], node.value)
+        raise ValueError(f"Unknown op {node.op}")
+
+    roots = _rewrite(roots, simplify)
+
+    # Second pass: flatten chains of additions into a single n-ary addition,
+    # which evaluate() computes as a balanced tree. Additions whose result is
+    # used more than once are kept, to avoid recomputing them.
+    uses = _use_counts(_postorder(roots))
+
+    def flatten(node, args):
+        if node.op == ADD:
+            terms = []
+            for old_arg, arg in zip(node.args, args):
+                if arg.op == ADD and uses[id(old_arg)] == 1:
+                    terms.extend(arg.args)
+                else:
+                    terms.append(arg)
+            return Node(ADD, terms)
+        if all(arg is old_arg for arg, old_arg in zip(args, node.args)):
+            return node
+        return Node(
+            node.op,
+            args,
+            value=node.value,
+            dim=node.dim,
+            original_shape=node.original_shape,
+        )
+
+    return _rewrite(roots, flatten)
+
+
+def _nodes(outputs) -> list[Node]:
+    return [output.node for output in outputs]
+
+
+def optimize(*outputs: LazyCiphertext) -> list[LazyCiphertext]:
+    """Return the outputs computed by an optimized DAG."""
+    return [LazyCiphertext(node) for node in _optimize_nodes(_nodes(outputs))]
+
+
+def op_counts(*outputs: LazyCiphertext) -> OpCounts:
+    """Count the operations evaluate() performs to compute the outputs."""
+    counts = OpCounts()
+    for node in _postorder(_optimize_nodes(_nodes(outputs))):
+        if node.op == ROTATE:
+            counts.rotations += 1
+            counts.rotation_amounts[node.value] += 1
+        elif node.op == MUL:
+            counts.ct_ct_multiplications += 1
+        elif node.op == MUL_PLAIN:
+            counts.ct_pt_multiplications += 1
+        elif node.op == ADD:
+            counts.additions += len(node.args) - 1
+    return counts
+
+
+def _balanced_sum(values: list[Ciphertext]) -> Ciphertext:
+    while len(values) > 1:
+        paired = [values[i] + values[i + 1] for i in range(0, len(values) - 1, 2)]
+        if len(values) % 2:
+            paired.append(values[-1])
+        values = paired
+    return values[0]
+
+
+class Schedule:
+    """The optimized DAG computing some outputs, in evaluation order."""
+
+    def __init__(self, roots: list[Node]):
+        # The nodes computing the outputs, in order.
+        self.roots = roots
+        # Every node of the DAG, each after all its args.
+        self.order = _postorder(roots)
+
+    def use_counts(self) -> dict[int, int]:
+        """The number of consumers of each node, keyed by id. Each output
+        counts as one more consumer of its root, so that an evaluation
+        releasing the value of a node after its last consumer never releases
+        the outputs."""
+        uses = _use_counts(self.order)
+        for root in self.roots:
+            uses[id(root)] += 1
+        return uses
+
+    def wavefronts(self) -> list[list[Node]]:
+        """Partition the nodes into wavefronts, where the args of each node
+        are in earlier wavefronts, so the nodes of a wavefront are
+        independent of each other."""
+        # The wavefront of a node is one more than the latest of its args.
+        wavefront = {}
+        for node in self.order:
+            wavefront[id(node)] = 1 + max(
+                (wavefront[id(arg)] for arg in node.args), default=-1
+            )
+        waves = [[] for _ in range(1 + max(wavefront.values(), default=-1))]
+        for node in self.order:
+            waves[wavefront[id(node)]].append(node)
+        return waves
+
+
+def schedule(*outputs: LazyCiphertext) -> Schedule:
+    """Optimize the DAG computing the outputs, for evaluation."""
+    return Schedule(_optimize_nodes(_nodes(outputs)))
+
+
+def evaluate(*outputs: LazyCiphertext) -> list[Ciphertext]:
+    """Optimize the DAG computing the outputs and evaluate it."""
+    plan = schedule(*outputs)
+    remaining_uses = plan.use_counts()
+
+    values = {}
+    for node in plan.order:
+        args = [values[id(arg)] for arg in node.args]
+        if node.op == INPUT:
+            value = node.value
+        elif node.op == ZERO:
+            value = Ciphertext([0] * node.dim, original_shape=node.original_shape)
+        elif node.op == ROTATE:
+            value = args[0].rotate(node.value)
+        elif node.op == ADD:
+            value = _balanced_sum(args)
+        elif node.op == MUL:
+            value = args[0] * args[1]
+        elif node.op == MUL_PLAIN:
+            value = args[0] * node.value
+        values[id(node)] = value
+
+        for arg in node.args:
+            remaining_uses[id(arg)] -= 1
+            if remaining_uses[id(arg)] == 0:
+                del values[id(arg)]
+
+    return [values[id(root)] for root in plan.roots]
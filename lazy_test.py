@@ -0,0 +1,103 @@
+import bicyclic
+import halevi_shoup
+import lazy
+import siso_convolution
+from computational_model import Ciphertext, count_ops, rotate_and_sum
+
+
+def eager_and_lazy(fn, *inputs):
+    """Run fn on the inputs eagerly and lazily, returning the results and
+    the op counts of both."""
+    with count_ops() as eager_counts:
+        eager = fn(*inputs)
+
+    lazy_result = fn(*lazy.wrap(list(inputs)))
+    with count_ops() as lazy_counts:
+        [evaluated] = lazy.evaluate(lazy_result)
+    assert lazy.op_counts(lazy_result) == lazy_counts
+    return eager, evaluated, eager_counts, lazy_counts
+
+
+def test_lazy_matrix_vector_multiply():
+    matrix = [[1, 2, 3, 4], [3, 4, 5, 6], [5, 6, 7, 8], [6, 7, 8, 9]]
+    vector = Ciphertext([1, -1, 2, 0])
+    eager, evaluated, eager_counts, lazy_counts = eager_and_lazy(
+        halevi_shoup.matrix_vector_multiply, halevi_shoup.pack(matrix), vector
+    )
+    assert evaluated == eager
+    assert lazy_counts == eager_counts
+
+
+def test_lazy_bicyclic_drops_zero_accumulator():
+    a = [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10], [11, 12, 13, 14, 15]]
+    b = [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]]
+    eager, evaluated, eager_counts, lazy_counts = eager_and_lazy(
+        lambda x, y: bicyclic.matrix_multiply(x, y, 3, 5, 2),
+        bicyclic.pack(a, 30),
+        bicyclic.pack(b, 30),
+    )
+    assert evaluated == eager
+    assert lazy_counts.additions == eager_counts.additions - 1
+
+
+def test_lazy_shares_rotations_across_calls():
+    matrix = [[i * 4 + j for j in range(4)] for i in range(4)]
+    filter = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    packed = lazy.wrap(siso_convolution.pack_rowwise(matrix))
+    filters = siso_convolution.prepare_filters((4, 4), filter, pad=1)
+    doubled = lazy.wrap(siso_convolution.prepare_filters((4, 4), filter, pad=1))
+    for row in doubled:
+        for j, f in enumerate(row):
+            row[j] = f * 2
+
+    first = siso_convolution.siso_convolution(packed, (4, 4), filters, pad=1)
+    second = siso_convolution.siso_convolution(packed, (4, 4), doubled, pad=1)
+    counts = lazy.op_counts(first, second)
+    single = lazy.op_counts(first)
+
+    # The rotations of the packed matrix are shared by both convolutions.
+    assert counts.rotations == single.rotations == 8
+
+    result_first, result_second = lazy.evaluate(first, second)
+    assert [2 * x for x in result_first.data] == result_second.data
+
+
+def test_fold_rotations():
+    x = lazy.wrap(Ciphertext(list(range(8))))
+    assert lazy.op_counts(x.rotate(3).rotate(-1).rotate(4)).rotations == 1
+    assert x.rotate(3).rotate(-1).rotate(4).data == [2, 3, 4, 5, 6, 7, 0, 1]
+    assert lazy.op_counts(x.rotate(3).rotate(-1).rotate(6)).rotations == 0
+
+
+def test_reassociate_additions():
+    inputs = [Ciphertext([i] * 4) for i in range(1, 9)]
+    wrapped = lazy.wrap(inputs)
+    total = wrapped[0]
+    for x in wrapped[1:]:
+        total = total + x
+
+    [result] = lazy.evaluate(total)
+    assert result.data == [36] * 4
+    assert lazy.op_counts(total).additions == 7
+
+    # A shared partial sum is computed only once.
+    partial = wrapped[0] + wrapped[1]
+    counts = lazy.op_counts(partial + wrapped[2], partial + wrapped[3])
+    assert counts.additions == 3
+
+
+def test_dead_code_elimination():
+    x = lazy.wrap(Ciphertext([1, 2, 3, 4]))
+    unused = x * x  # never requested, so never computed
+    used = x.rotate(1) + x * 0
+    with count_ops() as counts:
+        [result] = lazy.evaluate(used)
+    assert result.data == [4, 1, 2, 3]
+    assert counts.rotations == 1
+    assert counts.ct_ct_multiplications == counts.additions == 0
+    del unused
+
+
+def test_lazy_rotate_and_sum():
+    x = lazy.wrap(Ciphertext(list(range(16))))
+    assert rotate_and_sum(x).data == [120] * 16
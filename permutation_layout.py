@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
+from collections import Counter
 from dataclasses import dataclass
 import itertools
+from math import prod
+from operator import add, attrgetter, floordiv, itemgetter, mul
 
 
 @dataclass(frozen=True, order=True)
@@ -32,6 +35,75 @@ class PermutationEntry:
         return f"{self.codomain_index} -> {self.domain_index}"
 
 
+@dataclass(frozen=True)
+class SlotUtilization:
+    """The number of slots of each ciphertext of a layout's codomain holding
+    data, where the last axis of the codomain indexes the slots."""
+
+    used_slots: tuple[int, ...]
+    slots_per_ciphertext: int
+
+    @property
+    def used(self) -> int:
+        return sum(self.used_slots)
+
+    @property
+    def total(self) -> int:
+        return len(self.used_slots) * self.slots_per_ciphertext
+
+    @property
+    def fraction(self) -> float:
+        return self.used / self.total if self.total else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.used}/{self.total} slots used ({self.fraction:.1%}) "
+            f"in {len(self.used_slots)} ciphertexts"
+        )
+
+
+def _linear_offsets(indices: list[tuple], shape, kind: str) -> list[int]:
+    """Check every index is within shape, and return their row-major offsets.
+
+    The indices are checked an axis at a time, with min, max and map over the
+    column of the axis, rather than an index at a time.
+    """
+    if not indices:
+        return []
+    if set(map(len, indices)) != {len(shape)}:
+        raise ValueError(f"Expected {kind} indices with {len(shape)} axes")
+
+    offsets = None
+    for axis, size in enumerate(shape):
+        column = list(map(itemgetter(axis), indices))
+        if min(column) < 0 or max(column) >= size:
+            bad = next(index for index in indices if not 0 <= index[axis] < size)
+            raise ValueError(f"The {kind} index {bad} is out of bounds of {shape}")
+        if offsets is None:
+            offsets = column
+        else:
+            offsets = list(map(add, map(mul, offsets, itertools.repeat(size)), column))
+    return offsets
+
+
+def _unravel(offset: int, shape) -> tuple[int, ...]:
+    index = []
+    for size in reversed(shape):
+        offset, i = divmod(offset, size)
+        index.append(i)
+    return tuple(reversed(index))
+
+
+def _first_repeat(offsets: list[int]) -> tuple[int, int]:
+    """The positions of the first two equal offsets."""
+    seen = {}
+    for position, offset in enumerate(offsets):
+        if offset in seen:
+            return seen[offset], position
+        seen[offset] = position
+    raise AssertionError("No repeated offset")
+
+
 class Layout:
 
     def __init__(self, domain_shape, codomain_shape, entries, reversed=False):
@@ -43,15 +115,46 @@ class Layout:
             return x.codomain_index if self.reversed else x.domain_index
 
         self.entries = list(sorted(entries, key=sort_key))
-        # self.verify()
-
-    def verify(self):
-        for entry in self.entries:
-            for index, size in zip(entry.domain_index, self.domain_shape):
-                assert index < size, f"{index=} but {size=}"
-
-            for index, size in zip(entry.codomain_index, self.codomain_shape):
-                assert index < size, f"{index=} but {size=}"
+        self.utilization = self.verify()
+
+    def verify(self) -> SlotUtilization:
+        """Check the layout maps every entry of the domain to a distinct slot
+        of the codomain, raising a ValueError otherwise, and return the slot
+        utilization of the codomain.
+
+        Runs in O(len(entries)) time, and is cheap enough to run on every
+        layout constructed.
+        """
+        domain = list(map(attrgetter("domain_index"), self.entries))
+        codomain = list(map(attrgetter("codomain_index"), self.entries))
+        domain_offsets = _linear_offsets(domain, self.domain_shape, "domain")
+        codomain_offsets = _linear_offsets(codomain, self.codomain_shape, "codomain")
+
+        if len(set(codomain_offsets)) != len(codomain_offsets):
+            i, j = _first_repeat(codomain_offsets)
+            raise ValueError(
+                f"{domain[i]} and {domain[j]} are both mapped to {codomain[i]}"
+            )
+        if len(set(domain_offsets)) != len(domain_offsets):
+            i, j = _first_repeat(domain_offsets)
+            raise ValueError(
+                f"{domain[i]} is mapped to both {codomain[i]} and {codomain[j]}"
+            )
+        domain_size = prod(self.domain_shape)
+        if len(domain_offsets) != domain_size:
+            mapped = set(domain_offsets)
+            missing = next(i for i in range(domain_size) if i not in mapped)
+            raise ValueError(f"{_unravel(missing, self.domain_shape)} is not mapped")
+
+        slots = self.codomain_shape[-1]
+        per_ciphertext = Counter(
+            map(floordiv, codomain_offsets, itertools.repeat(slots))
+        )
+        num_ciphertexts = prod(self.codomain_shape[:-1])
+        return SlotUtilization(
+            used_slots=tuple(per_ciphertext[c] for c in range(num_ciphertexts)),
+            slots_per_ciphertext=slots,
+        )
 
     def __str__(self):
         if self.reversed:
@@ -1,11 +1,15 @@
+import pytest
+
 from permutation_layout import Add
 from permutation_layout import AffineExpr
 from permutation_layout import AffineMap
 from permutation_layout import Constant
 from permutation_layout import DimId
 from permutation_layout import FloorDiv
+from permutation_layout import Layout
 from permutation_layout import Mod
 from permutation_layout import Mul
+from permutation_layout import PermutationEntry
 from permutation_layout import column_major_layout
 from permutation_layout import from_affine_map
 from permutation_layout import row_major_layout
@@ -186,3 +190,78 @@ def test_multi_ciphertext_column_major_layout():
     )
     layout = from_affine_map(affine_map, data_shape, ciphertext_shape)
     assert str(layout) == expected
+
+
+def test_slot_utilization():
+    layout = row_major_layout((4, 6), (2, 16))
+    assert layout.utilization.used_slots == (16, 8)
+    assert layout.utilization.fraction == 0.75
+    assert str(layout.utilization) == "24/32 slots used (75.0%) in 2 ciphertexts"
+
+    layout = column_major_layout((4, 4), (1, 32))
+    assert layout.utilization.used_slots == (16,)
+
+
+def make_layout(mapping, domain_shape=(2, 2), codomain_shape=(1, 8)):
+    return Layout(
+        domain_shape,
+        codomain_shape,
+        [PermutationEntry(d, c) for d, c in mapping.items()],
+    )
+
+
+def test_verify_accepts_valid_layout():
+    mapping = {(0, 0): (0, 7), (0, 1): (0, 0), (1, 0): (0, 3), (1, 1): (0, 1)}
+    assert make_layout(mapping).utilization.used == 4
+
+
+def test_verify_rejects_out_of_bounds_codomain():
+    mapping = {(0, 0): (0, 0), (0, 1): (0, 1), (1, 0): (0, 2), (1, 1): (0, 8)}
+    with pytest.raises(ValueError, match="out of bounds"):
+        make_layout(mapping)
+    mapping[(1, 1)] = (1, 0)
+    with pytest.raises(ValueError, match="out of bounds"):
+        make_layout(mapping)
+    mapping[(1, 1)] = (0, -1)
+    with pytest.raises(ValueError, match="out of bounds"):
+        make_layout(mapping)
+
+
+def test_verify_rejects_out_of_bounds_domain():
+    mapping = {(0, 0): (0, 0), (0, 1): (0, 1), (1, 0): (0, 2), (2, 0): (0, 3)}
+    with pytest.raises(ValueError, match=r"\(2, 0\) is out of bounds"):
+        make_layout(mapping)
+
+
+def test_verify_rejects_collisions():
+    mapping = {(0, 0): (0, 0), (0, 1): (0, 1), (1, 0): (0, 2), (1, 1): (0, 1)}
+    with pytest.raises(ValueError, match="both mapped to"):
+        make_layout(mapping)
+
+
+def test_verify_rejects_unmapped_entries():
+    mapping = {(0, 0): (0, 0), (0, 1): (0, 1), (1, 1): (0, 2)}
+    with pytest.raises(ValueError, match=r"\(1, 0\) is not mapped"):
+        make_layout(mapping)
+    # More data than slots.
+    with pytest.raises(ValueError, match="not mapped"):
+        row_major_layout((4, 4), (1, 8))
+
+
+def test_verify_rejects_entries_mapped_twice():
+    entries = [
+        PermutationEntry((0, 0), (0, 0)),
+        PermutationEntry((0, 0), (0, 1)),
+        PermutationEntry((0, 1), (0, 2)),
+    ]
+    with pytest.raises(ValueError, match="mapped to both"):
+        Layout((1, 2), (1, 4), entries)
+
+
+def test_verify_rejects_wrong_number_of_axes():
+    with pytest.raises(ValueError, match="axes"):
+        Layout(
+            (2,),
+            (1, 4),
+            [PermutationEntry((0,), (0, 0)), PermutationEntry((1,), (1,))],
+        )
@@ -0,0 +1,74 @@
+"""A cache of plaintext constants shared across kernel calls.
+
+Kernels repeatedly multiply by the same plaintext constants, such as the
+one-hot masks extracting slots, or the punctured filters of a convolution.
+These are identical across calls, so they are built once and shared as
+immutable tuples of slot values, keyed by (kind, size, parameters).
+
+The cache is bounded, evicting the least recently used constants first.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class PlaintextCache:
+    def __init__(self, max_entries: int = 4096):
+        """Create a cache holding at most max_entries constants."""
+        assert max_entries > 0
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, kind: str, size: int, params: Hashable, build: Callable):
+        """Return the constant for (kind, size, params), calling build() to
+        create it if it is not cached.
+
+        The built value is stored as is, so it should be immutable, e.g., a
+        tuple of slot values.
+        """
+        key = (kind, size, params)
+        value = self._entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = self._entries[key] = build()
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# The cache shared by all kernels.
+default_cache = PlaintextCache()
+
+
+def block_mask(size: int, start: int, stop: int) -> tuple[int, ...]:
+    """A mask of size slots, with ones in slots [start, stop)."""
+
+    def build():
+        return (0,) * start + (1,) * (stop - start) + (0,) * (size - stop)
+
+    assert 0 <= start <= stop <= size
+    return default_cache.get("block_mask", size, (start, stop), build)
+
+
+def one_hot_mask(size: int, index: int) -> tuple[int, ...]:
+    """A mask of size slots, with a one in slot index."""
+    return block_mask(size, index, index + 1)
+
+
+def prefix_mask(size: int, length: int) -> tuple[int, ...]:
+    """A mask of size slots, with ones in the first length slots."""
+    return block_mask(size, 0, length)
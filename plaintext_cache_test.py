@@ -0,0 +1,57 @@
+from plaintext_cache import PlaintextCache
+from plaintext_cache import block_mask
+from plaintext_cache import one_hot_mask
+from plaintext_cache import prefix_mask
+
+
+def test_masks():
+    assert block_mask(6, 2, 4) == (0, 0, 1, 1, 0, 0)
+    assert one_hot_mask(4, 3) == (0, 0, 0, 1)
+    assert prefix_mask(4, 2) == (1, 1, 0, 0)
+
+
+def test_masks_are_shared():
+    assert block_mask(8, 1, 5) is block_mask(8, 1, 5)
+
+
+def test_hits_and_misses():
+    cache = PlaintextCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return (1, 2, 3)
+
+    first = cache.get("kind", 3, (), build)
+    second = cache.get("kind", 3, (), build)
+    assert first is second
+    assert len(builds) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get("other", 3, (), build)
+    assert len(builds) == 2
+    assert len(cache) == 2
+
+
+def test_evicts_least_recently_used():
+    cache = PlaintextCache(max_entries=2)
+    cache.get("a", 1, (), lambda: (1,))
+    cache.get("b", 1, (), lambda: (2,))
+    # Touch "a", so "b" is the least recently used.
+    cache.get("a", 1, (), lambda: (1,))
+    cache.get("c", 1, (), lambda: (3,))
+    assert len(cache) == 2
+
+    misses = cache.misses
+    cache.get("a", 1, (), lambda: (1,))
+    assert cache.misses == misses
+    cache.get("b", 1, (), lambda: (2,))
+    assert cache.misses == misses + 1
+
+
+def test_clear():
+    cache = PlaintextCache()
+    cache.get("a", 1, (), lambda: (1,))
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,569 @@
+"""A cost model for choosing between the packing schemes.
+
+Given an operation, the shapes of its operands and the number of slots in a
+ciphertext, the planner estimates the op counts, multiplicative depth and
+slot utilization of every scheme that supports it, and returns the plan
+with the lowest cost under a configurable CostModel.
+
+Example:
+
+    plan = planner.plan("matvec", [(100, 100)], num_slots=64)
+    result = plan.execute(matrix, vector)
+
+The estimates are exact for the kernels in this repository, i.e., they
+match the counts reported by computational_model.count_ops.
+"""
+
+from dataclasses import dataclass, replace
+from math import gcd, log2
+from typing import Callable
+
+import bicyclic
+import halevi_shoup
+import im2col_convolution
+import siso_convolution
+from computational_model import Ciphertext, is_power_of_two
+
+
+@dataclass(frozen=True)
+class CostModel:
+    """The relative cost of each FHE operation, and of each level of
+    multiplicative depth.
+
+    If levels is set, a plan is charged for the bootstraps that
+    computational_model.level_budget(levels) would report: a ciphertext at a
+    multiplicative depth that is a positive multiple of levels has no levels
+    left, and is bootstrapped when it is next multiplied.
+    """
+
+    rotation: float = 1.0
+    ct_ct_multiplication: float = 1.0
+    ct_pt_multiplication: float = 0.25
+    addition: float = 0.05
+    depth: float = 0.0
+    levels: int = None
+    bootstrap: float = 100.0
+
+    def bootstraps(self, estimate: "Estimate") -> int:
+        if self.levels is None:
+            return 0
+        return sum(
+            count
+            for depth, count in enumerate(estimate.multiplied_by_depth, start=1)
+            if depth % self.levels == 0
+        )
+
+    def cost(self, estimate: "Estimate") -> float:
+        return (
+            self.rotation * estimate.rotations
+            + self.ct_ct_multiplication * estimate.ct_ct_multiplications
+            + self.ct_pt_multiplication * estimate.ct_pt_multiplications
+            + self.addition * estimate.additions
+            + self.depth * estimate.depth
+            + self.bootstrap * self.bootstraps(estimate)
+        )
+
+
+@dataclass(frozen=True)
+class Estimate:
+    rotations: int
+    ct_ct_multiplications: int
+    ct_pt_multiplications: int
+    additions: int
+    depth: int
+    # The fraction of the operands' ciphertext slots holding distinct data.
+    slot_utilization: float
+    # The number of ciphertexts at each multiplicative depth 1, 2, ... that
+    # are multiplied by a ciphertext or a plaintext vector, which consumes a
+    # level. Ciphertexts at depth 0 are fresh, and are not counted.
+    multiplied_by_depth: tuple[int, ...] = ()
+
+
+@dataclass
+class Plan:
+    """A packing scheme chosen for an operation.
+
+    pack(*operands) packs the plaintext operands, kernel(*packed) runs the
+    scheme on the packed operands, and unpack(result) extracts the
+    plaintext result. execute composes all three.
+
+    If first_layer_only is set, pack() transforms the input in the clear
+    before encryption, so the scheme cannot be applied to an encrypted input,
+    e.g., the output of a previous layer.
+    """
+
+    operation: str
+    scheme: str
+    estimate: Estimate
+    cost: float
+    pack: Callable
+    kernel: Callable
+    unpack: Callable
+    first_layer_only: bool = False
+
+    def execute(self, *operands):
+        return self.unpack(self.kernel(*self.pack(*operands)))
+
+
+@dataclass
+class _Candidate:
+    scheme: str
+    estimate: Estimate
+    pack: Callable
+    kernel: Callable
+    unpack: Callable
+    first_layer_only: bool = False
+
+
+def _halevi_shoup_diagonal_estimate(n, num_slots) -> Estimate:
+    """The estimate of halevi_shoup.matrix_vector_multiply on an n x n matrix."""
+    return Estimate(
+        rotations=n - 1,
+        ct_ct_multiplications=n,
+        ct_pt_multiplications=0,
+        additions=n - 1,
+        depth=1,
+        slot_utilization=n / num_slots,
+    )
+
+
+def _bicyclic_estimate(m, n, p, num_slots) -> Estimate:
+    """The estimate of bicyclic.matrix_multiply of an m x n by an n x p
+    matrix."""
+    amounts = bicyclic.rotation_amounts(m, n, p)
+    return Estimate(
+        rotations=sum(bool(a) + bool(b) for a, b in amounts),
+        ct_ct_multiplications=n,
+        ct_pt_multiplications=0,
+        additions=n,
+        depth=1,
+        slot_utilization=(m * n + n * p) / (2 * num_slots),
+    )
+
+
+def _matvec_candidates(shape, num_slots):
+    n, m = shape
+    square = n == m
+    candidates = []
+
+    if square and is_power_of_two(n) and n <= num_slots:
+        log_n = int(log2(n))
+        candidates.append(
+            _Candidate(
+                scheme="halevi_shoup_naive",
+                estimate=Estimate(
+                    rotations=n * log_n,
+                    ct_ct_multiplications=n,
+                    ct_pt_multiplications=n,
+                    additions=n * log_n + n - 1,
+                    depth=2,
+                    slot_utilization=n / num_slots,
+                    # The reduced row products are masked.
+                    multiplied_by_depth=(n,),
+                ),
+                pack=lambda matrix, vector: (
+                    halevi_shoup.pack_naive(matrix),
+                    Ciphertext(vector),
+                ),
+                kernel=halevi_shoup.matrix_vector_multiply_naive,
+                unpack=lambda result: result.data[:n],
+            )
+        )
+
+        k = num_slots // n
+        if num_slots % n == 0 and is_power_of_two(k):
+            num_ciphertexts = -(-n // k)
+            candidates.append(
+                _Candidate(
+                    scheme="halevi_shoup_naive_packed",
+                    estimate=Estimate(
+                        rotations=num_ciphertexts * log_n,
+                        ct_ct_multiplications=num_ciphertexts,
+                        ct_pt_multiplications=num_ciphertexts,
+                        additions=num_ciphertexts * (log_n + 1) - 1,
+                        depth=2,
+                        slot_utilization=n * n / (num_ciphertexts * num_slots),
+                        multiplied_by_depth=(num_ciphertexts,),
+                    ),
+                    pack=lambda matrix, vector: (
+                        halevi_shoup.pack_naive_packed(matrix, num_slots),
+                        halevi_shoup.pack_vector_naive_packed(vector, num_slots),
+                    ),
+                    kernel=halevi_shoup.matrix_vector_multiply_naive_packed,
+                    unpack=lambda result: result.data[:n],
+                )
+            )
+
+    if square and is_power_of_two(n) and n * n <= num_slots:
+        log_n = int(log2(n))
+        candidates.append(
+            _Candidate(
+                scheme="halevi_shoup_replicated",
+                estimate=Estimate(
+                    rotations=2 * log_n,
+                    ct_ct_multiplications=1,
+                    ct_pt_multiplications=0,
+                    additions=2 * log_n,
+                    depth=1,
+                    slot_utilization=n * n / num_slots,
+                ),
+                pack=lambda matrix, vector: (
+                    halevi_shoup.pack_row_major(matrix, n),
+                    halevi_shoup.pack_vector_compact(vector, n),
+                ),
+                kernel=halevi_shoup.matrix_vector_multiply_replicated,
+                unpack=lambda result: halevi_shoup.unpack_replicated(result, n),
+            )
+        )
+
+    if square and n <= num_slots:
+        candidates.append(
+            _Candidate(
+                scheme="halevi_shoup_diagonal",
+                estimate=_halevi_shoup_diagonal_estimate(n, num_slots),
+                pack=lambda matrix, vector: (
+                    halevi_shoup.pack(matrix),
+                    Ciphertext(vector),
+                ),
+                kernel=halevi_shoup.matrix_vector_multiply,
+                unpack=lambda result: result.data[:n],
+            )
+        )
+
+    if n < m <= num_slots and is_power_of_two(n) and is_power_of_two(m):
+        num_shifts = int(log2(m) - log2(n))
+        candidates.append(
+            _Candidate(
+                scheme="halevi_shoup_squat",
+                estimate=Estimate(
+                    rotations=n - 1 + num_shifts,
+                    ct_ct_multiplications=n,
+                    ct_pt_multiplications=1,
+                    additions=n - 1 + num_shifts,
+                    depth=2,
+                    slot_utilization=m / num_slots,
+                    multiplied_by_depth=(1,),
+                ),
+                pack=lambda matrix, vector: (
+                    halevi_shoup.pack_squat(matrix),
+                    Ciphertext(vector),
+                ),
+                kernel=halevi_shoup.matrix_vector_multiply_squat,
+                unpack=lambda result: result.data[:n],
+            )
+        )
+
+    b = halevi_shoup.choose_block_size(shape, num_slots)
+    block_rows, block_cols = -(-n // b), -(-m // b)
+    num_blocks = block_rows * block_cols
+    candidates.append(
+        _Candidate(
+            scheme="halevi_shoup_blocked",
+            estimate=Estimate(
+                rotations=block_cols * (b - 1),
+                ct_ct_multiplications=num_blocks * b,
+                ct_pt_multiplications=0,
+                additions=num_blocks * (b - 1) + block_rows * (block_cols - 1),
+                depth=1,
+                slot_utilization=n * m / (num_blocks * b * num_slots),
+            ),
+            pack=lambda matrix, vector: (
+                halevi_shoup.pack_blocked(matrix, num_slots, block_size=b),
+                halevi_shoup.pack_vector_blocked(vector, b),
+            ),
+            kernel=halevi_shoup.matrix_vector_multiply_blocked,
+            unpack=lambda results: [x for r in results for x in r.data][:n],
+        )
+    )
+
+    return candidates
+
+
+def _matmul_candidates(shape_a, shape_b, num_slots):
+    (m, n), (n2, p) = shape_a, shape_b
+    assert n == n2, f"Inner dimensions must match: {n} != {n2}"
+    candidates = []
+
+    dim = max(m, n, p)
+    if dim * dim <= num_slots:
+        plaintexts = halevi_shoup.prepare_matrix_multiply(dim)
+        lhs_offsets = {offset for diagonals in plaintexts.lhs for offset in diagonals}
+        rhs_offsets = {offset for diagonals in plaintexts.rhs for offset in diagonals}
+        diagonals_per_term = [
+            len(lhs) + len(rhs) for lhs, rhs in zip(plaintexts.lhs, plaintexts.rhs)
+        ]
+        candidates.append(
+            _Candidate(
+                scheme="halevi_shoup_matmul",
+                estimate=Estimate(
+                    rotations=len(lhs_offsets - {0}) + len(rhs_offsets - {0}),
+                    ct_ct_multiplications=dim,
+                    ct_pt_multiplications=sum(diagonals_per_term),
+                    additions=sum(d - 2 for d in diagonals_per_term) + dim - 1,
+                    depth=2,
+                    slot_utilization=(m * n + n * p) / (2 * num_slots),
+                    # Both permuted operands of each of the dim products.
+                    multiplied_by_depth=(2 * dim,),
+                ),
+                pack=lambda a, b: (
+                    halevi_shoup.pack_row_major(a, dim),
+                    halevi_shoup.pack_row_major(b, dim),
+                ),
+                kernel=lambda a, b: halevi_shoup.matrix_multiply(a, b, plaintexts),
+                unpack=lambda result: halevi_shoup.unpack_row_major(result, m, p),
+            )
+        )
+
+    coprime = gcd(m, n) == gcd(n, p) == gcd(m, p) == 1
+    slots = m * n * p
+    if coprime and slots <= num_slots:
+        candidates.append(
+            _Candidate(
+                scheme="bicyclic_matmul",
+                estimate=_bicyclic_estimate(m, n, p, num_slots),
+                pack=lambda a, b: (bicyclic.pack(a, slots), bicyclic.pack(b, slots)),
+                kernel=lambda a, b: bicyclic.matrix_multiply(a, b, m, n, p),
+                unpack=lambda result: bicyclic.unpack(result, m, p),
+            )
+        )
+
+    return candidates
+
+
+def _conv_candidates(matrix_shape, filter_shape, num_slots, pad):
+    n, m = matrix_shape
+    fn, fm = filter_shape
+    candidates = []
+
+    # The SISO kernel produces a correctly laid out result only for
+    # convolutions preserving the matrix shape.
+    same_shape = 2 * pad == fn - 1 and 2 * pad == fm - 1
+    if n == m and is_power_of_two(n) and n * n <= num_slots and same_shape:
+        rotations = {
+            (-m * (i - pad) - (j - pad)) % (n * m)
+            for i in range(fn)
+            for j in range(fm)
+        }
+        candidates.append(
+            _Candidate(
+                scheme="siso_convolution",
+                estimate=Estimate(
+                    rotations=len(rotations - {0}),
+                    ct_ct_multiplications=fn * fm,
+                    ct_pt_multiplications=0,
+                    additions=fn * fm,
+                    depth=1,
+                    slot_utilization=n * m / num_slots,
+                ),
+                pack=lambda matrix, filter: (
+                    siso_convolution.pack_rowwise(matrix),
+                    siso_convolution.prepare_filters(matrix_shape, filter, pad),
+                ),
+                kernel=lambda packed, filters: siso_convolution.siso_convolution(
+                    packed, matrix_shape, filters, pad=pad
+                ),
+                unpack=lambda result: [
+                    result.data[i * m : (i + 1) * m] for i in range(n)
+                ],
+            )
+        )
+
+    candidates += _im2col_candidates(matrix_shape, filter_shape, num_slots, pad)
+    return candidates
+
+
+def _im2col_candidates(matrix_shape, filter_shape, num_slots, pad):
+    n, m = matrix_shape
+    candidates = []
+
+    # The Toeplitz matrix of the filter, by the encrypted input.
+    dim = im2col_convolution.toeplitz_dim(matrix_shape, filter_shape, pad)
+    if dim <= num_slots:
+        candidates.append(
+            _Candidate(
+                scheme="toeplitz_diagonal",
+                estimate=_halevi_shoup_diagonal_estimate(dim, num_slots),
+                pack=lambda matrix, filter: (
+                    im2col_convolution.pack_toeplitz_diagonal(
+                        filter, matrix_shape, pad
+                    ),
+                    im2col_convolution.pack_input(matrix, dim),
+                ),
+                kernel=halevi_shoup.matrix_vector_multiply,
+                unpack=lambda result: im2col_convolution.unpack_toeplitz_diagonal(
+                    result, matrix_shape, filter_shape, pad
+                ),
+            )
+        )
+
+    toeplitz_rows, toeplitz_cols = im2col_convolution.toeplitz_bicyclic_shape(
+        matrix_shape, filter_shape, pad
+    )
+    if toeplitz_rows * toeplitz_cols <= num_slots:
+        estimate = _bicyclic_estimate(toeplitz_rows, toeplitz_cols, 1, num_slots)
+        # The input is repeated into its bicyclic encoding as a column.
+        tile_rotations = im2col_convolution.tile_rotations(toeplitz_rows)
+        candidates.append(
+            _Candidate(
+                scheme="toeplitz_bicyclic",
+                estimate=replace(
+                    estimate,
+                    rotations=estimate.rotations + tile_rotations,
+                    additions=estimate.additions + tile_rotations,
+                ),
+                pack=lambda matrix, filter: (
+                    im2col_convolution.pack_toeplitz_bicyclic(
+                        filter, matrix_shape, pad
+                    ),
+                    im2col_convolution.pack_input(
+                        matrix, toeplitz_rows * toeplitz_cols
+                    ),
+                ),
+                kernel=lambda packed_filter, packed_input: (
+                    im2col_convolution.convolve_toeplitz_bicyclic(
+                        packed_filter, packed_input, matrix_shape, filter_shape, pad
+                    )
+                ),
+                unpack=lambda result: im2col_convolution.unpack_toeplitz_bicyclic(
+                    result, matrix_shape, filter_shape, pad
+                ),
+            )
+        )
+
+    # The patch matrix of the input, lowered on the client, by the filter.
+
+    try:
+        num_diagonals, _, per_ciphertext = im2col_convolution.diagonal_geometry(
+            matrix_shape, filter_shape, pad, num_slots
+        )
+    except ValueError:
+        per_ciphertext = 0
+    if per_ciphertext:
+        num_ciphertexts = num_diagonals // per_ciphertext
+        log_per_ciphertext = int(log2(per_ciphertext))
+        candidates.append(
+            _Candidate(
+                scheme="im2col_diagonal",
+                estimate=Estimate(
+                    rotations=log_per_ciphertext,
+                    ct_ct_multiplications=num_ciphertexts,
+                    ct_pt_multiplications=0,
+                    additions=num_ciphertexts - 1 + log_per_ciphertext,
+                    depth=1,
+                    slot_utilization=n * m / (num_ciphertexts * num_slots),
+                ),
+                pack=lambda matrix, filter: (
+                    im2col_convolution.pack_diagonal(
+                        matrix, filter_shape, pad, num_slots
+                    ),
+                    im2col_convolution.prepare_filter_diagonal(
+                        filter, matrix_shape, pad, num_slots
+                    ),
+                ),
+                kernel=lambda packed, filters: im2col_convolution.convolve_diagonal(
+                    packed, filters, matrix_shape, filter_shape, pad
+                ),
+                unpack=lambda result: im2col_convolution.unpack_diagonal(
+                    result, matrix_shape, filter_shape, pad
+                ),
+                first_layer_only=True,
+            )
+        )
+
+    rows, cols = im2col_convolution.bicyclic_shape(matrix_shape, filter_shape, pad)
+    if rows * cols <= num_slots:
+        candidates.append(
+            _Candidate(
+                scheme="im2col_bicyclic",
+                estimate=replace(
+                    _bicyclic_estimate(rows, cols, 1, num_slots),
+                    slot_utilization=n * m / num_slots,
+                ),
+                pack=lambda matrix, filter: (
+                    im2col_convolution.pack_bicyclic(matrix, filter_shape, pad),
+                    im2col_convolution.prepare_filter_bicyclic(
+                        filter, matrix_shape, pad
+                    ),
+                ),
+                kernel=lambda packed, filters: im2col_convolution.convolve_bicyclic(
+                    packed, filters, matrix_shape, filter_shape, pad
+                ),
+                unpack=lambda result: im2col_convolution.unpack_bicyclic(
+                    result, matrix_shape, filter_shape, pad
+                ),
+                first_layer_only=True,
+            )
+        )
+
+    return candidates
+
+
+OPERATIONS = ["matvec", "matmul", "conv"]
+
+
+def candidate_plans(
+    operation: str,
+    shapes: list[tuple[int, int]],
+    num_slots: int,
+    cost_model: CostModel = CostModel(),
+    pad: int = 1,
+    first_layer: bool = False,
+) -> list[Plan]:
+    """Return a plan for every scheme supporting the operation, cheapest first.
+
+    Args:
+        operation: one of "matvec", "matmul" or "conv".
+        shapes: the operand shapes. For matvec, the matrix shape. For matmul,
+            the shapes of both matrices. For conv, the shapes of the matrix
+            and the filter.
+        num_slots: the number of slots in a ciphertext.
+        cost_model: the relative costs used to rank the plans.
+        pad: the padding of a convolution.
+        first_layer: whether the client holds the input in the clear, as for
+            the first layer of a network, so that schemes transforming it
+            before encryption (see Plan.first_layer_only) are included.
+    """
+    if operation == "matvec":
+        candidates = _matvec_candidates(shapes[0], num_slots)
+    elif operation == "matmul":
+        candidates = _matmul_candidates(shapes[0], shapes[1], num_slots)
+    elif operation == "conv":
+        candidates = _conv_candidates(shapes[0], shapes[1], num_slots, pad)
+    else:
+        raise ValueError(f"Unknown {operation=}, expected one of {OPERATIONS}")
+
+    plans = [
+        Plan(
+            operation=operation,
+            scheme=candidate.scheme,
+            estimate=candidate.estimate,
+            cost=cost_model.cost(candidate.estimate),
+            pack=candidate.pack,
+            kernel=candidate.kernel,
+            unpack=candidate.unpack,
+            first_layer_only=candidate.first_layer_only,
+        )
+        for candidate in candidates
+        if first_layer or not candidate.first_layer_only
+    ]
+    return sorted(plans, key=lambda plan: plan.cost)
+
+
+def plan(
+    operation: str,
+    shapes: list[tuple[int, int]],
+    num_slots: int,
+    cost_model: CostModel = CostModel(),
+    pad: int = 1,
+    first_layer: bool = False,
+) -> Plan:
+    """Return the cheapest plan for the operation. See candidate_plans."""
+    plans = candidate_plans(
+        operation, shapes, num_slots, cost_model, pad=pad, first_layer=first_layer
+    )
+    if not plans:
+        raise ValueError(
+            f"No packing scheme supports {operation} on {shapes} "
+            f"with {num_slots} slots"
+        )
+    return plans[0]
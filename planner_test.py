@@ -0,0 +1,192 @@
+import random
+
+import pytest
+
+from computational_model import count_ops, level_budget
+from planner import CostModel, candidate_plans, plan
+from siso_convolution import plaintext_convolution
+
+
+def random_matrix(shape, rng):
+    return [[rng.randint(-10, 10) for _ in range(shape[1])] for _ in range(shape[0])]
+
+
+def matvec(matrix, vector):
+    return [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+
+
+def matmul(a, b):
+    return [
+        [sum(a[i][k] * b[k][j] for k in range(len(b))) for j in range(len(b[0]))]
+        for i in range(len(a))
+    ]
+
+
+def check_plan(plan, operands):
+    """Check the plan computes the operation, with the estimated op counts."""
+    packed = plan.pack(*operands)
+    with count_ops() as counts:
+        result = plan.kernel(*packed)
+
+    estimate = plan.estimate
+    assert counts.rotations == estimate.rotations, plan.scheme
+    assert counts.ct_ct_multiplications == estimate.ct_ct_multiplications
+    assert counts.ct_pt_multiplications == estimate.ct_pt_multiplications
+    assert counts.additions == estimate.additions, plan.scheme
+    depths = [r.depth for r in result] if isinstance(result, list) else [result.depth]
+    assert max(depths) == estimate.depth, plan.scheme
+    assert 0 < estimate.slot_utilization <= 1
+
+    return plan.unpack(result)
+
+
+@pytest.mark.parametrize(
+    "shape,num_slots",
+    [((4, 4), 4), ((8, 8), 32), ((4, 16), 16), ((10, 6), 4), ((16, 16), 64)],
+)
+def test_matvec_plans(shape, num_slots):
+    rng = random.Random(0)
+    matrix = random_matrix(shape, rng)
+    vector = [rng.randint(-10, 10) for _ in range(shape[1])]
+    plans = candidate_plans("matvec", [shape], num_slots)
+    assert plans
+    for p in plans:
+        assert check_plan(p, (matrix, vector)) == matvec(matrix, vector)
+
+
+@pytest.mark.parametrize("shapes", [[(3, 5), (5, 7)], [(4, 4), (4, 4)]])
+def test_matmul_plans(shapes):
+    rng = random.Random(0)
+    a, b = random_matrix(shapes[0], rng), random_matrix(shapes[1], rng)
+    plans = candidate_plans("matmul", shapes, num_slots=128)
+    assert plans
+    for p in plans:
+        assert check_plan(p, (a, b)) == matmul(a, b)
+
+
+@pytest.mark.parametrize(
+    "shapes,pad,num_slots",
+    [
+        ([(4, 4), (3, 3)], 1, 16),
+        ([(4, 4), (3, 3)], 1, 256),
+        ([(8, 8), (3, 3)], 1, 4096),
+        ([(6, 5), (3, 2)], 0, 64),
+        ([(4, 4), (3, 3)], 1, 512),
+        ([(6, 5), (3, 2)], 0, 1024),
+    ],
+)
+def test_conv_plans(shapes, pad, num_slots):
+    rng = random.Random(0)
+    matrix, filter = random_matrix(shapes[0], rng), random_matrix(shapes[1], rng)
+    plans = candidate_plans(
+        "conv", shapes, num_slots=num_slots, pad=pad, first_layer=True
+    )
+    assert plans
+    for p in plans:
+        assert check_plan(p, (matrix, filter)) == plaintext_convolution(
+            matrix, filter, pad=pad
+        ), p.scheme
+
+
+def test_conv_plan_schemes():
+    # The Toeplitz schemes run on an encrypted input, so they apply to any
+    # layer, while the im2col schemes lower the input on the client, so they
+    # only apply to a first layer.
+    plans = candidate_plans("conv", [(4, 4), (3, 3)], num_slots=512, pad=1)
+    schemes = {p.scheme: p for p in plans}
+    assert set(schemes) == {
+        "siso_convolution",
+        "toeplitz_diagonal",
+        "toeplitz_bicyclic",
+    }
+    assert not any(p.first_layer_only for p in plans)
+    # The 16 x 16 Toeplitz matrix takes a rotation per diagonal but one.
+    assert schemes["toeplitz_diagonal"].estimate.rotations == 15
+    assert schemes["siso_convolution"].estimate.rotations == 8
+    assert plan("conv", [(8, 8), (3, 3)], 4096).scheme == "siso_convolution"
+
+    plans = candidate_plans(
+        "conv", [(8, 8), (3, 3)], num_slots=4096, pad=1, first_layer=True
+    )
+    schemes = {p.scheme: p for p in plans}
+    assert set(schemes) == {
+        "siso_convolution",
+        "toeplitz_diagonal",
+        "im2col_diagonal",
+        "im2col_bicyclic",
+    }
+    assert schemes["im2col_diagonal"].first_layer_only
+    assert not schemes["siso_convolution"].first_layer_only
+    # All 16 diagonals fit in one ciphertext, summed in log2(16) rotations,
+    # rather than the 8 of the SISO kernel.
+    assert schemes["im2col_diagonal"].estimate.rotations == 4
+    assert schemes["siso_convolution"].estimate.rotations == 8
+    assert plans[0].scheme == "im2col_diagonal"
+    # Without room for more than one diagonal per ciphertext, the diagonal
+    # kernel needs no rotations at all.
+    p = plan("conv", [(8, 8), (3, 3)], num_slots=64, pad=1, first_layer=True)
+    assert p.scheme == "im2col_diagonal" and p.estimate.rotations == 0
+    assert p.estimate.ct_ct_multiplications == 16
+
+
+def test_plan_chooses_cheapest():
+    # The diagonal method needs the fewest rotations when the matrix fits.
+    assert plan("matvec", [(16, 16)], num_slots=16).scheme == "halevi_shoup_diagonal"
+    # Only the blocked method supports matrices larger than a ciphertext.
+    assert plan("matvec", [(100, 100)], num_slots=64).scheme == "halevi_shoup_blocked"
+
+    shapes = [(3, 5), (5, 7)]
+    assert plan("matmul", shapes, num_slots=128).scheme == "bicyclic_matmul"
+    # Not enough slots for the bicyclic encoding.
+    assert plan("matmul", shapes, num_slots=64).scheme == "halevi_shoup_matmul"
+
+
+def test_plan_cost_model():
+    # Packing several rows per ciphertext needs the fewest operations...
+    shapes = [(8, 8)]
+    assert plan("matvec", shapes, num_slots=64).scheme == "halevi_shoup_naive_packed"
+    # ...but has depth 2, while replicating the vector has depth 1.
+    costly_depth = CostModel(depth=100.0)
+    assert (
+        plan("matvec", shapes, num_slots=64, cost_model=costly_depth).scheme
+        == "halevi_shoup_replicated"
+    )
+
+
+def test_plan_bootstrapping():
+    shapes = [(8, 8)]
+    # With a single level, depth 2 plans need bootstrapping.
+    one_level = CostModel(levels=1)
+    plans = candidate_plans("matvec", shapes, 64, cost_model=one_level)
+    assert plans[0].scheme == "halevi_shoup_replicated"
+    for p in plans:
+        assert (one_level.bootstraps(p.estimate) > 0) == (p.estimate.depth > 1)
+        assert CostModel(levels=2).bootstraps(p.estimate) == 0
+
+
+@pytest.mark.parametrize(
+    "operation,shapes,num_slots",
+    [
+        ("matvec", [(8, 8)], 16),
+        ("matvec", [(8, 32)], 32),
+        ("matmul", [(4, 4), (4, 4)], 16),
+    ],
+)
+@pytest.mark.parametrize("levels", [1, 2])
+def test_plan_bootstraps_match_level_budget(operation, shapes, num_slots, levels):
+    rng = random.Random(0)
+    operands = [random_matrix(shape, rng) for shape in shapes]
+    if operation == "matvec":
+        operands = [operands[0], [rng.randint(-10, 10) for _ in range(shapes[0][1])]]
+    cost_model = CostModel(levels=levels)
+    for p in candidate_plans(operation, shapes, num_slots, cost_model=cost_model):
+        with level_budget(levels) as report:
+            p.kernel(*p.pack(*operands))
+        assert cost_model.bootstraps(p.estimate) == report.num_bootstraps, p.scheme
+
+
+def test_plan_unsupported():
+    with pytest.raises(ValueError, match="No packing scheme"):
+        plan("matmul", [(4, 4), (4, 4)], num_slots=8)
+    with pytest.raises(ValueError, match="Unknown"):
+        plan("transpose", [(4, 4)], num_slots=8)
@@ -0,0 +1,212 @@
+"""Slot-wise evaluation of polynomials on ciphertexts, e.g., activations.
+
+A polynomial is given by its integer coefficients, lowest degree first, and
+is applied to every slot of a ciphertext, so it can be applied to the output
+of any kernel whatever its packing. Note that slots not holding data, e.g.,
+the padding of a packed matrix, are mapped to the constant coefficient.
+
+Multiplying ciphertexts (non-scalar multiplication) is much more expensive
+than multiplying by a constant or adding, and each one consumes a level, so
+the evaluators minimize the number and the depth of non-scalar
+multiplications. For a polynomial of degree d:
+
+ - horner uses d - 1 non-scalar multiplications in depth d - 1, as a
+   baseline.
+ - paterson_stockmeyer computes the baby powers x, ..., x^k and evaluates
+   the polynomial as a polynomial in y = x^k whose coefficients are linear
+   combinations of the baby powers, with about 2 sqrt(d) non-scalar
+   multiplications.
+ - baby_step_giant_step computes the baby powers and the giant powers
+   x^k, x^2k, x^4k, ... for k about sqrt(d), and recursively splits the
+   polynomial as p = q * x^(k 2^j) + r. Its depth ceil(log2(d)), that of
+   x^d, is optimal, with a few more non-scalar multiplications than
+   paterson_stockmeyer.
+
+Example:
+
+    # 3x - x^3 on the output of a matrix-vector product.
+    activated = evaluate(result, [0, 3, 0, -1])
+    print(evaluation_cost([0, 3, 0, -1]))
+"""
+
+from dataclasses import dataclass
+from math import ceil, log2
+from typing import Union
+
+from computational_model import Ciphertext, OpCounts, count_ops
+from profiling import profiled
+
+HORNER = "horner"
+PATERSON_STOCKMEYER = "paterson_stockmeyer"
+BABY_STEP_GIANT_STEP = "baby_step_giant_step"
+
+# An intermediate value: a ciphertext, or a constant not yet multiplied by
+# any ciphertext.
+Value = Union[Ciphertext, int]
+
+
+def _add(a: Value, b: Value) -> Value:
+    if isinstance(a, int) and a == 0:
+        return b
+    if isinstance(b, int) and b == 0:
+        return a
+    if isinstance(a, int):
+        return b + a
+    return a + b
+
+
+def _mul(a: Value, b: Value) -> Value:
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int) and b == 1:
+        return a
+    if isinstance(b, int) and b == 0:
+        return 0
+    return a * b
+
+
+def _as_ciphertext(value: Value, x: Ciphertext) -> Ciphertext:
+    if isinstance(value, int):
+        # A constant polynomial.
+        return x * 0 + value
+    return value
+
+
+def _trim(coefficients: list[int]) -> list[int]:
+    """The coefficients without the zero coefficients of highest degree."""
+    coefficients = list(coefficients)
+    while len(coefficients) > 1 and coefficients[-1] == 0:
+        coefficients.pop()
+    assert coefficients and all(isinstance(c, int) for c in coefficients)
+    return coefficients
+
+
+def powers(x: Ciphertext, k: int) -> list[Value]:
+    """The powers [1, x, x^2, ..., x^k], each x^i computed in the minimal
+    depth ceil(log2(i)) with one non-scalar multiplication."""
+    result = [1, x]
+    for i in range(2, k + 1):
+        high = 1 << (i.bit_length() - 1)
+        if high == i:
+            result.append(result[i // 2] * result[i // 2])
+        else:
+            result.append(result[high] * result[i - high])
+    return result[: k + 1]
+
+
+def _linear_combination(coefficients: list[int], baby: list[Value]) -> Value:
+    result = 0
+    for c, power in zip(coefficients, baby):
+        result = _add(result, _mul(power, c))
+    return result
+
+
+@profiled()
+def horner(x: Ciphertext, coefficients: list[int]) -> Ciphertext:
+    """Evaluate the polynomial by Horner's rule."""
+    coefficients = _trim(coefficients)
+    result = coefficients[-1]
+    for c in reversed(coefficients[:-1]):
+        result = _add(_mul(result, x), c)
+    return _as_ciphertext(result, x)
+
+
+def _paterson_stockmeyer_multiplications(degree: int, k: int) -> int:
+    return (min(k, degree) - 1) + ceil((degree + 1) / k) - 1
+
+
+@profiled()
+def paterson_stockmeyer(
+    x: Ciphertext, coefficients: list[int], k: int = None
+) -> Ciphertext:
+    """Evaluate the polynomial by the Paterson-Stockmeyer algorithm with k
+    baby powers, by default the k minimizing the non-scalar
+    multiplications."""
+    coefficients = _trim(coefficients)
+    degree = len(coefficients) - 1
+    if k is None:
+        k = min(
+            range(1, degree + 2),
+            key=lambda k: (_paterson_stockmeyer_multiplications(degree, k), -k),
+        )
+    assert k >= 1
+
+    # With a single chunk, the powers above the degree are not needed.
+    baby = powers(x, min(k, degree))
+    chunks = [coefficients[i : i + k] for i in range(0, len(coefficients), k)]
+    result = _linear_combination(chunks[-1], baby)
+    for chunk in reversed(chunks[:-1]):
+        result = _add(_mul(result, baby[k]), _linear_combination(chunk, baby))
+    return _as_ciphertext(result, x)
+
+
+def _split(coefficients: list[int], baby: list[Value], giants: list[Value]) -> Value:
+    """Evaluate the polynomial given the baby powers below x^k and the giant
+    powers x^k, x^2k, x^4k, ..."""
+    k = len(baby)
+    if len(coefficients) <= k:
+        return _linear_combination(coefficients, baby)
+    # The largest giant power x^(k 2^j) of degree at most the polynomial's.
+    j = (len(coefficients) - 1) // k
+    j = j.bit_length() - 1
+    split = k << j
+    low = _split(coefficients[:split], baby, giants)
+    high = _split(coefficients[split:], baby, giants)
+    return _add(_mul(high, giants[j]), low)
+
+
+@profiled()
+def baby_step_giant_step(x: Ciphertext, coefficients: list[int]) -> Ciphertext:
+    """Evaluate the polynomial in the minimal depth by baby-step giant-step
+    splitting."""
+    coefficients = _trim(coefficients)
+    degree = len(coefficients) - 1
+    if degree <= 1:
+        return horner(x, coefficients)
+
+    k = 1 << ceil(ceil(log2(degree + 1)) / 2)
+    baby = powers(x, k)
+    giants = [baby[k]]
+    while k << len(giants) <= degree:
+        giants.append(giants[-1] * giants[-1])
+    # The leaves only use the powers below x^k.
+    result = _split(coefficients, baby[:k], giants)
+    return _as_ciphertext(result, x)
+
+
+_METHODS = {
+    HORNER: horner,
+    PATERSON_STOCKMEYER: paterson_stockmeyer,
+    BABY_STEP_GIANT_STEP: baby_step_giant_step,
+}
+
+
+def evaluate(
+    x: Ciphertext, coefficients: list[int], method: str = BABY_STEP_GIANT_STEP
+) -> Ciphertext:
+    """Apply the polynomial to each slot of x."""
+    if method not in _METHODS:
+        raise ValueError(f"Unknown {method=}, expected one of {list(_METHODS)}")
+    return _METHODS[method](x, coefficients)
+
+
+@dataclass(frozen=True)
+class PolynomialCost:
+    counts: OpCounts
+    # The number of non-scalar multiplications on the longest path.
+    depth: int
+
+    @property
+    def nonscalar_multiplications(self) -> int:
+        return self.counts.ct_ct_multiplications
+
+
+def evaluation_cost(
+    coefficients: list[int], method: str = BABY_STEP_GIANT_STEP
+) -> PolynomialCost:
+    """The ops of evaluate() on a ciphertext of any size and depth 0. The
+    evaluation does not depend on the slots, so it is simulated on a single
+    slot."""
+    with count_ops() as counts:
+        result = evaluate(Ciphertext([0]), coefficients, method)
+    return PolynomialCost(counts, result.depth)
@@ -0,0 +1,91 @@
+from math import ceil, log2
+
+import pytest
+
+import halevi_shoup
+from computational_model import Ciphertext, count_ops, level_budget
+from polynomial import (
+    BABY_STEP_GIANT_STEP,
+    HORNER,
+    PATERSON_STOCKMEYER,
+    evaluate,
+    evaluation_cost,
+    powers,
+)
+
+METHODS = [HORNER, PATERSON_STOCKMEYER, BABY_STEP_GIANT_STEP]
+
+
+def expected(coefficients, values):
+    return [sum(c * v**i for i, c in enumerate(coefficients)) for v in values]
+
+
+def coefficients_of(degree):
+    return [(7 * i + 3) % 11 - 5 for i in range(degree)] + [2]
+
+
+def test_powers():
+    x = Ciphertext([2, -1, 3])
+    result = powers(x, 7)
+    for i in range(1, 8):
+        assert result[i].data == [v**i for v in [2, -1, 3]]
+        assert result[i].depth == ceil(log2(i))
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("degree", range(0, 18))
+def test_evaluate(method, degree):
+    values = [-2, -1, 0, 1, 2, 3]
+    coefficients = coefficients_of(degree)
+    x = Ciphertext(values)
+    with count_ops() as counts:
+        result = evaluate(x, coefficients, method)
+    assert result.data == expected(coefficients, values)
+    assert x.data == values
+
+    cost = evaluation_cost(coefficients, method)
+    assert counts == cost.counts
+    assert result.depth == cost.depth
+
+
+def test_depth_and_multiplications():
+    for degree in range(2, 64):
+        coefficients = coefficients_of(degree)
+        horner = evaluation_cost(coefficients, HORNER)
+        ps = evaluation_cost(coefficients, PATERSON_STOCKMEYER)
+        bsgs = evaluation_cost(coefficients, BABY_STEP_GIANT_STEP)
+
+        assert horner.nonscalar_multiplications == horner.depth == degree - 1
+        assert bsgs.depth == ceil(log2(degree))
+        assert ps.nonscalar_multiplications <= bsgs.nonscalar_multiplications
+        assert ps.nonscalar_multiplications <= 2 * ceil(degree**0.5)
+
+    cost = evaluation_cost(coefficients_of(31), BABY_STEP_GIANT_STEP)
+    assert cost.depth == 5
+    assert cost.nonscalar_multiplications == 11
+
+
+def test_zero_coefficients_are_free():
+    cost = evaluation_cost([0, 1, 0, 0, 0, 0, 0, 1])
+    # x + x^7 needs no scalar multiplications or constant additions.
+    assert cost.counts.ct_pt_multiplications == 0
+    assert cost.counts.additions == 1
+
+
+def test_on_packed_matrix_vector_product():
+    matrix = [[1, -2, 0, 1], [3, 1, -1, 0], [0, 2, 2, -1], [1, 0, 1, 1]]
+    vector = [1, 2, -1, 1]
+    coefficients = [1, 0, -3, 1]
+
+    with level_budget(levels=4):
+        packed = halevi_shoup.pack(matrix)
+        x = Ciphertext(vector, level=4)
+        product = halevi_shoup.matrix_vector_multiply(packed, x)
+        result = evaluate(product, coefficients)
+    assert result.data == expected(coefficients, product.data)
+    assert result.level == product.level - 2
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        evaluate(Ciphertext([1]), [1, 1], method="newton")
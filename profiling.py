@@ -0,0 +1,178 @@
+"""Opt-in timing of the phases of the kernels, with flamegraph export.
+
+The kernels mark their phases (packing, rotations, multiplications,
+reductions) with named spans. Spans are only timed within a profile()
+context. Otherwise span() returns a shared no-op context manager, so the
+kernels pay a single check per span when profiling is disabled.
+
+Each span's wall time, call count and net number of allocated memory blocks
+(as reported by sys.getallocatedblocks) is aggregated by its path of
+enclosing spans, e.g.,
+
+    with profile() as p:
+        bicyclic.matrix_multiply(a, b, m, n, p)
+    print(p.report())
+    p.write_collapsed("profile.folded")
+
+The collapsed stack output has a line "outer;inner <self time in ns>" per
+path, as consumed by flamegraph.pl and speedscope.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+import functools
+import sys
+import time
+from typing import Callable
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    # The wall time spent in the span, including its child spans.
+    total_ns: int = 0
+    # The net number of memory blocks allocated within the span.
+    allocated_blocks: int = 0
+
+    def add(self, other: "SpanStats") -> None:
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.allocated_blocks += other.allocated_blocks
+
+
+class Profile:
+    """The spans timed within a profile() context."""
+
+    def __init__(self):
+        self.stats: dict[tuple[str, ...], SpanStats] = {}
+        self._stack: list[str] = []
+
+    def self_ns(self, path: tuple[str, ...]) -> int:
+        """The time spent in the span at path, excluding its child spans."""
+        children = sum(
+            stats.total_ns
+            for child, stats in self.stats.items()
+            if len(child) == len(path) + 1 and child[:-1] == path
+        )
+        return self.stats[path].total_ns - children
+
+    def phases(self) -> dict[str, SpanStats]:
+        """The stats of each span name, summed over the paths it occurs in.
+
+        Spans nested in a span of the same name are not counted again, so
+        the total time of a recursive span is not double counted.
+        """
+        result = {}
+        for path, stats in self.stats.items():
+            if path[-1] in path[:-1]:
+                continue
+            result.setdefault(path[-1], SpanStats()).add(stats)
+        return result
+
+    def collapsed(self) -> str:
+        """The self time of each path in collapsed stack format."""
+        lines = [
+            f"{';'.join(path)} {self.self_ns(path)}" for path in sorted(self.stats)
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+
+    def report(self) -> str:
+        """A table of the phases, by decreasing total time."""
+        phases = sorted(self.phases().items(), key=lambda item: -item[1].total_ns)
+        width = max([len(name) for name, _ in phases] + [5])
+        lines = [f"{'phase':<{width}}{'calls':>10}{'time (ms)':>12}{'blocks':>10}"]
+        for name, stats in phases:
+            lines.append(
+                f"{name:<{width}}{stats.count:>10}"
+                f"{stats.total_ns / 1e6:>12.3f}{stats.allocated_blocks:>10}"
+            )
+        return "\n".join(lines)
+
+
+# The Profile of the active profile context, if any.
+_profile = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profile", "name", "start_ns", "start_blocks")
+
+    def __init__(self, profile: Profile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile._stack.append(self.name)
+        self.start_blocks = sys.getallocatedblocks()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter_ns() - self.start_ns
+        blocks = sys.getallocatedblocks() - self.start_blocks
+        stack = self.profile._stack
+        path = tuple(stack)
+        stack.pop()
+
+        stats = self.profile.stats.get(path)
+        if stats is None:
+            stats = self.profile.stats[path] = SpanStats()
+        stats.count += 1
+        stats.total_ns += elapsed
+        stats.allocated_blocks += blocks
+        return False
+
+
+def span(name: str):
+    """A context manager timing the enclosed code as a span with the given
+    name, if profiling is enabled."""
+    if _profile is None:
+        return _NULL_SPAN
+    return _Span(_profile, name)
+
+
+def profiled(name: str = None) -> Callable:
+    """Decorate a function to time each call as a span, named after the
+    function unless name is given."""
+
+    def decorator(function):
+        label = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return function(*args, **kwargs)
+            with _Span(_profile, label):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def profile():
+    """Time the spans entered within the context. See the module docstring."""
+    global _profile
+    previous = _profile
+    _profile = Profile()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
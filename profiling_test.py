@@ -0,0 +1,116 @@
+import bicyclic
+import halevi_shoup
+import siso_convolution
+from computational_model import Ciphertext
+from fhelipe import AxisBitRange, Layout
+from profiling import _NULL_SPAN, profile, profiled, span
+
+
+def test_disabled_spans_are_free():
+    assert span("anything") is _NULL_SPAN
+
+    @profiled()
+    def f(x):
+        return x + 1
+
+    assert f(1) == 2
+
+
+def test_nested_spans():
+    @profiled("outer")
+    def outer():
+        for _ in range(3):
+            with span("inner"):
+                pass
+        return 7
+
+    with profile() as p:
+        assert outer() == 7
+        outer()
+
+    assert p.stats[("outer",)].count == 2
+    assert p.stats[("outer", "inner")].count == 6
+    assert p.self_ns(("outer",)) >= 0
+    assert p.phases()["inner"].count == 6
+    assert p.collapsed().splitlines()[0].startswith("outer ")
+    assert p.collapsed().splitlines()[1].startswith("outer;inner ")
+    # Profiling is disabled outside the context.
+    assert span("inner") is _NULL_SPAN
+
+
+def test_recursive_spans_are_not_double_counted():
+    @profiled("recurse")
+    def recurse(n):
+        return 0 if n == 0 else recurse(n - 1)
+
+    with profile() as p:
+        recurse(3)
+
+    assert p.phases()["recurse"].count == 1
+    assert p.phases()["recurse"].total_ns == p.stats[("recurse",)].total_ns
+
+
+def test_kernel_phases(tmp_path):
+    m, n, p = 3, 4, 5
+    a = [[i + j for j in range(n)] for i in range(m)]
+    b = [[i * j for j in range(p)] for i in range(n)]
+    matrix = [[i * 4 + j for j in range(4)] for i in range(4)]
+    filter = [[1, 0, 1], [0, 1, 0], [1, 0, 1]]
+
+    with profile() as prof:
+        packed_a = bicyclic.pack(a, m * n * p)
+        packed_b = bicyclic.pack(b, m * n * p)
+        bicyclic.matrix_multiply(packed_a, packed_b, m, n, p)
+        filters = siso_convolution.prepare_filters((4, 4), filter, 1)
+        siso_convolution.siso_convolution(
+            siso_convolution.pack_rowwise(matrix), (4, 4), filters
+        )
+        Layout([AxisBitRange.parse("d0[1:0]")]).expand((4,))
+
+    phases = prof.phases()
+    assert phases["bicyclic.pack"].count == 2
+    assert phases["rotate"].count == n
+    assert phases["multiply_accumulate"].count == n
+    assert phases["rotate_multiply_accumulate"].count == 9
+    assert phases["fhelipe.Layout.expand"].count == 1
+    assert ("fhelipe.Layout.expand", "offsets") in prof.stats
+    assert "bicyclic.matrix_multiply" in prof.report()
+
+    path = tmp_path / "profile.folded"
+    prof.write_collapsed(path)
+    lines = path.read_text().splitlines()
+    assert "bicyclic.matrix_multiply;rotate" in [line.split()[0] for line in lines]
+    assert all(int(line.split()[1]) >= 0 for line in lines)
+
+
+def test_halevi_shoup_phases():
+    n = 4
+    matrix = [[i * n + j for j in range(n)] for i in range(n)]
+    vector = Ciphertext(list(range(n)))
+
+    with profile() as prof:
+        halevi_shoup.matrix_vector_multiply_naive(
+            halevi_shoup.pack_naive(matrix), vector
+        )
+        halevi_shoup.matrix_vector_multiply(halevi_shoup.pack(matrix), vector)
+        halevi_shoup.matrix_vector_multiply_blocked(
+            halevi_shoup.pack_blocked(matrix, 2, block_size=2),
+            halevi_shoup.pack_vector_blocked(list(range(n)), 2),
+        )
+        halevi_shoup.matrix_multiply(
+            halevi_shoup.pack_row_major(matrix, n),
+            halevi_shoup.pack_row_major(matrix, n),
+            halevi_shoup.prepare_matrix_multiply(n),
+        )
+
+    naive = "halevi_shoup.matrix_vector_multiply_naive"
+    for phase in ["multiply", "reduce", "mask", "accumulate"]:
+        assert (naive, phase) in prof.stats
+    assert (
+        "halevi_shoup.matrix_vector_multiply",
+        "rotate_multiply_accumulate",
+    ) in prof.stats
+    blocked = "halevi_shoup.matrix_vector_multiply_blocked"
+    for phase in ["rotate", "multiply_accumulate", "accumulate"]:
+        assert (blocked, phase) in prof.stats
+    assert prof.stats["halevi_shoup.matrix_multiply", "permute"].count == n
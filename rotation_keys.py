@@ -0,0 +1,253 @@
+"""Modeling of the rotation (Galois) keys available to a deployment.
+
+A real deployment only has keys for a limited set of rotation amounts, and
+composes any other rotation from a chain of rotations by available amounts.
+RotationKeySet computes the shortest such chains, and reports the extra
+rotations a workload incurs compared to having a key for every amount.
+
+A workload trace is a mapping from rotation amount to the number of
+rotations by that amount, such as OpCounts.rotation_amounts, e.g.,
+
+    with count_ops() as counts:
+        halevi_shoup.matrix_vector_multiply(packed_matrix, vector)
+    keys = RotationKeySet(power_of_two_keys(num_slots), num_slots)
+    extra = keys.extra_rotations(counts.rotation_amounts)
+"""
+
+from collections import Counter
+from typing import Iterable, Mapping
+
+from computational_model import Ciphertext, is_power_of_two
+
+
+def power_of_two_keys(num_slots: int, signed: bool = True) -> list[int]:
+    """The keys for rotations by powers of two, and (if signed) their
+    negations, which is the default key set of most FHE libraries."""
+    assert is_power_of_two(num_slots)
+    keys = []
+    shift = 1
+    while shift < num_slots:
+        keys.append(shift)
+        if signed:
+            keys.append(-shift % num_slots)
+        shift *= 2
+    return sorted(set(keys))
+
+
+def _shortest_chain(
+    keys: Iterable[int], amount: int, num_slots: int, max_length: int = None
+) -> list[int]:
+    """Return a shortest list of keys whose rotations compose to a rotation by
+    amount, or None if there is none (of at most max_length keys, if given).
+
+    This is a bidirectional breadth-first search, from 0 by adding keys and
+    from amount by subtracting them, which explores about |keys|^(L/2)
+    amounts on each side for a chain of length L, rather than all num_slots
+    amounts.
+    """
+    amount %= num_slots
+    if amount == 0:
+        return []
+    # For each side, the (previous amount, key) by which each amount was
+    # reached, the amounts reached in the last layer, and the layer count.
+    sides = [
+        [{0: None}, [0], 0, 1],
+        [{amount: None}, [amount], 0, -1],
+    ]
+    meet = None
+    while meet is None:
+        if sides[0][1] == [] or sides[1][1] == []:
+            return None
+        if max_length is not None and sides[0][2] + sides[1][2] >= max_length:
+            return None
+        # Expand the smaller frontier by a full layer. Each amount is checked
+        # against the other side as it is reached, so the first meeting
+        # completes a shortest chain.
+        side, other = sides if len(sides[0][1]) <= len(sides[1][1]) else sides[::-1]
+        visited, frontier, _, sign = side
+        reached_frontier = []
+        for previous in frontier:
+            for key in keys:
+                reached = (previous + sign * key) % num_slots
+                if reached in visited:
+                    continue
+                visited[reached] = (previous, key)
+                reached_frontier.append(reached)
+                if reached in other[0]:
+                    meet = reached
+                    break
+            if meet is not None:
+                break
+        side[1] = reached_frontier
+        side[2] += 1
+
+    chain = []
+    for visited, *_ in sides:
+        step = visited[meet]
+        while step is not None:
+            previous, key = step
+            chain.append(key)
+            step = visited[previous]
+    # Rotations commute, so the chain is returned in a canonical order.
+    return sorted(chain)
+
+
+class RotationKeySet:
+    def __init__(self, keys: Iterable[int], num_slots: int):
+        """A set of rotation keys for ciphertexts with num_slots slots.
+
+        Args:
+            keys: the rotation amounts with an available key. Amounts are
+                taken mod num_slots.
+            num_slots: the number of slots in a ciphertext.
+        """
+        self.num_slots = num_slots
+        self.keys = sorted({key % num_slots for key in keys} - {0})
+        # The shortest chain (or None) of each amount decomposed so far.
+        self._chains = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _chain(self, amount: int) -> list[int]:
+        amount %= self.num_slots
+        if amount not in self._chains:
+            self._chains[amount] = _shortest_chain(self.keys, amount, self.num_slots)
+        return self._chains[amount]
+
+    def decompose(self, amount: int) -> list[int]:
+        """Return a shortest list of keys whose rotations compose to a
+        rotation by amount. Raises ValueError if there is none."""
+        chain = self._chain(amount)
+        if chain is None:
+            raise ValueError(
+                f"Rotation by {amount % self.num_slots} cannot be composed "
+                f"from keys {self.keys}"
+            )
+        return list(chain)
+
+    def supports(self, amounts: Iterable[int]) -> bool:
+        return all(self._chain(a) is not None for a in amounts)
+
+    def total_rotations(self, trace: Mapping[int, int]) -> int:
+        """The number of key rotations needed to perform the traced rotations."""
+        return sum(count * len(self.decompose(a)) for a, count in trace.items())
+
+    def extra_rotations(self, trace: Mapping[int, int]) -> int:
+        """The number of rotations incurred beyond one per traced rotation."""
+        nonzero = sum(count for a, count in trace.items() if a % self.num_slots)
+        return self.total_rotations(trace) - nonzero
+
+    def rotate(self, ciphertext: Ciphertext, amount: int) -> Ciphertext:
+        """Rotate the ciphertext by a chain of rotations by available keys."""
+        assert len(ciphertext) == self.num_slots
+        for key in self.decompose(amount):
+            ciphertext = ciphertext.rotate(key)
+        return ciphertext
+
+    def __repr__(self) -> str:
+        return f"RotationKeySet({self.keys}, num_slots={self.num_slots})"
+
+
+def suggest_key_set(
+    trace: Mapping[int, int],
+    num_slots: int,
+    max_keys: int,
+    candidates: Iterable[int] = None,
+) -> RotationKeySet:
+    """Suggest a set of at most max_keys keys minimizing the total rotations
+    of the traced workload.
+
+    If the trace has at most max_keys distinct amounts, a key for each of
+    them is optimal. Otherwise, the keys are chosen greedily: starting from
+    all candidate keys (by default, the traced amounts and the signed powers
+    of two), the key whose removal increases the total rotations the least is
+    removed, until max_keys remain.
+
+    Only the traced amounts are decomposed. Removing a key only changes the
+    chains that use it, and the chain of an amount without a key stays
+    shortest as further keys are removed unless it uses one of them, so each
+    such chain is cached until then. The search for a chain is bounded by
+    the length beyond which removing the key cannot beat the best removal
+    found so far.
+    """
+    weights = Counter()
+    for a, count in trace.items():
+        if a % num_slots:
+            weights[a % num_slots] += count
+    if len(weights) <= max_keys:
+        return RotationKeySet(weights, num_slots)
+
+    if candidates is None:
+        candidates = set(weights) | set(power_of_two_keys(num_slots))
+    keys = {c % num_slots for c in candidates} - {0}
+    key_set = RotationKeySet(keys, num_slots)
+    if not key_set.supports(weights):
+        raise ValueError("The candidate keys cannot compose every traced rotation")
+    chains = {a: key_set.decompose(a) for a in weights}
+    # The shortest chain (or None) of each amount without each key, and
+    # lower bounds on the length of those not found by a bounded search.
+    chains_without = {}
+    min_lengths = {}
+
+    def chain_without(key, a, max_length):
+        if (key, a) in chains_without:
+            return chains_without[key, a]
+        if max_length is not None and min_lengths.get((key, a), 0) > max_length:
+            return None
+        chain = _shortest_chain(sorted(keys - {key}), a, num_slots, max_length)
+        if chain is not None or max_length is None:
+            chains_without[key, a] = chain
+        else:
+            min_lengths[key, a] = max_length + 1
+        return chain
+
+    while len(keys) > max_keys:
+        best_key, best_increase = None, None
+        for key in sorted(keys):
+            increase = 0
+            for a, chain in chains.items():
+                if key not in chain:
+                    continue
+                max_length = None
+                if best_increase is not None:
+                    # The longest chain keeping the increase below the best.
+                    budget = best_increase - increase
+                    if budget <= 0:
+                        break
+                    max_length = len(chain) + (budget - 1) // weights[a]
+                new_chain = chain_without(key, a, max_length)
+                if new_chain is None:
+                    break
+                increase += weights[a] * (len(new_chain) - len(chain))
+            else:
+                if best_increase is None or increase < best_increase:
+                    best_key, best_increase = key, increase
+        if best_key is None:
+            raise ValueError(f"No set of {max_keys} keys composes every rotation")
+
+        keys.remove(best_key)
+        for a, chain in chains.items():
+            if best_key in chain:
+                chains[a] = chains_without[best_key, a]
+        chains_without = {
+            (key, a): chain
+            for (key, a), chain in chains_without.items()
+            if key != best_key and (chain is None or best_key not in chain)
+        }
+
+    key_set = RotationKeySet(keys, num_slots)
+    key_set._chains.update(chains)
+    return key_set
+
+
+def key_set_tradeoff(
+    trace: Mapping[int, int], num_slots: int, key_budgets: Iterable[int]
+) -> list[tuple[int, int]]:
+    """For each key budget, return (number of keys, total rotations) of the
+    suggested key set, to weigh key material size against rotation count."""
+    result = []
+    for max_keys in key_budgets:
+        key_set = suggest_key_set(trace, num_slots, max_keys)
+        result.append((len(key_set), key_set.total_rotations(trace)))
+    return result
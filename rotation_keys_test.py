@@ -0,0 +1,95 @@
+import random
+import time
+
+import pytest
+from hypothesis import given
+from hypothesis.strategies import integers
+
+import halevi_shoup
+from computational_model import Ciphertext, count_ops
+from rotation_keys import (
+    RotationKeySet,
+    key_set_tradeoff,
+    power_of_two_keys,
+    suggest_key_set,
+)
+
+
+def test_power_of_two_keys():
+    assert power_of_two_keys(16) == [1, 2, 4, 8, 12, 14, 15]
+    assert power_of_two_keys(16, signed=False) == [1, 2, 4, 8]
+
+
+def test_decompose_power_of_two():
+    keys = RotationKeySet(power_of_two_keys(16), 16)
+    assert keys.decompose(0) == []
+    assert keys.decompose(4) == [4]
+    assert len(keys.decompose(7)) == 2  # 8 - 1
+    assert len(keys.decompose(-5)) == 2  # -4 - 1
+    assert sum(keys.decompose(11)) % 16 == 11
+
+
+@given(integers(min_value=-100, max_value=100))
+def test_rotate_composes_chain(amount):
+    keys = RotationKeySet(power_of_two_keys(32), 32)
+    x = Ciphertext(list(range(32)))
+    with count_ops() as counts:
+        rotated = keys.rotate(x, amount)
+    assert rotated == x.rotate(amount)
+    assert counts.rotations == len(keys.decompose(amount))
+    assert set(counts.rotation_amounts) <= set(keys.keys)
+
+
+def test_unsupported_rotation():
+    keys = RotationKeySet([2], 8)
+    assert keys.decompose(6) == [2, 2, 2]
+    with pytest.raises(ValueError, match="cannot be composed"):
+        keys.decompose(3)
+
+
+def test_extra_rotations_for_halevi_shoup():
+    n = 16
+    matrix = [[i * n + j for j in range(n)] for i in range(n)]
+    with count_ops() as counts:
+        halevi_shoup.matrix_vector_multiply(
+            halevi_shoup.pack(matrix), Ciphertext(list(range(n)))
+        )
+    trace = counts.rotation_amounts
+    assert sum(trace.values()) == n - 1
+
+    keys = RotationKeySet(power_of_two_keys(n), n)
+    # Each of the 15 rotations by -1, ..., -15 needs at most 2 keys
+    # (a signed power of two, or a sum/difference of two).
+    assert keys.total_rotations(trace) == 7 + 2 * 8
+    assert keys.extra_rotations(trace) == 8
+
+
+def test_suggest_key_set():
+    trace = {3: 10, 5: 10, 7: 1}
+    # Enough keys for every amount.
+    suggested = suggest_key_set(trace, 16, max_keys=3)
+    assert suggested.keys == [3, 5, 7]
+    assert suggested.extra_rotations(trace) == 0
+
+    # With only two keys, the frequent rotations should stay single keys.
+    suggested = suggest_key_set(trace, 16, max_keys=2)
+    assert suggested.keys == [3, 5]
+    assert suggested.decompose(7) == [3, 5, 5, 5, 5]
+    assert suggested.extra_rotations(trace) == 4
+
+    assert key_set_tradeoff(trace, 16, [1, 2, 3]) == [(1, 91), (2, 25), (3, 21)]
+
+
+def test_suggest_key_set_production_slot_count():
+    num_slots = 1 << 15
+    rng = random.Random(0)
+    trace = {rng.randrange(1, num_slots): rng.randint(1, 10) for _ in range(64)}
+    trace.update({-i: 1 for i in range(1, 33)})
+
+    start = time.perf_counter()
+    suggested = suggest_key_set(trace, num_slots, max_keys=32)
+    elapsed = time.perf_counter() - start
+
+    assert len(suggested) == 32
+    assert suggested.supports(trace)
+    assert elapsed < 10, f"suggest_key_set took {elapsed:.1f}s"
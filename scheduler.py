@@ -0,0 +1,303 @@
+"""Execution of independent ciphertext operations on a process pool.
+
+A Scheduler runs batches of independent operations, such as the n products
+of a Halevi-Shoup matrix-vector multiplication, on a pool of worker
+processes. The slots of the operands and results of a batch are exchanged
+through a single shared memory block rather than pickled, so each input
+ciphertext is copied once however many operations read it.
+
+Sums of many ciphertexts are computed as balanced trees, whose levels are
+each run as a batch. Lazy DAGs (see lazy.py) are optimized and evaluated
+wavefront by wavefront, each wavefront being a batch of operations whose
+arguments are already computed.
+
+Results are returned in the order of the requested operations, and do not
+depend on the number of workers. The operations performed by the workers
+are recorded in the active count_ops contexts. Levels (see level_budget)
+are not tracked through the pool.
+
+Example:
+
+    with Scheduler(max_workers=8) as scheduler:
+        result = scheduler.matrix_vector_multiply(packed_matrix, vector)
+"""
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import lazy
+from computational_model import Ciphertext, count_ops, record_counts
+
+# The operations of a task. See Scheduler.run.
+ADD = "add"
+MUL = "mul"
+ROTATE = "rotate"
+ROTATE_MUL = "rotate_mul"
+
+_INT64 = (-(1 << 63), 1 << 63)
+
+
+def _execute(op: str, operands: list[Ciphertext], args: tuple) -> Ciphertext:
+    """Perform a task on its ciphertext operands and other arguments."""
+    if op == ADD:
+        return operands[0] + operands[1]
+    if op == MUL:
+        return operands[0] * (operands[1] if len(operands) > 1 else args[0])
+    if op == ROTATE:
+        return operands[0].rotate(args[0])
+    if op == ROTATE_MUL:
+        multiplicand = operands[1] if len(operands) > 1 else args[1]
+        return operands[0].rotate(args[0]) * multiplicand
+    raise ValueError(f"Unknown {op=}")
+
+
+def _fits_int64(data: list[int]) -> bool:
+    return not data or (_INT64[0] <= min(data) and max(data) < _INT64[1])
+
+
+def _worker(task):
+    """Run a task in a worker, reading its operands from and writing its
+    result to the shared block where possible.
+
+    Returns the (data, depth, original_shape, modulus) of the result, where
+    data is None if it was written to the block, and the ops performed.
+    """
+    name, op, operands, args, output = task
+    # The workers share the resource tracker of the parent, which unlinks the
+    # block, so registering it again when attaching here is harmless.
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        slots = block.buf.cast("q")
+        try:
+            cts = []
+            for location, data, depth, original_shape, modulus in operands:
+                if location is not None:
+                    start, length = location
+                    data = slots[start : start + length].tolist()
+                cts.append(Ciphertext._wrap(data, original_shape, depth, modulus, None))
+
+            with count_ops() as counts:
+                result = _execute(op, cts, args)
+
+            data = result.data
+            if _fits_int64(data):
+                start = output
+                slots[start : start + len(data)] = array("q", data)
+                data = None
+        finally:
+            slots.release()
+    finally:
+        block.close()
+    return (data, result.depth, result.original_shape, result.modulus), counts
+
+
+class Scheduler:
+    def __init__(self, max_workers: int = None):
+        """A scheduler running operations on max_workers processes (by
+        default, one per CPU). If max_workers is 1, operations run in this
+        process."""
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self._executor = None
+        if max_workers != 1:
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "Scheduler":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def run(self, tasks: list[tuple]) -> list[Ciphertext]:
+        """Run independent tasks, returning their results in order.
+
+        Each task is a tuple (op, *operands), one of
+            (ADD, a, b): a + b,
+            (MUL, a, b): a * b, where b is a ciphertext or plaintext,
+            (ROTATE, a, n): a.rotate(n),
+            (ROTATE_MUL, a, n, b): a.rotate(n) * b.
+        """
+        if not tasks:
+            return []
+        parsed = [self._parse(task) for task in tasks]
+        if self._executor is None:
+            return [_execute(op, cts, args) for op, cts, args in parsed]
+        return self._run_in_pool(parsed)
+
+    @staticmethod
+    def _parse(task: tuple) -> tuple[str, list[Ciphertext], tuple]:
+        op, *rest = task
+        if op in (ADD, MUL):
+            a, b = rest
+            if isinstance(b, Ciphertext):
+                return op, [a, b], ()
+            return op, [a], (b,)
+        if op == ROTATE:
+            a, n = rest
+            return op, [a], (n,)
+        if op == ROTATE_MUL:
+            a, n, b = rest
+            if isinstance(b, Ciphertext):
+                return op, [a, b], (n,)
+            return op, [a], (n, b)
+        raise ValueError(f"Unknown {op=}")
+
+    def _run_in_pool(self, parsed) -> list[Ciphertext]:
+        # Lay out each distinct input ciphertext, then each output, in the
+        # shared block.
+        offsets = {}
+        size = 0
+        for _, cts, _ in parsed:
+            for ct in cts:
+                if id(ct) not in offsets and _fits_int64(ct.data):
+                    offsets[id(ct)] = size
+                    size += len(ct)
+        outputs = []
+        for _, cts, _ in parsed:
+            outputs.append(size)
+            size += len(cts[0])
+
+        block = shared_memory.SharedMemory(create=True, size=8 * max(size, 1))
+        try:
+            slots = block.buf.cast("q")
+            try:
+                written = set()
+                for _, cts, _ in parsed:
+                    for ct in cts:
+                        start = offsets.get(id(ct))
+                        if start is not None and id(ct) not in written:
+                            slots[start : start + len(ct)] = array("q", ct.data)
+                            written.add(id(ct))
+
+                worker_tasks = [
+                    (
+                        block.name,
+                        op,
+                        [self._operand(ct, offsets) for ct in cts],
+                        args,
+                        output,
+                    )
+                    for (op, cts, args), output in zip(parsed, outputs)
+                ]
+                chunksize = max(1, len(worker_tasks) // (4 * self.max_workers))
+                results = list(
+                    self._executor.map(_worker, worker_tasks, chunksize=chunksize)
+                )
+
+                ciphertexts = []
+                for (result, counts), output, (_, cts, _) in zip(
+                    results, outputs, parsed
+                ):
+                    data, depth, shape, modulus = result
+                    if data is None:
+                        data = slots[output : output + len(cts[0])].tolist()
+                    record_counts(counts)
+                    ciphertexts.append(
+                        Ciphertext._wrap(data, shape, depth, modulus, None)
+                    )
+            finally:
+                slots.release()
+        finally:
+            block.close()
+            block.unlink()
+        return ciphertexts
+
+    @staticmethod
+    def _operand(ct: Ciphertext, offsets: dict) -> tuple:
+        start = offsets.get(id(ct))
+        if start is None:
+            return None, ct.data, ct.depth, ct.original_shape, ct.modulus
+        return (start, len(ct)), None, ct.depth, ct.original_shape, ct.modulus
+
+    def sum_many(self, groups: list[list[Ciphertext]]) -> list[Ciphertext]:
+        """Sum each group of ciphertexts as a balanced tree, running the
+        additions at each level of all trees as one batch."""
+        groups = [list(group) for group in groups]
+        assert all(groups), "Cannot sum an empty group"
+        while any(len(group) > 1 for group in groups):
+            tasks, owners = [], []
+            for g, group in enumerate(groups):
+                for i in range(0, len(group) - 1, 2):
+                    tasks.append((ADD, group[i], group[i + 1]))
+                    owners.append(g)
+            sums = iter(self.run(tasks))
+            next_groups = [[] for _ in groups]
+            for g, group in enumerate(groups):
+                for i in range(0, len(group) - 1, 2):
+                    next_groups[g].append(next(sums))
+                if len(group) % 2:
+                    next_groups[g].append(group[-1])
+            groups = next_groups
+        return [group[0] for group in groups]
+
+    def sum(self, ciphertexts: list[Ciphertext]) -> Ciphertext:
+        """Sum the ciphertexts as a balanced tree."""
+        return self.sum_many([ciphertexts])[0]
+
+    def matrix_vector_multiply(
+        self, packed_matrix: list[Ciphertext], vector: Ciphertext
+    ) -> Ciphertext:
+        """Multiply the Halevi-Shoup-packed matrix by the vector, computing
+        the products of the diagonals in parallel."""
+        assert len(packed_matrix) == len(vector)
+        products = self.run(
+            [
+                (ROTATE_MUL, vector, -i, diagonal)
+                for i, diagonal in enumerate(packed_matrix)
+            ]
+        )
+        return self.sum(products)
+
+    def evaluate(self, *outputs: "lazy.LazyCiphertext") -> list[Ciphertext]:
+        """Optimize the lazy DAG computing the outputs and evaluate it, running
+        the operations of each wavefront as one batch."""
+        plan = lazy.schedule(*outputs)
+        remaining_uses = plan.use_counts()
+
+        values = {}
+        for wave in plan.wavefronts():
+            tasks, task_nodes, sums, sum_nodes = [], [], [], []
+            for node in wave:
+                args = [values[id(arg)] for arg in node.args]
+                if node.op == lazy.INPUT:
+                    values[id(node)] = node.value
+                elif node.op == lazy.ZERO:
+                    values[id(node)] = Ciphertext(
+                        [0] * node.dim, original_shape=node.original_shape
+                    )
+                elif node.op == lazy.ROTATE:
+                    tasks.append((ROTATE, args[0], node.value))
+                    task_nodes.append(node)
+                elif node.op == lazy.MUL:
+                    tasks.append((MUL, args[0], args[1]))
+                    task_nodes.append(node)
+                elif node.op == lazy.MUL_PLAIN:
+                    tasks.append((MUL, args[0], node.value))
+                    task_nodes.append(node)
+                elif node.op == lazy.ADD:
+                    sums.append(args)
+                    sum_nodes.append(node)
+                else:
+                    raise ValueError(f"Unknown op {node.op}")
+
+            for node, value in zip(task_nodes, self.run(tasks)):
+                values[id(node)] = value
+            if sums:
+                for node, value in zip(sum_nodes, self.sum_many(sums)):
+                    values[id(node)] = value
+
+            for node in wave:
+                for arg in node.args:
+                    remaining_uses[id(arg)] -= 1
+                    if remaining_uses[id(arg)] == 0:
+                        del values[id(arg)]
+
+        return [values[id(root)] for root in plan.roots]
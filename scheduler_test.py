@@ -0,0 +1,89 @@
+import pytest
+
+import halevi_shoup
+import lazy
+from computational_model import Ciphertext, count_ops, plaintext_modulus
+from scheduler import ADD, MUL, ROTATE, ROTATE_MUL, Scheduler
+
+
+@pytest.fixture(scope="module", params=[1, 2])
+def scheduler(request):
+    with Scheduler(max_workers=request.param) as scheduler:
+        yield scheduler
+
+
+def test_run(scheduler):
+    x = Ciphertext([1, 2, 3, 4])
+    y = Ciphertext([5, 6, 7, 8])
+    results = scheduler.run(
+        [
+            (ADD, x, y),
+            (MUL, x, y),
+            (MUL, x, [1, 0, 1, 0]),
+            (ROTATE, x, 1),
+            (ROTATE_MUL, x, -1, y),
+            (ROTATE_MUL, x, 2, 3),
+        ]
+    )
+    assert [r.data for r in results] == [
+        [6, 8, 10, 12],
+        [5, 12, 21, 32],
+        [1, 0, 3, 0],
+        [4, 1, 2, 3],
+        [10, 18, 28, 8],
+        [9, 12, 3, 6],
+    ]
+    assert results[1].depth == 1
+    assert scheduler.run([]) == []
+
+
+def test_large_values(scheduler):
+    # Values beyond 64 bits are passed without shared memory.
+    x = Ciphertext([1 << 40, 1 << 70])
+    [square] = scheduler.run([(MUL, x, x)])
+    assert square.data == [1 << 80, 1 << 140]
+
+
+def test_modulus(scheduler):
+    with plaintext_modulus(17):
+        x = Ciphertext([3, 16])
+    [product] = scheduler.run([(MUL, x, x)])
+    assert product.data == [9, 1]
+    assert product.modulus == 17
+
+
+def test_sum(scheduler):
+    cts = [Ciphertext([i, 2 * i, 3 * i]) for i in range(7)]
+    with count_ops() as counts:
+        total = scheduler.sum(cts)
+    assert total.data == [21, 42, 63]
+    assert counts.additions == 6
+
+
+def test_matrix_vector_multiply(scheduler):
+    n = 8
+    matrix = [[(i * 5 + j * 3) % 11 - 5 for j in range(n)] for i in range(n)]
+    vector = Ciphertext([j - 3 for j in range(n)])
+    packed = halevi_shoup.pack(matrix)
+
+    with count_ops() as expected_counts:
+        expected = halevi_shoup.matrix_vector_multiply(packed, vector)
+    with count_ops() as counts:
+        result = scheduler.matrix_vector_multiply(packed, vector)
+    assert result == expected
+    assert counts == expected_counts
+
+
+def test_evaluate_lazy_dag(scheduler):
+    n = 8
+    matrix = [[i * n + j for j in range(n)] for i in range(n)]
+    vectors = [Ciphertext([j + k for j in range(n)]) for k in range(3)]
+    packed = lazy.wrap(halevi_shoup.pack(matrix))
+    outputs = [
+        halevi_shoup.matrix_vector_multiply(packed, lazy.wrap(v)) for v in vectors
+    ]
+    expected = lazy.evaluate(*outputs)
+    with count_ops() as counts:
+        results = scheduler.evaluate(*outputs)
+    assert results == expected
+    assert counts.rotations == lazy.op_counts(*outputs).rotations
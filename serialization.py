@@ -0,0 +1,337 @@
+"""A binary format for packed ciphertexts, with memory-mapped loading.
+
+Packing a large matrix is slow, so the packed ciphertexts (e.g., the output
+of halevi_shoup.pack or siso_convolution.prepare_filters) can be saved once
+and loaded by every worker. A file consists of
+
+ - the magic bytes b"FHEPACK1",
+ - the length of the header, as a little-endian uint32,
+ - the header, as UTF-8 JSON, padded with spaces to a multiple of 8 bytes,
+ - the slot values of every ciphertext, contiguous and little-endian.
+
+The header records the nesting shape of the ciphertexts (e.g., [n] for the
+list returned by halevi_shoup.pack, or [fn, fm] for the grid of filters),
+the number of slots per ciphertext, the dtype of the slot values, their
+original_shape, depth and plaintext modulus, and the signature of the layout
+they were packed with.
+
+load() reads a whole file. open_packed() instead memory-maps it, and only
+reads the slots of a ciphertext when it is first accessed, so a worker can
+start serving without reading the whole file, and workers on one machine
+share a single page-cached copy of the payload.
+
+save_rows() and iter_rows() instead store a plain matrix as raw row-major
+values, which can be streamed row by row into the packing functions.
+
+Example:
+
+    save("weights.pack", halevi_shoup.pack(matrix), layout="diagonal")
+    with open_packed("weights.pack", layout="diagonal") as packed:
+        result = halevi_shoup.matrix_vector_multiply(packed.value, vector)
+"""
+
+from array import array
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+import json
+import mmap
+import struct
+import sys
+
+from computational_model import Ciphertext
+
+MAGIC = b"FHEPACK1"
+VERSION = 1
+
+# The array typecodes of the supported dtypes, from smallest to largest.
+DTYPES = {
+    "int8": "b",
+    "int16": "h",
+    "int32": "i",
+    "int64": "q",
+    "uint64": "Q",
+}
+_BOUNDS = {
+    "int8": (-(1 << 7), 1 << 7),
+    "int16": (-(1 << 15), 1 << 15),
+    "int32": (-(1 << 31), 1 << 31),
+    "int64": (-(1 << 63), 1 << 63),
+    "uint64": (0, 1 << 64),
+}
+
+
+@dataclass(frozen=True)
+class Header:
+    # The nesting shape of the ciphertexts, e.g., [rows, cols] for a grid.
+    shape: tuple[int, ...]
+    num_slots: int
+    dtype: str
+    original_shape: tuple[int, int] = None
+    depth: int = 0
+    modulus: int = None
+    # The str() of the layout the ciphertexts were packed with, if any.
+    layout: str = None
+    version: int = VERSION
+
+    @property
+    def num_ciphertexts(self) -> int:
+        result = 1
+        for size in self.shape:
+            result *= size
+        return result
+
+
+def _flatten(value, shape: list[int]) -> list[Ciphertext]:
+    """Flatten nested lists of ciphertexts, appending their shape to shape."""
+    if isinstance(value, Ciphertext):
+        return [value]
+    if not isinstance(value, (list, tuple)) or not value:
+        raise ValueError(f"Expected a ciphertext or a nonempty list, got {value!r}")
+    shape.append(len(value))
+    inner_shape = None
+    result = []
+    for item in value:
+        item_shape = []
+        result.extend(_flatten(item, item_shape))
+        if inner_shape is not None and item_shape != inner_shape:
+            raise ValueError("The nested lists of ciphertexts must be rectangular")
+        inner_shape = item_shape
+    shape.extend(inner_shape)
+    return result
+
+
+def _choose_dtype(ciphertexts: list[Ciphertext]) -> str:
+    low = min(min(ct.data) for ct in ciphertexts)
+    high = max(max(ct.data) for ct in ciphertexts)
+    for dtype, (lower, upper) in _BOUNDS.items():
+        if lower <= low and high < upper:
+            return dtype
+    raise ValueError(f"Slot values in [{low}, {high}] do not fit in 64 bits")
+
+
+def _common(ciphertexts: list[Ciphertext], attribute: str):
+    values = {getattr(ct, attribute) for ct in ciphertexts}
+    if len(values) > 1:
+        raise ValueError(f"The ciphertexts have different {attribute}s: {values}")
+    return values.pop()
+
+
+def _to_little_endian(values: array) -> array:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def save(path: str, value, layout=None) -> Header:
+    """Save a ciphertext, or (nested) lists of ciphertexts, to path.
+
+    Args:
+        path: the file to write.
+        value: a Ciphertext, or rectangular nested lists of Ciphertexts with
+            the same number of slots.
+        layout: the layout the ciphertexts were packed with, recorded as its
+            str() so that loading can check it.
+
+    Returns:
+        The header of the written file.
+    """
+    shape = []
+    ciphertexts = _flatten(value, shape)
+    original_shape = _common(ciphertexts, "original_shape")
+    header = Header(
+        shape=tuple(shape),
+        num_slots=_common(ciphertexts, "dim"),
+        dtype=_choose_dtype(ciphertexts),
+        original_shape=tuple(original_shape) if original_shape else None,
+        depth=max(ct.depth for ct in ciphertexts),
+        modulus=_common(ciphertexts, "modulus"),
+        layout=None if layout is None else str(layout),
+    )
+
+    encoded = json.dumps(asdict(header)).encode("utf-8")
+    # Pad the header so the payload is aligned for its dtype.
+    prefix_size = len(MAGIC) + 4
+    encoded += b" " * (-(prefix_size + len(encoded)) % 8)
+
+    typecode = DTYPES[header.dtype]
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(encoded)
+        for ct in ciphertexts:
+            _to_little_endian(array(typecode, ct.data)).tofile(f)
+    return header
+
+
+def _read_header(buffer) -> tuple[Header, int]:
+    """Parse the header at the start of buffer, returning it and the offset
+    of the payload."""
+    prefix_size = len(MAGIC) + 4
+    if len(buffer) < prefix_size or bytes(buffer[: len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a packed ciphertext file")
+    (header_size,) = struct.unpack("<I", buffer[len(MAGIC) : prefix_size])
+    fields = json.loads(bytes(buffer[prefix_size : prefix_size + header_size]))
+    if fields.get("version") != VERSION:
+        raise ValueError(f"Unsupported version {fields.get('version')}")
+    fields["shape"] = tuple(fields["shape"])
+    if fields["original_shape"] is not None:
+        fields["original_shape"] = tuple(fields["original_shape"])
+    header = Header(**fields)
+    if header.dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {header.dtype}")
+
+    offset = prefix_size + header_size
+    itemsize = array(DTYPES[header.dtype]).itemsize
+    expected = offset + header.num_ciphertexts * header.num_slots * itemsize
+    if len(buffer) != expected:
+        raise ValueError(f"Expected {expected} bytes, got {len(buffer)}")
+    return header, offset
+
+
+def _check_layout(header: Header, layout) -> None:
+    if layout is not None and header.layout != str(layout):
+        raise ValueError(f"Expected layout {str(layout)!r}, got {header.layout!r}")
+
+
+class PackedArray(Sequence):
+    """A view of the nested lists of ciphertexts in a memory-mapped file.
+
+    Indexing down to a ciphertext reads its slots from the mapped file, and
+    the ciphertext is cached, so each is read at most once.
+    """
+
+    def __init__(self, packed: "PackedFile", start: int, shape: tuple[int, ...]):
+        self._packed = packed
+        self._start = start
+        self._shape = shape
+        self._stride = 1
+        for size in shape[1:]:
+            self._stride *= size
+
+    def __len__(self) -> int:
+        return self._shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = self._start + index * self._stride
+        if len(self._shape) == 1:
+            return self._packed.ciphertext(start)
+        return PackedArray(self._packed, start, self._shape[1:])
+
+    def __repr__(self) -> str:
+        return f"PackedArray(shape={self._shape})"
+
+
+class PackedFile:
+    """A memory-mapped packed ciphertext file. See open_packed."""
+
+    def __init__(self, path: str, layout=None):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.header, offset = _read_header(self._mmap)
+            _check_layout(self.header, layout)
+        except Exception:
+            self._mmap.close()
+            raise
+
+        self._payload = memoryview(self._mmap)[offset:]
+        self._slots = self._payload.cast(DTYPES[self.header.dtype])
+        self._ciphertexts = {}
+
+    def ciphertext(self, index: int) -> Ciphertext:
+        """The ciphertext at index in the flattened nesting of ciphertexts."""
+        ciphertext = self._ciphertexts.get(index)
+        if ciphertext is None:
+            n = self.header.num_slots
+            data = self._slots[index * n : (index + 1) * n]
+            if sys.byteorder == "big":
+                data = _to_little_endian(array(data.format, data))
+            ciphertext = self._ciphertexts[index] = Ciphertext(
+                data.tolist(),
+                original_shape=self.header.original_shape,
+                depth=self.header.depth,
+                modulus=self.header.modulus,
+            )
+        return ciphertext
+
+    @property
+    def value(self):
+        """The saved value: a Ciphertext if a single ciphertext was saved,
+        and otherwise a PackedArray of the saved shape."""
+        if not self.header.shape:
+            return self.ciphertext(0)
+        return PackedArray(self, 0, self.header.shape)
+
+    def close(self) -> None:
+        """Unmap the file. Ciphertexts already read remain valid."""
+        if self._mmap.closed:
+            return
+        self._slots.release()
+        self._payload.release()
+        self._mmap.close()
+
+    def __enter__(self) -> "PackedFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def open_packed(path: str, layout=None) -> PackedFile:
+    """Memory-map a file written by save, reading ciphertexts on demand.
+
+    If layout is given, raise ValueError unless the file was saved with the
+    same layout.
+    """
+    return PackedFile(path, layout=layout)
+
+
+def load(path: str, layout=None):
+    """Read a file written by save, returning the saved Ciphertext or nested
+    lists of Ciphertexts. See open_packed for the layout check."""
+    with open_packed(path, layout=layout) as packed:
+        return _materialize(packed.value)
+
+
+def save_rows(path: str, rows, dtype: str = "int64") -> None:
+    """Write the rows of a matrix to path as raw little-endian values in
+    row-major order, without a header, as read by iter_rows."""
+    typecode = DTYPES[dtype]
+    with open(path, "wb") as f:
+        for row in rows:
+            _to_little_endian(array(typecode, row)).tofile(f)
+
+
+def iter_rows(path: str, num_cols: int, dtype: str = "int64", offset: int = 0):
+    """Iterate over the rows of a matrix stored as raw little-endian values in
+    row-major order, starting offset bytes into the file.
+
+    The file is memory-mapped, and each row is read only when the iterator
+    reaches it, so a matrix larger than memory can be streamed into, e.g.,
+    halevi_shoup.pack_streaming.
+    """
+    typecode = DTYPES[dtype]
+    itemsize = array(typecode).itemsize
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        size = len(mapped) - offset
+        row_size = num_cols * itemsize
+        if size < 0 or size % row_size:
+            raise ValueError(f"{size} bytes is not a whole number of rows")
+        for start in range(offset, len(mapped), row_size):
+            row = array(typecode, mapped[start : start + row_size])
+            yield _to_little_endian(row).tolist()
+
+
+def _materialize(value):
+    if isinstance(value, Ciphertext):
+        return value
+    return [_materialize(item) for item in value]
@@ -0,0 +1,92 @@
+import pytest
+
+import halevi_shoup
+import siso_convolution
+from computational_model import Ciphertext, plaintext_modulus
+from serialization import iter_rows, load, open_packed, save, save_rows
+
+
+def test_round_trip_diagonals(tmp_path):
+    path = tmp_path / "diagonals.pack"
+    matrix = [[i * 4 + j for j in range(4)] for i in range(4)]
+    packed = halevi_shoup.pack(matrix)
+    header = save(path, packed, layout="diagonal")
+    assert header.shape == (4,)
+    assert header.num_slots == 4
+    assert header.dtype == "int8"
+
+    loaded = load(path, layout="diagonal")
+    assert loaded == packed
+    assert loaded[0].original_shape == packed[0].original_shape
+
+    vector = Ciphertext([1, 2, 3, 4])
+    expected = halevi_shoup.matrix_vector_multiply(packed, vector)
+    with open_packed(path) as mapped:
+        assert len(mapped.value) == 4
+        result = halevi_shoup.matrix_vector_multiply(mapped.value, vector)
+    assert result == expected
+
+
+def test_round_trip_grid(tmp_path):
+    path = tmp_path / "filters.pack"
+    filter = [[1, -2, 3], [400, 5, -6], [7, 8, 9]]
+    filters = siso_convolution.prepare_filters((4, 4), filter, 1)
+    header = save(path, filters)
+    assert header.shape == (3, 3)
+    assert header.dtype == "int16"
+
+    with open_packed(path) as mapped:
+        assert mapped.value[1][0] == filters[1][0]
+        assert mapped.value[-1][-1] == filters[2][2]
+        # Ciphertexts are read once.
+        assert mapped.value[1][0] is mapped.value[1][0]
+    assert load(path) == filters
+
+
+def test_round_trip_single_and_large_values(tmp_path):
+    path = tmp_path / "single.pack"
+    ct = Ciphertext([-(1 << 40), 0, 1 << 40, 5], depth=2)
+    assert save(path, ct).dtype == "int64"
+    loaded = load(path)
+    assert loaded == ct
+    assert loaded.depth == 2
+
+    with plaintext_modulus((1 << 64) - 59):
+        ct = Ciphertext([-1, 2])
+    assert save(path, ct).dtype == "uint64"
+    loaded = load(path)
+    assert loaded == ct
+    assert loaded.modulus == ct.modulus
+
+
+def test_invalid_files(tmp_path):
+    path = tmp_path / "bad.pack"
+    with pytest.raises(ValueError, match="64 bits"):
+        save(path, Ciphertext([1 << 70]))
+    with pytest.raises(ValueError, match="rectangular"):
+        save(path, [[Ciphertext([1])], [Ciphertext([1]), Ciphertext([2])]])
+
+    save(path, [Ciphertext([1, 2])], layout="row_major")
+    with pytest.raises(ValueError, match="Expected layout"):
+        load(path, layout="column_major")
+
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="bytes"):
+        load(path)
+    path.write_bytes(b"not a packed file")
+    with pytest.raises(ValueError, match="Not a packed"):
+        load(path)
+
+
+def test_stream_rows_from_file(tmp_path):
+    path = tmp_path / "matrix.bin"
+    matrix = [[i * 8 - j * 1000 for j in range(8)] for i in range(8)]
+    save_rows(path, matrix, dtype="int32")
+    assert list(iter_rows(path, 8, dtype="int32")) == matrix
+    assert list(iter_rows(path, 8, dtype="int32", offset=32 * 4)) == matrix[4:]
+
+    packed = halevi_shoup.pack_streaming(iter_rows(path, 8, dtype="int32"))
+    assert packed == halevi_shoup.pack(matrix)
+
+    with pytest.raises(ValueError, match="whole number"):
+        list(iter_rows(path, 3, dtype="int32"))
@@ -0,0 +1,141 @@
+"""An asyncio front end batching matrix-vector requests into ciphertexts.
+
+A matrix-vector multiplication of an n x n matrix by a single vector uses n
+slots, while a ciphertext typically has many more. MatVecServer collects the
+vectors of concurrent requests for a short window, packs them into disjoint
+slot ranges of one ciphertext, multiplies them all at once, and returns each
+caller its own product, so the rotations of the multiplication are shared
+by the whole batch (see halevi_shoup.matrix_vector_multiply_batched).
+
+A batch is run as soon as it is full, or once its oldest request has waited
+max_latency seconds.
+
+Example:
+
+    server = MatVecServer(matrix, num_slots=4096)
+    results = await asyncio.gather(*(server.multiply(v) for v in vectors))
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+import halevi_shoup
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    batches: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+
+class MatVecServer:
+    def __init__(
+        self,
+        matrix: list[list[int]],
+        num_slots: int,
+        max_batch_size: Optional[int] = None,
+        max_latency: float = 0.005,
+        executor=None,
+    ):
+        """A server multiplying the matrix by the vectors of requests.
+
+        Args:
+            matrix: the n x n matrix.
+            num_slots: the number of slots in a ciphertext, at least 2n.
+            max_batch_size: the most vectors multiplied at once, by default
+                as many as a ciphertext holds.
+            max_latency: the longest time in seconds a request waits for
+                others to join its batch.
+            executor: a concurrent.futures executor to run the multiplications
+                in, so that they do not block the event loop. By default,
+                they run in the event loop's default executor.
+        """
+        self.n = len(matrix)
+        capacity = halevi_shoup.batch_capacity(self.n, num_slots)
+        if max_batch_size is None:
+            max_batch_size = capacity
+        assert 0 < max_batch_size <= capacity, f"{max_batch_size=} > {capacity=}"
+
+        self.num_slots = num_slots
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.executor = executor
+        self.packed_matrix = halevi_shoup.pack_batched(matrix, num_slots)
+        self.stats = ServerStats()
+        self._pending: list[tuple[list[int], asyncio.Future]] = []
+        self._timer = None
+        # The running batches. The event loop only keeps weak references to
+        # tasks, so they are kept here until done.
+        self._tasks: set[asyncio.Task] = set()
+
+    async def multiply(self, vector: list[int]) -> list[int]:
+        """Return the product of the matrix and the vector."""
+        if len(vector) != self.n:
+            raise ValueError(f"Expected a vector of length {self.n}")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((vector, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_latency, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Start multiplying the pending requests, in batches."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Run the pending requests without waiting for more, and wait for
+        every running batch to finish."""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def __aenter__(self) -> "MatVecServer":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def _multiply(self, vectors: list[list[int]]) -> list[list[int]]:
+        packed = halevi_shoup.pack_vectors_batched(vectors, self.num_slots)
+        result = halevi_shoup.matrix_vector_multiply_batched(
+            self.packed_matrix, packed
+        )
+        return halevi_shoup.unpack_batched(result, self.n, len(vectors))
+
+    async def _run(self, batch: list[tuple[list[int], asyncio.Future]]) -> None:
+        self.stats.requests += len(batch)
+        self.stats.batches += 1
+        vectors = [vector for vector, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, self._multiply, vectors
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # The caller may have been cancelled while the batch ran.
+            if not future.done():
+                future.set_result(result)
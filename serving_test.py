@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from computational_model import count_ops
+from halevi_shoup import (
+    matrix_vector_multiply_batched,
+    pack_batched,
+    pack_vectors_batched,
+    unpack_batched,
+)
+from serving import MatVecServer
+
+N = 4
+MATRIX = [[(i * 3 + j * 5) % 7 - 3 for j in range(N)] for i in range(N)]
+
+
+def matvec(vector):
+    return [sum(MATRIX[i][j] * vector[j] for j in range(N)) for i in range(N)]
+
+
+def test_batched_kernel():
+    vectors = [[b + j for j in range(N)] for b in range(3)]
+    packed_matrix = pack_batched(MATRIX, num_slots=32)
+    packed_vectors = pack_vectors_batched(vectors, num_slots=32)
+    with count_ops() as counts:
+        result = matrix_vector_multiply_batched(packed_matrix, packed_vectors)
+    assert unpack_batched(result, N, 3) == [matvec(v) for v in vectors]
+    # The rotations are shared by the batch.
+    assert counts.rotations == N - 1
+
+
+def test_server_batches_concurrent_requests():
+    vectors = [[b * j - 2 for j in range(N)] for b in range(10)]
+
+    async def serve():
+        server = MatVecServer(MATRIX, num_slots=32, max_latency=0.01)
+        results = await asyncio.gather(*(server.multiply(v) for v in vectors))
+        return server, results
+
+    server, results = asyncio.run(serve())
+    assert results == [matvec(v) for v in vectors]
+    assert server.stats.requests == 10
+    # Up to 4 vectors fit in 32 slots.
+    assert server.stats.batches == 3
+    assert server.stats.mean_batch_size == 10 / 3
+
+
+def test_server_deadline():
+    async def serve():
+        server = MatVecServer(MATRIX, num_slots=64, max_batch_size=4, max_latency=0)
+        first = await server.multiply([1, 0, 0, 0])
+        second = await server.multiply([0, 1, 0, 0])
+        return server, first, second
+
+    server, first, second = asyncio.run(serve())
+    assert first == [row[0] for row in MATRIX]
+    assert second == [row[1] for row in MATRIX]
+    # Each request ran alone once its deadline passed.
+    assert server.stats.batches == 2
+
+
+def test_server_rejects_bad_requests():
+    with pytest.raises(AssertionError):
+        MatVecServer(MATRIX, num_slots=32, max_batch_size=5)
+
+    async def serve():
+        server = MatVecServer(MATRIX, num_slots=32)
+        await server.multiply([1, 2])
+
+    with pytest.raises(ValueError, match="length"):
+        asyncio.run(serve())
+
+
+def test_server_keeps_running_batches_until_closed():
+    async def serve():
+        async with MatVecServer(MATRIX, num_slots=32, max_latency=10) as server:
+            futures = [
+                asyncio.ensure_future(server.multiply([1, 0, 0, j]))
+                for j in range(4)
+            ]
+            # Let the requests fill a batch, which starts running.
+            await asyncio.sleep(0)
+            assert len(server._tasks) == 1
+        assert not server._tasks
+        return await asyncio.gather(*futures)
+
+    results = asyncio.run(serve())
+    assert results == [matvec([1, 0, 0, j]) for j in range(4)]
@@ -2,12 +2,15 @@
 
 from computational_model import Ciphertext
 from computational_model import is_power_of_two
+from computational_model import rotate_mac
+from computational_model import zeros_like
+from plaintext_cache import default_cache
+from profiling import profiled, span
 from util import (
     convolution_indices,
     flatten,
     map_matrix,
     pad_zeros,
-    print_as_square,
     zeros,
 )
 
@@ -22,8 +25,23 @@ def pack_rowwise(matrix):
     )
 
 
+@profiled()
 def prepare_filters(matrix_shape, filter, pad):
     """Construct punctured filters for SISO convolution."""
+    fn, fm = len(filter), len(filter[0])
+    punctured = default_cache.get(
+        "punctured_filter",
+        matrix_shape,
+        (tuple(map(tuple, filter)), pad),
+        lambda: _punctured_filters(matrix_shape, filter, pad),
+    )
+    return map_matrix(
+        punctured, lambda f: Ciphertext(list(f), original_shape=(fn, fm))
+    )
+
+
+def _punctured_filters(matrix_shape, filter, pad):
+    """Compute the slot values of the punctured filters, as nested tuples."""
     n, m = matrix_shape
     fn, fm = len(filter), len(filter[0])
     filters = [[zeros(matrix_shape) for _ in range(fm)] for _ in range(fn)]
@@ -35,32 +53,28 @@ def prepare_filters(matrix_shape, filter, pad):
             i, j = iter_index.combined_index
             filters[fi][fj][i][j] = filter[fi][fj]
 
-    ciphertexts = map_matrix(
-        filters, lambda f: Ciphertext(flatten(f), original_shape=(fn, fm))
-    )
-
+    punctured = []
     for i in range(fn):
+        punctured.append([])
         for j in range(fm):
             # The Gazelle paper's rotation is backwards from our convention:
             # their positive rotation rotates index 0 leftward, while we rotate
             # rightward, so we need to negate the rotation amount given to our
             # rotation function.
-            rotation = -m * (i - pad) - (j - pad)
-            ciphertexts[i][j] = ciphertexts[i][j].rotate(rotation)
-            print(f"Prepared filter for ({i}, {j}), rotated by {rotation}:")
-            print_as_square(ciphertexts[i][j])
+            rotation = (-m * (i - pad) - (j - pad)) % (n * m)
+            data = flatten(filters[i][j])
+            punctured[i].append(tuple(data[-rotation:] + data[:-rotation]))
 
-    return ciphertexts
+    return tuple(map(tuple, punctured))
 
 
+@profiled()
 def siso_convolution(packed_matrix, matrix_shape, prepared_filters, pad=1):
     """Apply the SISO convolution to the packed matrix."""
     nrows, ncols = matrix_shape
     filter_width, filter_height = prepared_filters[0][0].original_shape
 
-    output = Ciphertext(
-        [0] * len(packed_matrix.data), original_shape=packed_matrix.original_shape
-    )
+    output = zeros_like(packed_matrix)
     for i in range(filter_height):
         for j in range(filter_width):
             # The Gazelle paper's rotation is backwards from our convention:
@@ -68,10 +82,10 @@ def siso_convolution(packed_matrix, matrix_shape, prepared_filters, pad=1):
             # rightward, so we need to negate the rotation amount given to our
             # rotation function.
             rotation = -ncols * (i - pad) - (j - pad)
-            rotated = packed_matrix.rotate(rotation)
-            print(f"Rotated by {rotation} for filter index ({i}, {j}):")
-            print_as_square(rotated)
-            output += rotated * prepared_filters[i][j]
+            with span("rotate_multiply_accumulate"):
+                output = rotate_mac(
+                    output, packed_matrix, rotation, prepared_filters[i][j]
+                )
 
     return output
 
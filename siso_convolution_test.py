@@ -1,6 +1,7 @@
 import pytest
 from hypothesis import given
 from hypothesis.strategies import composite, integers, lists
+from computational_model import plaintext_modulus
 from util import flatten
 
 from siso_convolution import (
@@ -223,3 +224,30 @@ def test_4_by_4_with_3_by_3_filter(matrix, filter):
 #     matrix = [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12], [13, 14, 15, 16]]
 #     filter = [[-1, -2, -3], [-4, -5, -6], [-7, -8, -9]]
 #     run_test(matrix, filter, pack_rowwise, siso_convolution, pad=pad)
+
+
+def test_plaintext_modulus():
+    t = 97
+    matrix = [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12], [13, 14, 15, 16]]
+    filter = [[-1, -2, -3], [-4, -5, -6], [-7, -8, -9]]
+    with plaintext_modulus(t):
+        packed_matrix = pack_rowwise(matrix)
+        prepared_filters = prepare_filters((4, 4), filter, pad=1)
+        result = siso_convolution(packed_matrix, (4, 4), prepared_filters, pad=1)
+    expected = flatten(plaintext_convolution(matrix, filter, pad=1))
+    assert result.data == [x % t for x in expected]
+
+
+def test_plaintext_modulus_outside_context():
+    # The modulus is a property of the packed ciphertexts, not of the context
+    # the kernel runs in.
+    t = 97
+    matrix = [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12], [13, 14, 15, 16]]
+    filter = [[-1, -2, -3], [-4, -5, -6], [-7, -8, -9]]
+    with plaintext_modulus(t):
+        packed_matrix = pack_rowwise(matrix)
+        prepared_filters = prepare_filters((4, 4), filter, pad=1)
+    result = siso_convolution(packed_matrix, (4, 4), prepared_filters, pad=1)
+    assert result.modulus == t
+    expected = flatten(plaintext_convolution(matrix, filter, pad=1))
+    assert result.data == [x % t for x in expected]